@@ -0,0 +1,137 @@
+# =======================
+# AI response cache — LRU + TTL, optional SQLite tier, single-flight
+# =======================
+import json, re, time, sqlite3, hashlib, threading
+from collections import OrderedDict
+
+from metrics import log
+
+
+def normalize_text(text):
+    """Нормализация для ключа: регистр, ё/е, пробелы."""
+    text = (text or "").lower().replace("ё", "е")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def make_key(feature, *parts):
+    """Стабильный ключ кэша из фичи и произвольных (JSON-сериализуемых) частей."""
+    norm = [normalize_text(p) if isinstance(p, str) else p for p in parts]
+    raw = json.dumps([feature, norm], ensure_ascii=False, sort_keys=True)
+    return feature + ":" + hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+class _Flight:
+    __slots__ = ("done", "value")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+class ResponseCache:
+    """
+    Кэш ответов ИИ. get_or_compute() — single-flight: при N одновременных
+    одинаковых запросах compute() вызывается один раз, остальные ждут результат.
+    None не кэшируется (ошибка апстрима).
+    """
+
+    def __init__(self, max_items=2000, ttl=24 * 3600, disk_path=None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._mem = OrderedDict()   # key -> (expires_at, value)
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0}
+        self._db = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS ai_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+            self._db.execute("DELETE FROM ai_cache WHERE expires < ?", (time.time(),))
+
+    # ---------- tiers ----------
+    def _mem_get(self, key, now):
+        item = self._mem.get(key)
+        if item is None:
+            return None
+        if item[0] < now:
+            del self._mem[key]
+            return None
+        self._mem.move_to_end(key)
+        return item[1]
+
+    def _mem_put(self, key, value, expires):
+        self._mem[key] = (expires, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+
+    def _disk_get(self, key, now):
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT value, expires FROM ai_cache WHERE key = ?", (key,)).fetchone()
+        if not row or row[1] < now:
+            return None
+        return row[0], row[1]
+
+    def _disk_put(self, key, value, expires):
+        if self._db is None:
+            return
+        try:
+            self._db.execute("INSERT OR REPLACE INTO ai_cache(key, value, expires) VALUES (?, ?, ?)", (key, value, expires))
+        except Exception as e:
+            log("ai_cache_disk", error=e)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            v = self._mem_get(key, now)
+            if v is not None:
+                self.stats["hits"] += 1
+                return v
+            d = self._disk_get(key, now)
+            if d is not None:
+                self.stats["disk_hits"] += 1
+                self._mem_put(key, d[0], d[1])
+                return d[0]
+        return None
+
+    def put(self, key, value, ttl=None):
+        expires = time.time() + (ttl or self.ttl)
+        with self._lock:
+            self._mem_put(key, value, expires)
+            self._disk_put(key, value, expires)
+
+    # ---------- single-flight ----------
+    def get_or_compute(self, key, compute, ttl=None):
+        v = self.get(key)
+        if v is not None:
+            return v
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.stats["misses"] += 1
+            else:
+                self.stats["coalesced"] += 1
+        if not leader:
+            flight.done.wait()
+            return flight.value
+        try:
+            flight.value = compute()
+            if flight.value is not None:
+                self.put(key, flight.value, ttl)
+            return flight.value
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def summary(self):
+        with self._lock:
+            s = dict(self.stats)
+            s["size"] = len(self._mem)
+        total = s["hits"] + s["disk_hits"] + s["misses"] + s["coalesced"]
+        s["hit_rate"] = round((s["hits"] + s["disk_hits"] + s["coalesced"]) / total, 3) if total else 0.0
+        return s
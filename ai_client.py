@@ -0,0 +1,297 @@
+# =======================
+# OpenAI client — один пул соединений, лимиты по фичам, ретраи, circuit breaker
+# =======================
+import os, time, random, threading
+
+import httpx
+import openai
+from openai import OpenAI
+
+from metrics import timed, count_usage, OPENAI_ERRORS, STAGE_SECONDS
+from ai_routes import ROUTES, with_detail
+
+# Сколько одновременных запросов к OpenAI разрешено каждой фиче
+FEATURE_LIMITS = {
+    "vision": int(os.getenv("AI_LIMIT_VISION", "3")),
+    "list":   int(os.getenv("AI_LIMIT_LIST", "4")),
+    "recipe": int(os.getenv("AI_LIMIT_RECIPE", "3")),
+    "plan":   int(os.getenv("AI_LIMIT_PLAN", "2")),
+    "plan_day": int(os.getenv("AI_LIMIT_PLAN_DAY", "8")),
+    "pregen": int(os.getenv("AI_LIMIT_PREGEN", "2")),
+    "default": int(os.getenv("AI_LIMIT_DEFAULT", "4")),
+}
+# Дедлайн на весь вызов (ожидание слота + все попытки), сек
+FEATURE_DEADLINES = {
+    "vision": float(os.getenv("AI_DEADLINE_VISION", "45")),
+    "list":   float(os.getenv("AI_DEADLINE_LIST", "40")),
+    "recipe": float(os.getenv("AI_DEADLINE_RECIPE", "45")),
+    "plan":   float(os.getenv("AI_DEADLINE_PLAN", "90")),
+    "plan_day": float(os.getenv("AI_DEADLINE_PLAN_DAY", "40")),
+    "pregen": float(os.getenv("AI_DEADLINE_PREGEN", "120")),
+    "default": float(os.getenv("AI_DEADLINE_DEFAULT", "40")),
+}
+MAX_ATTEMPTS = int(os.getenv("AI_MAX_ATTEMPTS", "3"))
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+
+
+class AIError(Exception):
+    pass
+
+
+class CircuitOpen(AIError):
+    pass
+
+
+class DeadlineExceeded(AIError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    closed -> (threshold подряд ошибок) -> open -> (cooldown) -> half-open:
+    пропускаем один пробный запрос; успех закрывает, ошибка снова открывает.
+    allow() отдаёт пробе метку; проба без исхода (брошенный генератор) снимается
+    через release(метка), а зависшая — сама через probe_timeout.
+    """
+
+    def __init__(self, threshold=5, cooldown=30.0, probe_timeout=120.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.probe_timeout = probe_timeout
+        self._fails = 0
+        self._opened_at = None
+        self._probe = None        # monotonic выдачи пробы
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """False — нельзя; True — можно; float — можно, это проба (метка для release)."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at < self.cooldown:
+                return False
+            if self._probe is not None and now - self._probe < self.probe_timeout:
+                return False
+            self._probe = now
+            return now
+
+    def release(self, token):
+        """Проба закончилась без success()/failure() — пустить следующую."""
+        if token is True or not token:
+            return
+        with self._lock:
+            if self._probe == token:
+                self._probe = None
+
+    def success(self):
+        with self._lock:
+            self._fails = 0
+            self._opened_at = None
+            self._probe = None
+
+    def failure(self):
+        with self._lock:
+            self._fails += 1
+            if self._probe is not None or self._fails >= self.threshold:
+                self._opened_at = time.monotonic()
+            self._probe = None
+
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+
+BREAKER = CircuitBreaker(
+    threshold=int(os.getenv("AI_BREAKER_THRESHOLD", "5")),
+    cooldown=float(os.getenv("AI_BREAKER_COOLDOWN", "30")),
+    probe_timeout=float(os.getenv("AI_BREAKER_PROBE_TIMEOUT", "120")),
+)
+_SEMAPHORES = {name: threading.BoundedSemaphore(n) for name, n in FEATURE_LIMITS.items()}
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Единственный на процесс клиент OpenAI с keep-alive пулом httpx."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                pool = int(os.getenv("AI_HTTP_POOL", str(sum(FEATURE_LIMITS.values()) + 2)))
+                http = httpx.Client(
+                    limits=httpx.Limits(max_connections=pool, max_keepalive_connections=pool, keepalive_expiry=60),
+                    timeout=httpx.Timeout(60.0, connect=10.0),
+                )
+                _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", ""), http_client=http, max_retries=0)
+    return _client
+
+
+def _retryable(e):
+    if isinstance(e, (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError)):
+        return True
+    return isinstance(e, openai.APIStatusError) and e.status_code >= 500
+
+
+def _backoff(attempt, e=None):
+    # уважаем retry-after от апстрима, иначе full jitter
+    ra = None
+    resp = getattr(e, "response", None)
+    if resp is not None:
+        try: ra = float(resp.headers.get("retry-after"))
+        except (TypeError, ValueError): ra = None
+    if ra is not None:
+        return min(ra, BACKOFF_CAP)
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def complete(feature, messages, temperature=0.7, max_tokens=None, deadline=None, **extra):
+    """
+    Chat Completions с лимитом параллелизма фичи, дедлайном и ретраями.
+    Модель, detail картинок, потолок max_tokens и температуру задаёт маршрут фичи (ai_routes).
+    Возвращает объект ответа OpenAI; бросает AIError при неудаче.
+    """
+    sem = _SEMAPHORES.get(feature, _SEMAPHORES["default"])
+    timeout = deadline or FEATURE_DEADLINES.get(feature, FEATURE_DEADLINES["default"])
+    end = time.monotonic() + timeout
+    _check_slot(feature, sem, timeout)
+    t0, usage, probe = None, None, None
+    try:
+        route = ROUTES.pick(feature)
+        model = extra.pop("model", route.model)
+        temperature, max_tokens = route.params(temperature, max_tokens)
+        messages = with_detail(messages, route.detail)
+        probe = BREAKER.allow()
+        if not probe:
+            OPENAI_ERRORS.inc(feature=feature, kind="circuit_open")
+            raise CircuitOpen("openai circuit open")
+        t0 = time.perf_counter()
+        last = None
+        for attempt in range(MAX_ATTEMPTS):
+            left = end - time.monotonic()
+            if left <= 0.5:
+                break
+            try:
+                with timed("openai", feature):
+                    resp = get_client().with_options(timeout=left).chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        **extra,
+                    )
+                BREAKER.success()
+                usage = getattr(resp, "usage", None)
+                count_usage(feature, usage)
+                return resp
+            except Exception as e:
+                last = e
+                OPENAI_ERRORS.inc(feature=feature, kind=type(e).__name__)
+                if not _retryable(e):
+                    # 4xx — апстрим жив, ошибка в самом запросе
+                    BREAKER.success()
+                    raise AIError(f"{feature}: {e}") from e
+                pause = _backoff(attempt, e)
+                if time.monotonic() + pause >= end:
+                    break
+                time.sleep(pause)
+        BREAKER.failure()
+        OPENAI_ERRORS.inc(feature=feature, kind="gave_up")
+        raise DeadlineExceeded(f"{feature}: gave up after retries: {last}")
+    finally:
+        sem.release()
+        BREAKER.release(probe)
+        if t0 is not None:
+            ROUTES.observe(route, time.perf_counter() - t0, usage)
+
+
+def _check_slot(feature, sem, timeout):
+    """Открытый breaker или нет свободного слота фичи — сразу ошибка (и счётчик)."""
+    if BREAKER.state() == "open":
+        OPENAI_ERRORS.inc(feature=feature, kind="circuit_open")
+        raise CircuitOpen("openai circuit open")
+    if not sem.acquire(timeout=timeout):
+        OPENAI_ERRORS.inc(feature=feature, kind="no_slot")
+        raise DeadlineExceeded(f"{feature}: no free slot in {timeout:.0f}s")
+
+
+def chat(feature, messages, temperature=0.7, max_tokens=None, **kw):
+    """То же, что complete(), но возвращает только текст."""
+    resp = complete(feature, messages, temperature=temperature, max_tokens=max_tokens, **kw)
+    return (resp.choices[0].message.content or "").strip()
+
+
+def stream(feature, messages, temperature=0.7, max_tokens=None, deadline=None, **extra):
+    """
+    Потоковый вариант complete(): генератор текстовых дельт.
+    Повтор возможен только до первого токена — дальше ошибка пробрасывается.
+    """
+    sem = _SEMAPHORES.get(feature, _SEMAPHORES["default"])
+    timeout = deadline or FEATURE_DEADLINES.get(feature, FEATURE_DEADLINES["default"])
+    end = time.monotonic() + timeout
+    _check_slot(feature, sem, timeout)
+    t_start, usage, probe = None, None, None
+    try:
+        route = ROUTES.pick(feature)
+        model = extra.pop("model", route.model)
+        temperature, max_tokens = route.params(temperature, max_tokens)
+        messages = with_detail(messages, route.detail)
+        probe = BREAKER.allow()
+        if not probe:
+            OPENAI_ERRORS.inc(feature=feature, kind="circuit_open")
+            raise CircuitOpen("openai circuit open")
+        t_start = time.perf_counter()
+        last = None
+        for attempt in range(MAX_ATTEMPTS):
+            left = end - time.monotonic()
+            if left <= 0.5:
+                break
+            started = False
+            t0 = time.perf_counter()
+            try:
+                resp = get_client().with_options(timeout=left).chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **extra,
+                )
+                for chunk in resp:
+                    # usage приходит последним чанком, без choices
+                    if getattr(chunk, "usage", None) is not None:
+                        usage = chunk.usage
+                    count_usage(feature, getattr(chunk, "usage", None))
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        started = True
+                        yield delta
+                BREAKER.success()
+                STAGE_SECONDS.observe(time.perf_counter() - t0, stage="openai_stream", op=feature)
+                return
+            except Exception as e:
+                last = e
+                OPENAI_ERRORS.inc(feature=feature, kind=type(e).__name__)
+                if started or not _retryable(e):
+                    if _retryable(e): BREAKER.failure()
+                    else: BREAKER.success()
+                    raise AIError(f"{feature}: {e}") from e
+                pause = _backoff(attempt, e)
+                if time.monotonic() + pause >= end:
+                    break
+                time.sleep(pause)
+        BREAKER.failure()
+        OPENAI_ERRORS.inc(feature=feature, kind="gave_up")
+        raise DeadlineExceeded(f"{feature}: gave up after retries: {last}")
+    finally:
+        # сюда же попадает GeneratorExit, когда потребитель бросил поток на середине
+        sem.release()
+        BREAKER.release(probe)
+        if t_start is not None:
+            ROUTES.observe(route, time.perf_counter() - t_start, usage)
@@ -0,0 +1,181 @@
+# =======================
+# AI routes — модель, detail, бюджет токенов и температура по фичам; фолбэк при промахе SLO
+# =======================
+import os, json, threading
+from collections import deque
+
+from metrics import REGISTRY, log
+
+MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+FALLBACK_MODEL = os.getenv("AI_FALLBACK_MODEL", "gpt-4.1-nano")   # быстрее и дешевле основной
+MIN_TOKENS = 64
+WINDOW = 50          # последних вызовов на маршрут
+MIN_SAMPLES = 10     # меньше — статистике не верим
+PROBE_EVERY = 10     # в деградации каждый N-й вызов всё же идёт основным маршрутом
+QUANTILE = 0.9
+
+# Основной маршрут фичи; fallback — то, что меняется при промахе SLO (быстрее/дешевле).
+# slo — целевой p90 всего вызова, сек (0 — без SLO). temperature None — как передал вызывающий.
+# max_tokens — потолок; scale — доля от max_tokens вызывающего (его подсказки обычно ниже потолка,
+# так что урезать бюджет в фолбэке можно только через scale). Список не режем: строки — это ответ.
+# Переопределяются JSON-ом из AI_ROUTES (строка) или AI_ROUTES_PATH (файл), по полям.
+DEFAULT_ROUTES = {
+    "list":     {"max_tokens": 900,  "temperature": None, "slo": 10,
+                 "fallback": {"model": FALLBACK_MODEL}},
+    "recipe":   {"max_tokens": 1000, "temperature": None, "slo": 15,
+                 "fallback": {"model": FALLBACK_MODEL, "max_tokens": 650, "scale": 0.75}},
+    "plan":     {"max_tokens": 2200, "temperature": None, "slo": 45,
+                 "fallback": {"model": FALLBACK_MODEL, "max_tokens": 1500, "scale": 0.75}},
+    "plan_day": {"max_tokens": 600,  "temperature": None, "slo": 15,
+                 "fallback": {"model": FALLBACK_MODEL, "max_tokens": 450, "scale": 0.75}},
+    "pregen":   {"max_tokens": 600,  "temperature": None, "slo": 0},
+    "vision":   {"max_tokens": 700,  "temperature": None, "detail": "auto", "slo": 15,
+                 "fallback": {"max_tokens": 450, "detail": "low", "scale": 0.65}},
+    "default":  {"max_tokens": 800,  "temperature": None, "slo": 0},
+}
+
+ROUTE_DECISIONS = REGISTRY.counter("bot_ai_route_total", "AI route chosen per call", ("feature", "route", "reason"))
+ROUTE_SECONDS = REGISTRY.histogram("bot_ai_route_seconds", "Whole AI call latency per route", ("feature", "route"))
+ROUTE_TOKENS = REGISTRY.counter("bot_ai_route_tokens_total", "OpenAI tokens per route and model",
+                                ("feature", "route", "model", "kind"))
+
+
+class Route:
+    __slots__ = ("feature", "name", "model", "max_tokens", "temperature", "detail", "slo", "scale")
+
+    def __init__(self, feature, name, model=MODEL, max_tokens=800, temperature=None, detail=None, slo=0, scale=1.0):
+        self.feature = feature
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.detail = detail
+        self.slo = slo
+        self.scale = scale
+
+    def params(self, temperature, max_tokens):
+        """(temperature, max_tokens) запроса: max_tokens вызывающего × scale, не выше потолка маршрута."""
+        t = temperature if self.temperature is None else self.temperature
+        want = int(max_tokens * self.scale) if max_tokens else self.max_tokens
+        return t, max(MIN_TOKENS, min(want, self.max_tokens))
+
+
+class _Stats:
+    __slots__ = ("lat", "calls")
+
+    def __init__(self):
+        self.lat = deque(maxlen=WINDOW)
+        self.calls = 0
+
+    def quantile(self, q=QUANTILE):
+        if len(self.lat) < MIN_SAMPLES:
+            return None
+        xs = sorted(self.lat)
+        return xs[min(len(xs) - 1, int(q * len(xs)))]
+
+
+def load_config():
+    cfg = {k: dict(v) for k, v in DEFAULT_ROUTES.items()}
+    raw = os.getenv("AI_ROUTES", "")
+    path = os.getenv("AI_ROUTES_PATH", "")
+    try:
+        if path:
+            with open(path, encoding="utf-8") as f:
+                raw = f.read()
+        for feature, over in (json.loads(raw) if raw else {}).items():
+            cfg.setdefault(feature, {}).update(over)
+    except (OSError, ValueError) as e:
+        log("ai_routes_config", error=e)
+    return cfg
+
+
+class RouteTable:
+    """
+    Маршрут на вызов: основной, пока его p90 за последние WINDOW вызовов укладывается в slo;
+    иначе fallback (проба основного — каждый PROBE_EVERY-й вызов, чтобы заметить восстановление).
+    Решения и задержки — в метриках bot_ai_route_*, смены режима — в лог.
+    """
+
+    def __init__(self, config):
+        self._routes = {}   # feature -> (primary, fallback | None)
+        for feature, c in config.items():
+            base = {k: c[k] for k in ("model", "max_tokens", "temperature", "detail", "slo", "scale") if k in c}
+            primary = Route(feature, "primary", **base)
+            fallback = None
+            if c.get("fallback"):
+                fb = dict(base, **{k: v for k, v in c["fallback"].items() if k != "slo"})
+                fallback = Route(feature, "fallback", **fb)
+            self._routes[feature] = (primary, fallback)
+        self._stats = {}
+        self._degraded = set()
+        self._lock = threading.Lock()
+
+    def _stat(self, route):
+        key = (route.feature, route.name)
+        s = self._stats.get(key)
+        if s is None:
+            s = self._stats[key] = _Stats()
+        return s
+
+    def pick(self, feature):
+        primary, fallback = self._routes.get(feature) or self._routes["default"]
+        with self._lock:
+            st = self._stat(primary)
+            st.calls += 1
+            if fallback is None or not primary.slo or primary.feature not in self._degraded:
+                route, reason = primary, "primary"
+            elif st.calls % PROBE_EVERY == 0:
+                route, reason = primary, "probe"
+            else:
+                route, reason = fallback, "slo_miss"
+        ROUTE_DECISIONS.inc(feature=feature, route=route.name, reason=reason)
+        return route
+
+    def observe(self, route, seconds, usage=None):
+        """Задержка всего вызова (с ретраями; ошибка — тоже промах) и токены маршрута."""
+        ROUTE_SECONDS.observe(seconds, feature=route.feature, route=route.name)
+        if usage is not None:
+            for kind in ("prompt", "completion"):
+                n = getattr(usage, kind + "_tokens", 0) or 0
+                ROUTE_TOKENS.inc(n, feature=route.feature, route=route.name, model=route.model, kind=kind)
+        if route.name != "primary" or not route.slo:
+            return
+        with self._lock:
+            st = self._stat(route)
+            st.lat.append(seconds)
+            p = st.quantile()
+            if p is None:
+                return
+            was = route.feature in self._degraded
+            now = p > route.slo
+            if now == was:
+                return
+            (self._degraded.add if now else self._degraded.discard)(route.feature)
+        log("ai_route_degraded" if now else "ai_route_recovered", feature=route.feature,
+            p90=round(p, 2), slo=route.slo)
+
+    def state(self):
+        """{feature: (degraded, p90)} — для /metrics."""
+        with self._lock:
+            return {f: (f in self._degraded, self._stats[(f, "primary")].quantile() if (f, "primary") in self._stats else None)
+                    for f in self._routes}
+
+
+ROUTES = RouteTable(load_config())
+REGISTRY.gauge("bot_ai_route_degraded", "1 when a feature runs on its fallback route", lambda: {
+    (f,): int(d) for f, (d, _) in ROUTES.state().items()}, ("feature",))
+
+
+def with_detail(messages, detail):
+    """Копия messages с detail у всех image_url (None — как есть)."""
+    if not detail:
+        return messages
+    out = []
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, list):
+            content = [dict(p, image_url=dict(p["image_url"], detail=detail)) if p.get("type") == "image_url" else p
+                       for p in content]
+            m = dict(m, content=content)
+        out.append(m)
+    return out
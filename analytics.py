@@ -0,0 +1,161 @@
+# =======================
+# Analytics — счётчики для админки, обновляются при записи (без сканов БД)
+# =======================
+import sqlite3, threading, time, atexit
+from datetime import date, datetime, timedelta, timezone
+
+from metrics import log
+
+FEATURES = ("photo", "list", "recipe", "plan")
+TRACKED_FIELDS = frozenset(("created_at", "sex", "goal"))
+
+
+def _day(d=None):
+    return (d or date.today()).isoformat()
+
+
+def _local_day(utc_iso):
+    """Местный день по created_at (UTC без зоны) — тот же календарь, что у _day() и seen."""
+    try:
+        return _day(datetime.fromisoformat(utc_iso).replace(tzinfo=timezone.utc).astimezone().date())
+    except ValueError:
+        return utc_iso[:10]
+
+
+class Analytics:
+    """
+    Счётчики в памяти + пакетный сброс в SQLite (как Storage).
+    Ключи: users, new:<день>, seen:<день>, sex:<v>, goal:<v>, feature:<f>, feature:<f>:<день>.
+    Все дни — местные (_day), в том числе new:<день> из UTC-шного created_at.
+    seen:<день> — не «заходы за день», а число юзеров, чей последний день активности — этот:
+    при новом заходе юзер переезжает из seen:<прошлый> в seen:<сегодня>. Поэтому каждый юзер
+    лежит ровно в одном seen-ключе, и WAU (сумма seen за 7 дней) — уникальные юзеры без
+    повторов; DAU = seen:<сегодня>. Оба считаются за O(1).
+    """
+
+    def __init__(self, path, flush_interval=2.0):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, n INTEGER NOT NULL)")
+        self._lock = threading.Lock()
+        self._counters = dict(self._conn.execute("SELECT key, n FROM counters"))
+        self._dirty = set()
+        self._seen_day = _day()
+        self._seen_today = set()    # uid, уже отмеченные сегодня в этом процессе
+        self._stop = threading.Event()
+        threading.Thread(target=self._flush_loop, args=(flush_interval,), name="analytics-flush", daemon=True).start()
+        atexit.register(self.close)
+
+    # ---------- запись ----------
+    def _add(self, key, n=1):
+        # вызывать под self._lock
+        self._counters[key] = self._counters.get(key, 0) + n
+        self._dirty.add(key)
+
+    def empty(self):
+        with self._lock:
+            return not self._counters
+
+    def rebuild(self, users):
+        """Однократное заполнение из существующих пользователей (первый запуск)."""
+        with self._lock:
+            for u in users:
+                self._add("users")
+                if u.get("created_at"):
+                    self._add("new:" + _local_day(u["created_at"]))
+                if u.get("last_seen"):
+                    self._add("seen:" + u["last_seen"])
+                for k in ("sex", "goal"):
+                    if u.get(k):
+                        self._add(f"{k}:{u[k]}")
+            self._add("rebuilt_at", int(time.time()))
+
+    def user_changed(self, old, data):
+        """old — запись до изменения, data — новые поля (см. TRACKED_FIELDS)."""
+        with self._lock:
+            if data.get("created_at") and not old.get("created_at"):
+                self._add("users")
+                self._add("new:" + _local_day(data["created_at"]))
+            for k in ("sex", "goal"):
+                if k in data and data[k] != old.get(k):
+                    if old.get(k):
+                        self._add(f"{k}:{old[k]}", -1)
+                    self._add(f"{k}:{data[k]}")
+
+    def seen_today(self, uid):
+        """True, если юзер уже отмечен сегодня (без обращения к БД)."""
+        today = _day()
+        with self._lock:
+            if today != self._seen_day:
+                self._seen_day, self._seen_today = today, set()
+            return uid in self._seen_today
+
+    def active(self, uid, last_seen):
+        """Первое действие юзера за день; last_seen — его прошлый день активности. Возвращает сегодняшний день."""
+        today = _day()
+        with self._lock:
+            self._seen_today.add(uid)
+            if last_seen != today:
+                if last_seen:
+                    self._add("seen:" + last_seen, -1)
+                self._add("seen:" + today)
+        return today
+
+    def feature(self, name):
+        with self._lock:
+            self._add("feature:" + name)
+            self._add(f"feature:{name}:{_day()}")
+
+    # ---------- чтение ----------
+    def get(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def summary(self):
+        today = date.today()
+        days = [_day(today - timedelta(days=i)) for i in range(7)]
+        with self._lock:
+            c = self._counters.get
+            return {
+                "users": c("users", 0),
+                "new_today": c("new:" + days[0], 0),
+                "new_yesterday": c("new:" + days[1], 0),
+                "new_7d": sum(c("new:" + d, 0) for d in days),
+                "dau": c("seen:" + days[0], 0),
+                "wau": sum(c("seen:" + d, 0) for d in days),
+                "sex": {v: c("sex:" + v, 0) for v in ("male", "female")},
+                "goal": {v: c("goal:" + v, 0) for v in ("cut", "maintain", "bulk")},
+                "features": {f: (c("feature:" + f, 0), c(f"feature:{f}:{days[0]}", 0)) for f in FEATURES},
+            }
+
+    # ---------- write-behind ----------
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            rows = [(k, self._counters[k]) for k in self._dirty]
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO counters(key, n) VALUES (?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._dirty.clear()
+
+    def _flush_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+            except Exception as e:
+                log("analytics_flush", error=e)
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception as e:
+            log("analytics_flush", error=e)
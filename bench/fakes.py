@@ -0,0 +1,276 @@
+# =======================
+# Локальные заглушки Bot API и OpenAI Chat Completions для нагрузочных прогонов
+# =======================
+import io, json, time, random, re, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class Faults:
+    """Задержка (среднее, сек; фактическая — равномерно 0.5x..1.5x) и доля ошибок."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        if self.latency > 0:
+            with self._lock:
+                k = self._rnd.uniform(0.5, 1.5)
+            time.sleep(self.latency * k)
+
+    def fail(self):
+        if self.error_rate <= 0:
+            return False
+        with self._lock:
+            return self._rnd.random() < self.error_rate
+
+
+class _Server:
+    handler_cls = None
+
+    def __init__(self, faults=None, host="127.0.0.1", port=0):
+        self.faults = faults or Faults()
+        self.calls = {}          # метод -> число вызовов
+        self.errors = 0
+        self._lock = threading.Lock()
+        handler = type("Handler", (self.handler_cls,), {"server_ref": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, name, error=False):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if error:
+                self.errors += 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, как у настоящих API
+    server_ref = None
+
+    def log_message(self, *a):
+        pass
+
+    def _body(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(n) if n else b""
+
+    def _send(self, code, payload, content_type="application/json"):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# ---------- Telegram Bot API ----------
+class _TelegramHandler(_Handler):
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def _params(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body = self._body()
+        ctype = self.headers.get("Content-Type", "")
+        if body and "json" in ctype:
+            params.update(json.loads(body))
+        elif body and "x-www-form-urlencoded" in ctype:
+            params.update({k: v[-1] for k, v in parse_qs(body.decode()).items()})
+        return url.path, params
+
+    def _dispatch(self):
+        srv = self.server_ref
+        path, params = self._params()
+        if path.startswith("/file/"):
+            srv.count("file")
+            srv.faults.delay()
+            return self._send(200, srv.file_bytes(path), "image/jpeg")
+        method = path.rsplit("/", 1)[-1]
+        srv.faults.delay()
+        if srv.faults.fail():
+            srv.count(method, error=True)
+            if random.random() < 0.5:
+                return self._send(429, {"ok": False, "error_code": 429,
+                                        "description": "Too Many Requests: retry after 1",
+                                        "parameters": {"retry_after": 1}})
+            return self._send(500, {"ok": False, "error_code": 500, "description": "Internal Server Error"})
+        srv.count(method)
+        return self._send(200, {"ok": True, "result": srv.result(method, params)})
+
+
+class FakeTelegram(_Server):
+    """
+    Bot API на localhost: sendMessage / editMessageText / deleteMessage / getFile /
+    скачивание файла; остальные методы отвечают True.
+    """
+    handler_cls = _TelegramHandler
+
+    def __init__(self, faults=None, photo_size=(1280, 960), **kw):
+        super().__init__(faults, **kw)
+        self.photo_size = photo_size
+        self._msg_id = 0
+        self._files = {}
+
+    def api_url(self):
+        return self.url + "/bot{0}/{1}"
+
+    def file_url(self):
+        return self.url + "/file/bot{0}/{1}"
+
+    def _message(self, params):
+        with self._lock:
+            self._msg_id += 1
+            mid = self._msg_id
+        chat_id = int(params.get("chat_id", 0) or 0)
+        return {"message_id": int(params.get("message_id") or mid), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")}
+
+    def result(self, method, params):
+        if method in ("sendMessage", "editMessageText", "sendPhoto"):
+            return self._message(params)
+        if method == "getFile":
+            fid = params.get("file_id", "f")
+            return {"file_id": fid, "file_unique_id": fid, "file_size": 150000, "file_path": f"photos/{fid}.jpg"}
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        if method == "getUpdates":
+            return []
+        return True
+
+    def file_bytes(self, path):
+        """Детерминированный JPEG на каждый file_path (шум + градиент — не сжимается в ноль)."""
+        with self._lock:
+            data = self._files.get(path)
+        if data is not None:
+            return data
+        from PIL import Image
+        rnd = random.Random(path)
+        w, h = self.photo_size
+        img = Image.effect_noise((w, h), 40 + rnd.random() * 40).convert("RGB")
+        img = Image.blend(img, Image.linear_gradient("L").resize((w, h)).convert("RGB"), 0.5)
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=90)
+        data = buf.getvalue()
+        with self._lock:
+            self._files[path] = data
+        return data
+
+
+# ---------- OpenAI ----------
+_DAY_RE = re.compile(r"Цель на день:\s*(\d+)\s*ккал")
+_FILLER = (
+    "Куриная грудка 150 г, рис 80 г, овощи 200 г — около 520 ккал, Б/Ж/У 45/9/62. "
+    "Готовить на сковороде без масла, рис отварить заранее. "
+)
+
+
+_MEAL = {"n": "Обед", "d": "курица 150 г, гречка 70 г", "k": 600, "p": 45, "f": 15, "c": 60}
+
+
+# задача prompts.* — по схеме в system-сообщении (week проверяем раньше day: в ней схема дня)
+_JSON_TASKS = (('"d":[', "week"), ('"items"', "list"), ('"t":', "recipe"), ('"m":[', "day"))
+
+
+def fake_json(task, prompt):
+    """Ответ в схемах prompts.SCHEMAS; prompt — пользовательское сообщение."""
+    lines = [ln for ln in prompt.splitlines() if ln.strip()]
+    if task == "list":
+        return {"items": [{"n": it, "g": 100, "k": 150, "p": 10, "f": 5, "c": 15} for it in lines or ["продукт"]]}
+    if task == "recipe":
+        return {"t": "Курица с овощами", "i": [["курица", "150 г"], ["овощи", "200 г"]],
+                "s": ["Нарезать", "Запечь 25 минут"], "k": 520, "p": 45, "f": 18, "c": 30, "tip": "курицу — на индейку"}
+    day = {"m": [dict(_MEAL, n=n) for n in ("Завтрак", "Обед", "Ужин")]}
+    return {"d": [day] * 7} if task == "week" else day
+
+
+def fake_answer(messages, max_tokens, json_mode=False):
+    """Правдоподобный ответ под промпт: JSON по схеме, день плана с «Итого», строки «… | … |» или текст."""
+    if json_mode and len(messages) > 1:
+        system = str(messages[0].get("content") or "")
+        task = next((t for marker, t in _JSON_TASKS if marker in system), None)
+        if task:
+            return json.dumps(fake_json(task, str(messages[-1].get("content") or "")), ensure_ascii=False)
+    prompt = ""
+    for m in messages:
+        c = m.get("content")
+        prompt += c if isinstance(c, str) else " ".join(p.get("text", "") for p in c if isinstance(p, dict))
+    day = _DAY_RE.search(prompt)
+    if day:
+        kcal = day.group(1)
+        return ("- Завтрак: овсянка 60 г, ягоды 100 г (300 ккал)\n- Обед: курица 150 г, гречка 70 г (600 ккал)\n"
+                "- Ужин: рыба 150 г, овощи 250 г (450 ккал)\n"
+                f"Итого за день: {kcal} ккал, Б/Ж/У 130/60/200")
+    if "название | граммы" in prompt:
+        items = [ln for ln in prompt.splitlines()[3:] if ln.strip()] or ["продукт"]
+        return "\n".join(f"{it} | 100 | 150 | 10 | 5 | 15" for it in items)
+    n = max(1, min(max_tokens * 3, 1800) // len(_FILLER))
+    return "<b>Ответ</b>\n" + _FILLER * n
+
+
+class _OpenAIHandler(_Handler):
+    def do_POST(self):
+        srv = self.server_ref
+        req = json.loads(self._body() or b"{}")
+        srv.faults.delay()
+        if srv.faults.fail():
+            srv.count("chat.completions", error=True)
+            return self._send(500, {"error": {"message": "fake upstream error", "type": "server_error"}})
+        srv.count("chat.completions")
+        text = fake_answer(req.get("messages", []), req.get("max_tokens") or 800,
+                           json_mode=(req.get("response_format") or {}).get("type") == "json_object")
+        usage = {"prompt_tokens": len(json.dumps(req.get("messages", []), ensure_ascii=False)) // 4,
+                 "completion_tokens": len(text) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        base = {"id": "chatcmpl-bench", "created": int(time.time()), "model": req.get("model", "fake")}
+        if not req.get("stream"):
+            return self._send(200, {**base, "object": "chat.completion", "usage": usage, "choices": [
+                {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}]})
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk = {**base, "object": "chat.completion.chunk"}
+        for i in range(0, len(text), 24):
+            self._chunk(dict(chunk, choices=[{"index": 0, "delta": {"content": text[i:i + 24]}, "finish_reason": None}]))
+            if srv.token_delay:
+                time.sleep(srv.token_delay)
+        if (req.get("stream_options") or {}).get("include_usage"):
+            self._chunk(dict(chunk, choices=[], usage=usage))
+        self._raw(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _chunk(self, obj):
+        self._raw(b"data: " + json.dumps(obj, ensure_ascii=False).encode() + b"\n\n")
+
+    def _raw(self, b):
+        self.wfile.write(b"%X\r\n%s\r\n" % (len(b), b))
+
+
+class FakeOpenAI(_Server):
+    """/v1/chat/completions (обычный и stream=True); token_delay — пауза между чанками."""
+    handler_cls = _OpenAIHandler
+
+    def __init__(self, faults=None, token_delay=0.0, **kw):
+        super().__init__(faults, **kw)
+        self.token_delay = token_delay
+
+    def base_url(self):
+        return self.url + "/v1"
@@ -0,0 +1,274 @@
+# =======================
+# Нагрузочный прогон без сети: Flask app + фейковые Bot API и OpenAI (bench/fakes.py).
+# Гоняет смесь сценариев (меню, анкета, список, фото, рецепт, рассылка) и печатает
+# пропускную способность, p50/p95/p99 по этапам и прирост файлов БД.
+#   python bench/loadtest.py --users 200 --updates 5000 --concurrency 32 --ai-latency 0.8
+#   python bench/loadtest.py ... --json bench_result.json   # для сравнения между коммитами
+# =======================
+import os, sys, json, time, random, argparse, tempfile, threading
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import Faults, FakeTelegram, FakeOpenAI
+
+ADMIN_ID = 1
+SECRET = "bench"
+
+# Сценарий — последовательность сообщений одного пользователя; "📷" — фото
+SCENARIOS = {
+    "menu": ["/start", "👨‍🍳 Рецепты от ИИ", "⬅️ Назад"],
+    "profile": ["📅 Меню на неделю", "👨 Мужчина", "178", "74", "Похудение", "📅 Меню на неделю"],
+    "list": ["🧾 КБЖУ по списку", "Куриная грудка 150 г; рис 100 г; оливковое масло 1 ст.л."],
+    "list_ai": ["🧾 КБЖУ по списку", "гречка 80 г, соус терияки 30 г, кимчи 50 г"],
+    "photo": ["📸 КБЖУ по фото", "📷"],
+    "recipe": ["🍽 Рецепт по запросу", "блинчики без сахара"],
+    "broadcast": ["🛠 Админ-панель", "📣 Рассылка", "Бенч: тестовая рассылка"],
+}
+DEFAULT_MIX = "menu=5,profile=2,list=3,list_ai=1,photo=3,recipe=2,broadcast=0"
+
+
+def percentiles(xs):
+    if not xs:
+        return {"n": 0}
+    xs = sorted(xs)
+    pick = lambda q: xs[min(len(xs) - 1, int(q * len(xs)))]
+    return {"n": len(xs), "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": xs[-1]}
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, w = part.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f"unknown scenario: {name}")
+        mix[name.strip()] = float(w or 1)
+    return mix
+
+
+def setup_env(args, tmp, tg, oai):
+    os.environ.update({
+        "TELEGRAM_TOKEN": "123456:bench",
+        "WEBHOOK_SECRET": SECRET,
+        "ADMIN_IDS": str(ADMIN_ID),
+        "DB_PATH": os.path.join(tmp, "db.sqlite3"),
+        "AI_CACHE_PATH": os.path.join(tmp, "ai_cache.sqlite3"),
+        "PLAN_LIBRARY_PATH": os.path.join(tmp, "plans.sqlite3"),
+        "FLOW_DB_PATH": os.path.join(tmp, "flows.sqlite3"),
+        "OPENAI_API_KEY": "sk-bench",
+        "OPENAI_BASE_URL": oai.base_url(),
+        "BROADCAST_RATE": str(args.broadcast_rate),
+        "STREAM_EDIT_INTERVAL": "0.2",
+    })
+    os.chdir(tmp)  # db.json и прочие относительные пути — во временной папке
+
+
+class Recorder:
+    """Времена: вебхук (POST), апдейт (POST -> хендлер отработал), фоновая задача (submit -> готово)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.webhook, self.update = [], []
+        self.jobs = {}       # имя задачи -> [сек]
+        self.statuses = {}   # HTTP-код вебхука -> число
+        self.posted = {}     # update_id -> время POST
+
+    def add(self, bucket, value):
+        with self.lock:
+            bucket.append(value)
+
+    def job(self, name, value):
+        with self.lock:
+            self.jobs.setdefault(name, []).append(value)
+
+    def status(self, code):
+        with self.lock:
+            self.statuses[code] = self.statuses.get(code, 0) + 1
+
+
+def instrument(app_bot, rec):
+    inner = app_bot.UPDATES.handler
+
+    def handler(upd):
+        try:
+            inner(upd)
+        finally:
+            t0 = rec.posted.pop(upd.update_id, None)
+            if t0 is not None:
+                rec.add(rec.update, time.perf_counter() - t0)
+    app_bot.UPDATES.handler = handler
+
+    submit = app_bot.JOBS.submit
+
+    def timed_submit(owner, fn, *a, **kw):
+        t0, name = time.perf_counter(), getattr(fn, "__name__", "job")
+        if fn is app_bot._journaled:   # (key, target, ...) — меряем по самой задаче
+            name = a[1].__name__
+
+        def run(*fa, **fkw):
+            try:
+                return fn(*fa, **fkw)
+            finally:
+                rec.job(name, time.perf_counter() - t0)
+        run.__name__ = name
+        return submit(owner, run, *a, **kw)
+    app_bot.JOBS.submit = timed_submit
+
+
+def make_update(uid, update_id, text, photo_id=None):
+    msg = {"message_id": update_id, "date": int(time.time()),
+           "chat": {"id": uid, "type": "private"},
+           "from": {"id": uid, "is_bot": False, "first_name": f"u{uid}", "username": f"u{uid}"}}
+    if photo_id:
+        msg["photo"] = [{"file_id": photo_id, "file_unique_id": photo_id, "width": 1280, "height": 960, "file_size": 150000}]
+    else:
+        msg["text"] = text
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return {"update_id": update_id, "message": msg}
+
+
+def files_size(tmp):
+    return {f: os.path.getsize(os.path.join(tmp, f)) for f in sorted(os.listdir(tmp)) if os.path.isfile(os.path.join(tmp, f))}
+
+
+def wait_drained(app_bot, timeout):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        js = app_bot.JOBS.stats()
+        if not app_bot.UPDATES.depth() and not js["backlog"] and not js["active"] and not app_bot.BROADCAST.running():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--updates", type=int, default=3000, help="сколько апдейтов отправить всего")
+    ap.add_argument("--concurrency", type=int, default=32, help="параллельных «пользователей» в полёте")
+    ap.add_argument("--mix", default=DEFAULT_MIX)
+    ap.add_argument("--photo-pool", type=int, default=50, help="различных фото (повторы бьют в кэш)")
+    ap.add_argument("--tg-latency", type=float, default=0.03)
+    ap.add_argument("--tg-errors", type=float, default=0.0)
+    ap.add_argument("--ai-latency", type=float, default=0.8, help="до первого токена, сек")
+    ap.add_argument("--ai-token-delay", type=float, default=0.005, help="пауза между stream-чанками, сек")
+    ap.add_argument("--ai-errors", type=float, default=0.0)
+    ap.add_argument("--broadcast-rate", type=float, default=500)
+    ap.add_argument("--drain-timeout", type=float, default=300)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", help="записать результат в файл")
+    args = ap.parse_args()
+
+    rnd = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    tg = FakeTelegram(Faults(args.tg_latency, args.tg_errors, args.seed)).start()
+    oai = FakeOpenAI(Faults(args.ai_latency, args.ai_errors, args.seed), token_delay=args.ai_token_delay).start()
+    tmp = tempfile.mkdtemp(prefix="loadtest-")
+    setup_env(args, tmp, tg, oai)
+
+    from telebot import apihelper
+    import bot as app_bot
+    apihelper.API_URL = tg.api_url()
+    apihelper.FILE_URL = tg.file_url()
+
+    rec = Recorder()
+    instrument(app_bot, rec)
+    client_local = threading.local()
+    counter = {"id": 0}
+    id_lock = threading.Lock()
+    before = files_size(tmp)
+
+    def post(uid, text, photo):
+        with id_lock:
+            counter["id"] += 1
+            upd_id = counter["id"]
+        client = getattr(client_local, "c", None) or app_bot.app.test_client()
+        client_local.c = client
+        rec.posted[upd_id] = t0 = time.perf_counter()
+        r = client.post(f"/tg/{SECRET}", json=make_update(uid, upd_id, text, photo if text == "📷" else None),
+                        headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+        rec.add(rec.webhook, time.perf_counter() - t0)
+        rec.status(r.status_code)
+        if r.status_code != 200:
+            rec.posted.pop(upd_id, None)
+
+    # очередь сессий: (uid, сценарий); пользователь проходит сценарий целиком, по порядку
+    names, weights = list(mix), list(mix.values())
+    sessions, total = [], 0
+    while total < args.updates:
+        name = rnd.choices(names, weights)[0]
+        uid = ADMIN_ID if name == "broadcast" else rnd.randrange(1000, 1000 + args.users)
+        sessions.append((uid, name, f"ph{rnd.randrange(args.photo_pool)}"))
+        total += len(SCENARIOS[name])
+    user_locks = {}
+
+    def run_session(s):
+        uid, name, photo = s
+        lock = user_locks.setdefault(uid, threading.Lock())
+        with lock:   # один пользователь не шлёт два сценария вперемешку
+            for text in SCENARIOS[name]:
+                post(uid, text, photo)
+
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(run_session, sessions))
+    t_sent = time.perf_counter()
+    drained = wait_drained(app_bot, args.drain_timeout)
+    t_end = time.perf_counter()
+    app_bot.DB.flush()
+    after = files_size(tmp)
+
+    sent = sum(len(SCENARIOS[n]) for _, n, _ in sessions)
+    result = {
+        "args": vars(args),
+        "updates": sent,
+        "drained": drained,
+        "seconds": {"send": round(t_sent - t_start, 3), "total": round(t_end - t_start, 3)},
+        "throughput_ups": round(sent / (t_end - t_start), 1),
+        "webhook_s": percentiles(rec.webhook),
+        "update_s": percentiles(rec.update),
+        "webhook_status": rec.statuses,
+        "jobs_s": {k: percentiles(v) for k, v in sorted(rec.jobs.items())},
+        "telegram_calls": dict(sorted(tg.calls.items())),
+        "telegram_errors": tg.errors,
+        "openai_calls": oai.calls.get("chat.completions", 0),
+        "openai_errors": oai.errors,
+        "ai_cache": app_bot.AI_CACHE.summary(),
+        "db_bytes": {"before": before, "after": after,
+                     "growth": sum(after.values()) - sum(before.values()),
+                     "users": app_bot.DB.user_count()},
+    }
+    print_report(result)
+    if args.json:
+        with open(os.path.join(ROOT, args.json) if not os.path.isabs(args.json) else args.json, "w") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    app_bot.UPDATES.stop(drain=False, timeout=1)
+    app_bot.DB.close()
+    tg.stop(); oai.stop()
+
+
+def _ms(p):
+    if not p.get("n"):
+        return "—"
+    return f"n={p['n']:<6} p50={p['p50'] * 1e3:8.1f}  p95={p['p95'] * 1e3:8.1f}  p99={p['p99'] * 1e3:8.1f}  max={p['max'] * 1e3:8.1f} ms"
+
+
+def print_report(r):
+    print(f"updates: {r['updates']}  drained: {r['drained']}  wall: {r['seconds']['total']} s "
+          f"(send {r['seconds']['send']} s)  throughput: {r['throughput_ups']} upd/s")
+    print(f"webhook          {_ms(r['webhook_s'])}")
+    print(f"update handled   {_ms(r['update_s'])}")
+    print(f"webhook status   {r['webhook_status']}")
+    for k, v in r["jobs_s"].items():
+        print(f"{k[:16]:<16} {_ms(v)}")
+    print(f"telegram calls   {r['telegram_calls']}  errors: {r['telegram_errors']}")
+    print(f"openai calls     {r['openai_calls']}  errors: {r['openai_errors']}  cache: {r['ai_cache']}")
+    db = r["db_bytes"]
+    print(f"db files         +{db['growth']} bytes for {db['users']} users: {db['after']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# =======================
+# Микробенчмарк: стоимость диспетчеризации одного апдейта
+# ROUTER.process (словари) против bot.process_new_updates (линейный перебор telebot).
+#   python bench/routing_bench.py [N]
+# =======================
+import os, sys, json, time, tempfile
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+TMP = tempfile.mkdtemp(prefix="routing-bench-")
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:bench")
+os.environ["DB_PATH"] = os.path.join(TMP, "db.sqlite3")
+os.environ["AI_CACHE_PATH"] = os.path.join(TMP, "ai_cache.sqlite3")
+os.environ["PLAN_LIBRARY_PATH"] = os.path.join(TMP, "plans.sqlite3")
+os.chdir(TMP)  # db.json (если вдруг есть) не трогаем
+
+import telebot
+import bot as app_bot
+
+# Telegram не вызываем: отправка сообщений — заглушка
+_sent = SimpleNamespace(n=0)
+def _fake_send(*a, **kw):
+    _sent.n += 1
+    return SimpleNamespace(message_id=1)
+app_bot.bot.send_message = _fake_send
+app_bot.bot.reply_to = _fake_send
+
+def make_update(i, text):
+    return telebot.types.Update.de_json(json.dumps({
+        "update_id": i,
+        "message": {
+            "message_id": i, "date": 0, "text": text,
+            "chat": {"id": 1000 + i % 50, "type": "private"},
+            "from": {"id": 1000 + i % 50, "is_bot": False, "first_name": "u"},
+            **({"entities": [{"type": "bot_command", "offset": 0, "length": len(text)}]} if text.startswith("/") else {}),
+        },
+    }))
+
+TEXTS = ["⬅️ Назад", "👨‍🍳 Рецепты от ИИ", "🛠 Админ-панель", "привет", "/start", "✏️ Сменить приветствие"]
+
+
+def bench(fn, updates):
+    t0 = time.perf_counter()
+    for u in updates:
+        fn(u)
+    return (time.perf_counter() - t0) / len(updates)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    updates = [make_update(i, TEXTS[i % len(TEXTS)]) for i in range(n)]
+    # прогрев (регистрация пользователей, кэши)
+    for u in updates[:200]:
+        app_bot.ROUTER.process(u)
+    send = _sent.n
+    routed = bench(app_bot.ROUTER.process, updates)
+    linear = bench(lambda u: app_bot.bot.process_new_updates([u]), updates)
+    print(f"updates: {n}, handlers: text={len(app_bot.ROUTER.texts)} state={len(app_bot.ROUTER.states)}")
+    print(f"ROUTER.process           : {routed * 1e6:8.1f} µs/update")
+    print(f"bot.process_new_updates  : {linear * 1e6:8.1f} µs/update")
+    print(f"speedup                  : {linear / routed:8.2f}x  (send stubs called: {_sent.n - send})")
+    kb = app_bot.main_menu()
+    t0 = time.perf_counter()
+    for _ in range(n):
+        kb.to_json()
+    frozen = (time.perf_counter() - t0) / n
+    t0 = time.perf_counter()
+    for _ in range(n):
+        telebot.types.ReplyKeyboardMarkup.to_json(kb)
+    fresh = (time.perf_counter() - t0) / n
+    print(f"main_menu().to_json      : {frozen * 1e6:8.2f} µs (prebuilt) vs {fresh * 1e6:.2f} µs (serialize each time)")
+    app_bot.DB.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,10 @@
 # =======================
 # Calories AI — webhook version with background tasks
 # =======================
-import os, json, time, threading, base64, re
+import os, time, threading, base64, re
+from html import escape
 from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor
 
-import requests
 import telebot
 from telebot import types
 from telebot.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
@@ -20,104 +19,253 @@ ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split("
 if not BOT_TOKEN:
     raise RuntimeError("TELEGRAM_TOKEN is not set")
 
-bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML", threaded=True)
+# threaded=False: хендлеры исполняются в потоках UPDATES (по шарду на чат),
+# иначе собственный пул telebot перемешал бы апдейты одного чата.
+bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML", threaded=False)
 
-# ---------- SIMPLE DB (json) ----------
-DB_FILE = "db.json"
-LOCK = threading.RLock()
+# ---------- METRICS (см. metrics.py) ----------
+from telebot import apihelper
+from metrics import REGISTRY, CONTENT_TYPE, timed, trace, log
 
-def _load():
-    if not os.path.exists(DB_FILE):
-        return {"users": {}, "welcome": DEFAULT_WELCOME, "broadcast_log": []}
-    try:
-        with open(DB_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {"users": {}, "welcome": DEFAULT_WELCOME, "broadcast_log": []}
+# ---------- TELEGRAM HTTP (см. tg_files.py) ----------
+from tg_files import make_session, FileFetcher, FileTooLarge
+
+# Один keep-alive пул на процесс для Bot API и файлов: по соединению на каждый поток,
+# который ходит в Telegram (UPDATES, JOBS, рассылка) + запас
+TG_HTTP_POOL = int(os.getenv("TG_HTTP_POOL") or (
+    int(os.getenv("UPDATE_WORKERS", "8")) + int(os.getenv("WORKERS", "6")) + int(os.getenv("BROADCAST_WORKERS", "8")) + 4
+))
+TG_SESSION = make_session(TG_HTTP_POOL)
+apihelper.session = TG_SESSION
+
+def _timed_tg_request(method, url, **kw):
+    """Все вызовы Bot API — через TG_SESSION, с замером по имени метода (sendMessage, getFile, …)."""
+    with timed("tg_api", url.rsplit("/", 1)[-1]):
+        return TG_SESSION.request(method, url, **kw)
+
+apihelper.CUSTOM_REQUEST_SENDER = _timed_tg_request
+
+FILES = FileFetcher(
+    bot,
+    TG_SESSION,
+    lambda path: (apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}").format(BOT_TOKEN, path),
+    max_bytes=int(os.getenv("TG_FILE_MAX_BYTES", str(20 * 1024 * 1024))),
+)
 
-def _save(db):
-    with LOCK:
-        with open(DB_FILE, "w", encoding="utf-8") as f:
-            json.dump(db, f, ensure_ascii=False, indent=2)
+# ---------- DB (SQLite + кэш, см. storage.py) ----------
+from storage import Storage
+
+DB_FILE = "db.json"  # старый формат — переносится в SQLite при первом запуске
+DB_PATH = os.getenv("DB_PATH", "db.sqlite3")
+DB = Storage(
+    DB_PATH,
+    legacy_json=DB_FILE,
+    flush_interval=float(os.getenv("DB_FLUSH_INTERVAL", "1.0")),
+    cache_size=int(os.getenv("DB_CACHE_SIZE", "50000")),
+)
 
 def db_get():
-    with LOCK:
-        return _load()
+    """Полный снимок БД (медленно — только для редких админ-операций)."""
+    return {
+        "users": DB.all_users(),
+        "welcome": db_get_welcome(),
+        "broadcast_log": DB.broadcast_log(limit=1000),
+    }
+
+# Счётчики админки обновляются при записи — статистика без сканов БД (см. analytics.py)
+from analytics import Analytics, TRACKED_FIELDS
+
+STATS = Analytics(os.getenv("ANALYTICS_PATH", "analytics.sqlite3"))
+if STATS.empty():
+    STATS.rebuild(DB.all_users().values())
 
 def db_set_user(uid, data: dict):
-    with LOCK:
-        db = _load()
-        u = db["users"].get(str(uid), {})
-        u.update(data)
-        db["users"][str(uid)] = u
-        _save(db)
+    if not TRACKED_FIELDS.isdisjoint(data):
+        STATS.user_changed(DB.get_user(uid), data)
+    DB.set_user(uid, data)
 
 def db_get_user(uid):
-    with LOCK:
-        db = _load()
-        return db["users"].get(str(uid), {})
+    return DB.get_user(uid)
+
+def db_user_ids():
+    return DB.user_ids()
+
+def db_user_count():
+    return DB.user_count()
 
 def db_get_welcome():
-    with LOCK:
-        db = _load()
-        return db.get("welcome", DEFAULT_WELCOME)
+    return DB.get_meta("welcome", DEFAULT_WELCOME)
 
 def db_set_welcome(text):
-    with LOCK:
-        db = _load()
-        db["welcome"] = text
-        _save(db)
+    DB.set_meta("welcome", text)
+
+def db_log_broadcast(entry: dict):
+    DB.append_broadcast_log(entry)
+
+def db_get_broadcast_state():
+    return DB.get_meta("broadcast_state")
+
+def db_set_broadcast_state(state):
+    DB.set_meta("broadcast_state", dict(state) if state else None)
+
+# ---------- STATES (см. flow_store.py) ----------
+from flow_store import make_flow_store
 
-# ---------- STATES ----------
-USER_FLOW = {}  # uid -> {"step": "...", ...}
+# FLOW_BACKEND=sqlite — шаги в файле и переживают рестарт; бот — один процесс
+# (кэш Storage и прочее состояние не общие между воркерами, см. flow_store.py);
+# брошенные сценарии забываются через FLOW_TTL секунд
+FLOWS = make_flow_store(
+    os.getenv("FLOW_BACKEND", "memory"),
+    path=os.getenv("FLOW_DB_PATH", "flows.sqlite3"),
+    ttl=float(os.getenv("FLOW_TTL", "3600")),
+)
 
 def set_step(uid, step, **extra):
-    USER_FLOW[uid] = {"step": step, **extra}
+    FLOWS.set(uid, step, **extra)
 
 def get_step(uid):
-    return USER_FLOW.get(uid, {}).get("step")
+    return FLOWS.step(uid)
 
 def reset_flow(uid):
-    USER_FLOW.pop(uid, None)
+    FLOWS.clear(uid)
 
 def is_admin(uid):
     return uid in ADMIN_IDS
 
+# ---------- ROUTING (см. routing.py) ----------
+from routing import Router
+
+# Хендлеры регистрируются через ROUTER (он же регистрирует их в telebot);
+# ensure_user вызывается для каждого входящего сообщения, кнопки главного меню сбрасывают шаг
+ROUTER = Router(bot, get_step, on_message=lambda m: ensure_user(m), reset_step=reset_flow)
+
 # ---------- KEYBOARDS ----------
+class _FrozenKeyboard(ReplyKeyboardMarkup):
+    """Reply-клавиатура, собранная и сериализованная один раз при старте."""
+
+    def __init__(self, *rows):
+        super().__init__(resize_keyboard=True)
+        for r in rows:
+            self.row(*[KeyboardButton(t) for t in r])
+        self._json = super().to_json()
+
+    def to_json(self):
+        return self._json
+
+_MENU_ROWS = (("📸 КБЖУ по фото", "🧾 КБЖУ по списку"), ("📅 Меню на неделю", "👨‍🍳 Рецепты от ИИ"), ("📊 Мой дневник",))
+MAIN_MENU = _FrozenKeyboard(*_MENU_ROWS)
+MAIN_MENU_ADMIN = _FrozenKeyboard(*_MENU_ROWS, ("🛠 Админ-панель",))
+BACK_MENU = _FrozenKeyboard(("⬅️ Назад",))
+SEX_MENU = _FrozenKeyboard(("👨 Мужчина", "👩 Женщина"), ("⬅️ Назад",))
+GOAL_MENU = _FrozenKeyboard(("Похудение", "Поддержание веса", "Набор массы"), ("⬅️ Назад",))
+RECIPES_MENU = _FrozenKeyboard(("🍽 Рецепт по запросу", "🔥 Рецепт на N ккал"), ("⬅️ Назад",))
+ADMIN_MENU = _FrozenKeyboard(("👥 Пользователи", "📣 Рассылка"), ("✏️ Сменить приветствие",), ("⬅️ Назад",))
+
 def main_menu(uid=None):
-    kb = ReplyKeyboardMarkup(resize_keyboard=True)
-    kb.row(KeyboardButton("📸 КБЖУ по фото"), KeyboardButton("🧾 КБЖУ по списку"))
-    kb.row(KeyboardButton("📅 Меню на неделю"), KeyboardButton("👨‍🍳 Рецепты от ИИ"))
-    if uid and is_admin(uid):
-        kb.row(KeyboardButton("🛠 Админ-панель"))
-    return kb
+    return MAIN_MENU_ADMIN if uid and is_admin(uid) else MAIN_MENU
 
 def back_menu():
-    kb = ReplyKeyboardMarkup(resize_keyboard=True)
-    kb.row(KeyboardButton("⬅️ Назад"))
-    return kb
+    return BACK_MENU
 
 # Приветствие по умолчанию
 DEFAULT_WELCOME = (
     "Привет! 🤖 Я помогу посчитать КБЖУ еды:\n"
     "• «📸 КБЖУ по фото» — пришли фото блюда\n"
-    "• «🧾 КБЖУ по списку» — напиши продукты и граммы\n\n"
+    "• «🧾 КБЖУ по списку» — напиши продукты и граммы\n"
+    "• «📊 Мой дневник» — сколько съедено за день и в среднем за неделю\n\n"
     "Также подберу <b>меню на 7 дней</b> под твои параметры — «📅 Меню на неделю».\n"
     "«👨‍🍳 Рецепты от ИИ» — бесплатно.\n\n"
     "Премиум открывает доп. функции на 30 дней."
 )
 
-# ---------- BG EXECUTOR ----------
-EXEC = ThreadPoolExecutor(max_workers=int(os.getenv("WORKERS", "6")))
+# ---------- BG JOBS (см. jobs.py) ----------
+from jobs import JobScheduler, OK, BUSY, DUPLICATE, BROADCAST as PRIO_BROADCAST, PREGEN as PRIO_PREGEN
+from job_journal import JobJournal
+from ai_cache import normalize_text
+
+JOBS = JobScheduler(
+    workers=int(os.getenv("WORKERS", "6")),
+    per_user=int(os.getenv("JOBS_PER_USER", "2")),
+    max_backlog=int(os.getenv("JOBS_MAX_BACKLOG", "200")),
+    reserved=int(os.getenv("JOBS_RESERVED", "2")),
+)
+
+# Журнал задач пользователей: после рестарта недоделанное ставится заново
+# (не дольше JOB_RECOVER_MAX_AGE и не больше JOB_MAX_ATTEMPTS попыток), иначе правим «🧠 …»
+JOURNAL = JobJournal(os.getenv("JOB_JOURNAL_PATH", "jobs.sqlite3"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+JOB_RECOVER_MAX_AGE = float(os.getenv("JOB_RECOVER_MAX_AGE", "900"))
 
 def run_bg(target, *args, **kwargs):
-    EXEC.submit(_safe_wrap, target, *args, **kwargs)
+    """Фоновая задача без привязки к пользователю."""
+    return JOBS.submit(None, target, *args, **kwargs)
 
-def _safe_wrap(fn, *args, **kwargs):
+def _journaled(key, target, *args):
+    JOURNAL.start(key)
     try:
-        fn(*args, **kwargs)
-    except Exception as e:
-        print("BG task error:", e)
+        target(*args)
+    finally:
+        JOURNAL.finish(key)
+
+def _submit_user_job(uid, chat_id, wait_id, key, target, args, dedup=None):
+    def on_cancel():
+        safe_delete(chat_id, wait_id)
+        if key: JOURNAL.finish(key)
+    if key:
+        res = JOBS.submit(uid, _journaled, key, target, *args, dedup=dedup, on_cancel=on_cancel)
+        if res != OK:
+            JOURNAL.finish(key)
+        return res
+    return JOBS.submit(uid, target, *args, dedup=dedup, on_cancel=on_cancel)
+
+def run_user_job(m, wait_id, target, *args, dedup=None):
+    """
+    Задача пользователя: target(m, wait_id, *args).
+    Очередь переполнена — правим «🧠 …» на «занято»; такой же запрос уже ждёт — сообщаем об этом.
+    Задачи из JOURNAL.tasks пишутся в журнал; ключ — сообщение пользователя, поэтому
+    повторная доставка того же апдейта вторую задачу не ставит.
+    """
+    uid, chat_id = m.from_user.id, m.chat.id
+    key = None
+    if target.__name__ in JOURNAL.tasks:
+        key = f"{chat_id}:{m.message_id}"
+        if not JOURNAL.begin(key, target.__name__, uid, chat_id, wait_id, {"msg": m.json, "args": args}):
+            safe_delete(chat_id, wait_id)
+            return False
+    res = _submit_user_job(uid, chat_id, wait_id, key, target, (m, wait_id) + args, dedup)
+    if res == BUSY:
+        safe_edit(chat_id, wait_id, "⏳ Сейчас много запросов, попробуй чуть позже.", reply_markup=main_menu(uid))
+    elif res == DUPLICATE:
+        safe_edit(chat_id, wait_id, "⏳ Такой запрос уже в очереди, результат придёт отдельным сообщением.")
+    return res == OK
+
+def recover_jobs():
+    """Старт: недоделанные до рестарта задачи — снова в очередь, безнадёжные — правим их «🧠 …»."""
+    now = time.time()
+    requeued = orphaned = 0
+    for e in JOURNAL.unfinished():
+        fn = JOURNAL.tasks.get(e.task)
+        res = None
+        if fn and e.attempts < JOB_MAX_ATTEMPTS and now - e.created < JOB_RECOVER_MAX_AGE:
+            try:
+                m = types.Message.de_json(e.payload["msg"])
+                with trace("r" + e.key):
+                    res = _submit_user_job(e.owner, e.chat_id, e.wait_id, e.key, fn, [m, e.wait_id] + e.payload["args"])
+            except Exception as ex:
+                log("job_recover", error=ex, key=e.key)
+        if res == OK:
+            requeued += 1
+            continue
+        JOURNAL.finish(e.key)
+        safe_edit(e.chat_id, e.wait_id, "⚠️ Бот перезапускался, и запрос не выполнился. Отправь его ещё раз.",
+                  reply_markup=main_menu(e.owner))
+        orphaned += 1
+    if requeued or orphaned:
+        log("jobs_recovered", requeued=requeued, orphaned=orphaned)
+
+def cancel_user_jobs(uid):
+    """Снимает ещё не начатые задачи пользователя (их «🧠 …» удаляются)."""
+    return JOBS.cancel(uid)
 
 def safe_delete(chat_id, message_id):
     try: bot.delete_message(chat_id, message_id)
@@ -130,32 +278,70 @@ def safe_edit(chat_id, message_id, text, **kw):
         try: bot.send_message(chat_id, text, **kw)
         except: pass
 
+# ---------- BROADCAST ----------
+from broadcast import BroadcastEngine
+
+def _mark_gone(uid):
+    """Бот заблокирован/чат удалён: в рассылки больше не берём, пока юзер не напишет снова (ensure_user)."""
+    db_set_user(uid, {"blocked": True})
+    KNOWN_USERS.discard(int(uid))
+
+BROADCAST = BroadcastEngine(
+    bot,
+    load_state=db_get_broadcast_state,
+    save_state=db_set_broadcast_state,
+    list_users=lambda after, limit: DB.user_ids_after(after, limit, active_only=True),
+    count_users=lambda: DB.user_count(active_only=True),
+    mark_gone=_mark_gone,
+    log_done=db_log_broadcast,
+    rate=float(os.getenv("BROADCAST_RATE", "28")),
+    workers=int(os.getenv("BROADCAST_WORKERS", "8")),
+    # рассылка — задача класса BROADCAST в JOBS и уступает, пока ждут интерактивные задачи
+    spawn=lambda fn, st: JOBS.submit(None, fn, st, prio=PRIO_BROADCAST, dedup="broadcast") == OK,
+    yield_to=lambda: JOBS.pending() > 0,
+)
+
 # ---------- OpenAI helpers ----------
-def oai_chat(messages, temperature=0.7, max_tokens=800):
+import ai_client
+from ai_cache import ResponseCache, make_key
+
+AI_CACHE = ResponseCache(
+    max_items=int(os.getenv("AI_CACHE_SIZE", "2000")),
+    ttl=int(os.getenv("AI_CACHE_TTL", str(24 * 3600))),
+    disk_path=os.getenv("AI_CACHE_PATH", "ai_cache.sqlite3") or None,
+)
+
+def oai_chat(messages, temperature=0.7, max_tokens=None, feature="default", cache=False, as_json=False):
     """
     Унифицированный вызов OpenAI Chat (текст).
+    Модель и потолок max_tokens — из маршрута фичи (ai_routes); max_tokens здесь — подсказка меньше потолка.
+    cache=True — одинаковые (после нормализации) запросы берутся из AI_CACHE.
+    as_json=True — response_format json_object (ответ разбирает prompts.parse_json).
     """
-    try:
-        import openai
-        openai.api_key = OPENAI_API_KEY
-        resp = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
-        return resp["choices"][0]["message"]["content"].strip()
-    except Exception as e:
-        print("openai text error:", e)
-        return None
+    extra = {"response_format": {"type": "json_object"}} if as_json else {}
+    def call():
+        try:
+            return ai_client.chat(feature, messages, temperature=temperature, max_tokens=max_tokens, **extra)
+        except Exception as e:
+            log("openai_text", error=e, feature=feature)
+            return None
+    if not cache:
+        return call()
+    return AI_CACHE.get_or_compute(_chat_key(messages, temperature, max_tokens, feature, as_json), call)
+
+def _chat_key(messages, temperature, max_tokens, feature, as_json=False):
+    return make_key(feature + (":json" if as_json else ""), [m["content"] for m in messages], temperature, max_tokens)
+
+# json — компактный запрос с общим system-префиксом, ответ JSON, HTML собираем сами;
+# text — прежние текстовые промпты (для сравнения токенов/латентности)
+import prompts
+PROMPT_MODE = os.getenv("PROMPT_MODE", "json")
 
-def oai_vision(prompt_text, image_bytes, temperature=0.2, max_tokens=700):
+def oai_vision(prompt_text, image_bytes, temperature=0.2, max_tokens=None, feature="vision"):
     """
     Визуальная подсказка: передаём картинку (base64) + текст.
     """
     try:
-        import openai, base64
-        openai.api_key = OPENAI_API_KEY
         b64 = base64.b64encode(image_bytes).decode("utf-8")
         messages = [
             {"role":"system","content":"Ты нутрициолог. Определи блюдо/ингредиенты по фото и оцени КБЖУ (ккал, Б/Ж/У)."},
@@ -164,40 +350,140 @@ def oai_vision(prompt_text, image_bytes, temperature=0.2, max_tokens=700):
                 {"type":"image_url","image_url":{"url": f"data:image/jpeg;base64,{b64}"}}
             ]}
         ]
-        resp = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
-        return resp["choices"][0]["message"]["content"].strip()
+        return ai_client.chat(feature, messages, temperature=temperature, max_tokens=max_tokens)
     except Exception as e:
-        print("openai vision error:", e)
+        log("openai_vision", error=e, feature=feature)
         return None
 
+# Потоковый вывод: «🧠 …» правится по мере генерации (AI_STREAM=0 — ждать ответ целиком)
+from streaming import StreamingEditor, RenderedEditor, split_message
+AI_STREAM = os.getenv("AI_STREAM", "1") == "1"
+
+def deliver(chat_id, wait_id, uid, text, tail=None):
+    """Готовый ответ вместо wait-сообщения (длинный — несколькими сообщениями); tail — последним, с меню."""
+    safe_delete(chat_id, wait_id)
+    parts = split_message(text) + ([tail] if tail else [])
+    for part in parts[:-1]:
+        bot.send_message(chat_id, part)
+    bot.send_message(chat_id, parts[-1], reply_markup=main_menu(uid))
+
+def ai_reply(chat_id, wait_id, uid, messages, temperature=0.7, max_tokens=None, feature="default", cache=False,
+             as_json=False, render=None, closing=None):
+    """
+    Генерирует ответ и показывает его пользователю вместо wait-сообщения.
+    Возвращает текст ответа; при ошибке бросает исключение (wait остаётся для сообщения об ошибке).
+    С cache=True одинаковые одновременные запросы идут в апстрим один раз (AI_CACHE.get_or_compute):
+    лидер стримит в своё сообщение, остальные ждут его результат и получают ответ целиком.
+    render(raw, done) -> HTML | None — показывать не сам ответ (JSON), а собранный из него HTML,
+    в потоке — по мере разбора; closing(raw) -> текст | None — завершающее сообщение с меню.
+    """
+    def show(res):
+        html = render(res, True) if render else res
+        if not html:
+            raise RuntimeError(f"{feature}: unrenderable answer")
+        return html
+
+    if not AI_STREAM:
+        res = oai_chat(messages, temperature=temperature, max_tokens=max_tokens, feature=feature, cache=cache, as_json=as_json)
+        if not res:
+            raise RuntimeError(f"{feature}: AI failed")
+        deliver(chat_id, wait_id, uid, show(res), closing(res) if closing else None)
+        return res
+    streamed = []
+    extra = {"response_format": {"type": "json_object"}} if as_json else {}
+
+    def stream():
+        streamed.append(True)
+        interval = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+        if render:
+            editor = RenderedEditor(bot, chat_id, wait_id, render, interval=interval)
+        else:
+            editor = StreamingEditor(bot, chat_id, wait_id, interval=interval)
+        for delta in ai_client.stream(feature, messages, temperature=temperature, max_tokens=max_tokens, **extra):
+            editor.feed(delta)
+        shown = editor.finish()
+        # в кэш — сырой ответ (его заново рендерят ведомые и попадания в кэш); неразобранный не кэшируем
+        return (editor.raw if render else shown) if shown else None
+
+    if cache:
+        res = AI_CACHE.get_or_compute(_chat_key(messages, temperature, max_tokens, feature, as_json), stream)
+    else:
+        res = stream()
+    if not res:
+        raise RuntimeError(f"{feature}: empty stream")
+    if not streamed:
+        # ответ из кэша или от чужого (лидерского) стрима
+        deliver(chat_id, wait_id, uid, show(res), closing(res) if closing else None)
+        return res
+    # клавиатуру меню к отредактированному сообщению не прикрепить — отдельным сообщением
+    bot.send_message(chat_id, (closing(res) if closing else None) or "Готово ✅", reply_markup=main_menu(uid))
+    return res
+
 # ---------- Webhook (Flask) ----------
-from flask import Flask, request, abort
+from flask import Flask, request, abort, jsonify
+from dispatcher import UpdateDispatcher
 app = Flask(__name__)
 
+def handle_update(upd):
+    # trace id = update_id: по нему в логах видно всю цепочку, включая фоновые задачи
+    with trace(f"u{upd.update_id}"), timed("update"):
+        ROUTER.process(upd)
+
+# Очередь входящих апдейтов: вебхук только кладёт апдейт и сразу отвечает 200
+UPDATES = UpdateDispatcher(
+    handle_update,
+    workers=int(os.getenv("UPDATE_WORKERS", "8")),
+    max_pending=int(os.getenv("UPDATE_QUEUE_MAX", "1000")),
+)
+
 @app.get("/")
 def index():
     return "Bot is running", 200
 
+@app.get(f"/queue/{WEBHOOK_SECRET}")
+def queue_stats():
+    return jsonify(UPDATES.stats()), 200
+
+_BREAKER_STATES = {"closed": 0, "half-open": 1, "open": 2}
+REGISTRY.gauge("bot_jobs_backlog", "Jobs waiting in JOBS", lambda: JOBS.stats()["backlog"])
+REGISTRY.gauge("bot_jobs_active", "JOBS workers busy right now", lambda: JOBS.stats()["active"])
+REGISTRY.gauge("bot_jobs_workers", "JOBS worker threads", lambda: JOBS.stats()["workers"])
+REGISTRY.gauge("bot_jobs_users_waiting", "Users with queued jobs", lambda: JOBS.stats()["users_waiting"])
+REGISTRY.gauge("bot_jobs_interactive_queued", "Interactive jobs waiting in JOBS", lambda: JOBS.pending())
+REGISTRY.gauge("bot_updates_pending", "Updates queued in UPDATES", UPDATES.depth)
+REGISTRY.gauge("bot_updates_shed", "Updates rejected with 503 since start", lambda: UPDATES.stats()["shed"])
+REGISTRY.gauge("bot_ai_cache_hit_rate", "AI_CACHE hit rate", lambda: AI_CACHE.summary()["hit_rate"])
+REGISTRY.gauge("bot_openai_breaker_state", "0 closed, 1 half-open, 2 open",
+               lambda: _BREAKER_STATES[ai_client.BREAKER.state()])
+
+# METRICS_TOKEN — если задан, /metrics требует «Authorization: Bearer <token>»
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+@app.get("/metrics")
+def metrics_endpoint():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        abort(403)
+    return REGISTRY.render(), 200, {"Content-Type": CONTENT_TYPE}
+
 @app.post(f"/tg/{WEBHOOK_SECRET}")
 def tg_webhook():
     if request.headers.get("content-type") != "application/json":
         abort(403)
     if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
         abort(403)
-    update = telebot.types.Update.de_json(request.get_data(as_text=True))
-    bot.process_new_updates([update])
+    with timed("webhook"):
+        update = telebot.types.Update.de_json(request.get_data(as_text=True))
+        if not UPDATES.submit(update):
+            # очередь переполнена — Telegram повторит доставку позже
+            log("update_shed", update_id=update.update_id)
+            return "busy", 503, {"Retry-After": "5"}
     return "ok", 200
 
 def setup_webhook():
     try:
         bot.remove_webhook()  # на всякий
     except Exception as e:
-        print("remove_webhook warn:", e)
+        log("remove_webhook", error=e)
     url = f"https://{EXTERNAL_HOST}/tg/{WEBHOOK_SECRET}"
     ok = bot.set_webhook(
         url=url,
@@ -205,18 +491,20 @@ def setup_webhook():
         drop_pending_updates=True,
         max_connections=40
     )
-    print("✅ Webhook set:", ok)
+    log("webhook_set", ok=ok, url=f"https://{EXTERNAL_HOST}/tg/…")
     # ========== START / BACK ==========
-@bot.message_handler(commands=["start"])
+@ROUTER.command("start")
 def cmd_start(m):
     uid = m.from_user.id
     reset_flow(uid)
+    cancel_user_jobs(uid)
     bot.send_message(m.chat.id, db_get_welcome(), reply_markup=main_menu(uid))
 
-@bot.message_handler(func=lambda m: m.text == "⬅️ Назад")
+@ROUTER.text("⬅️ Назад")
 def go_back(m):
     uid = m.from_user.id
     reset_flow(uid)
+    cancel_user_jobs(uid)
     bot.send_message(m.chat.id, "Окей, вернул в меню.", reply_markup=main_menu(uid))
 
 # ========== PROFILE (для плана) ==========
@@ -227,12 +515,9 @@ def profile_complete(uid):
 
 def ask_profile(uid, chat_id):
     set_step(uid, "sex")
-    kb = ReplyKeyboardMarkup(resize_keyboard=True)
-    kb.row(KeyboardButton("👨 Мужчина"), KeyboardButton("👩 Женщина"))
-    kb.row(KeyboardButton("⬅️ Назад"))
-    bot.send_message(chat_id, "Выберите пол:", reply_markup=kb)
+    bot.send_message(chat_id, "Выберите пол:", reply_markup=SEX_MENU)
 
-@bot.message_handler(func=lambda m: get_step(m.from_user.id) == "sex")
+@ROUTER.state("sex")
 def prof_sex(m):
     uid = m.from_user.id
     if m.text not in ["👨 Мужчина","👩 Женщина"]:
@@ -240,9 +525,9 @@ def prof_sex(m):
     sex = "male" if "Мужчина" in m.text else "female"
     db_set_user(uid, {"sex": sex})
     set_step(uid, "height")
-    msg = bot.send_message(m.chat.id, "Введите рост (см):", reply_markup=back_menu())
-    bot.register_next_step_handler(msg, prof_height)
+    bot.send_message(m.chat.id, "Введите рост (см):", reply_markup=back_menu())
 
+@ROUTER.state("height")
 def prof_height(m):
     uid = m.from_user.id
     try:
@@ -250,12 +535,11 @@ def prof_height(m):
         if not (120 <= h <= 230): raise ValueError
         db_set_user(uid, {"height": h})
         set_step(uid, "weight")
-        msg = bot.send_message(m.chat.id, "Введите вес (кг):", reply_markup=back_menu())
-        bot.register_next_step_handler(msg, prof_weight)
+        bot.send_message(m.chat.id, "Введите вес (кг):", reply_markup=back_menu())
     except:
-        msg = bot.reply_to(m, "Введите число, напр. 178", reply_markup=back_menu())
-        bot.register_next_step_handler(msg, prof_height)
+        bot.reply_to(m, "Введите число, напр. 178", reply_markup=back_menu())
 
+@ROUTER.state("weight")
 def prof_weight(m):
     uid = m.from_user.id
     try:
@@ -263,15 +547,11 @@ def prof_weight(m):
         if not (35 <= w <= 300): raise ValueError
         db_set_user(uid, {"weight": w})
         set_step(uid, "goal")
-        kb = ReplyKeyboardMarkup(resize_keyboard=True)
-        kb.row(KeyboardButton("Похудение"), KeyboardButton("Поддержание веса"), KeyboardButton("Набор массы"))
-        kb.row(KeyboardButton("⬅️ Назад"))
-        bot.send_message(m.chat.id, "Выберите цель:", reply_markup=kb)
+        bot.send_message(m.chat.id, "Выберите цель:", reply_markup=GOAL_MENU)
     except:
-        msg = bot.reply_to(m, "Введите число, напр. 74", reply_markup=back_menu())
-        bot.register_next_step_handler(msg, prof_weight)
+        bot.reply_to(m, "Введите число, напр. 74", reply_markup=back_menu())
 
-@bot.message_handler(func=lambda m: get_step(m.from_user.id) == "goal")
+@ROUTER.state("goal")
 def prof_goal(m):
     uid = m.from_user.id
     opts = ["Похудение","Поддержание веса","Набор массы"]
@@ -282,8 +562,53 @@ def prof_goal(m):
     reset_flow(uid)
     bot.send_message(m.chat.id, "Готово! Анкета сохранена ✅", reply_markup=main_menu(uid))
 
+# ========== ДНЕВНИК ПИТАНИЯ (см. diary.py) ==========
+from diary import FoodDiary, parse_estimate
+
+DIARY = FoodDiary(
+    os.getenv("DIARY_PATH", "diary.sqlite3"),
+    tz_offset=float(os.getenv("DIARY_TZ_OFFSET", "3")),
+)
+DIARY_NOTE = "📒 Добавил в дневник — итог дня в «📊 Мой дневник»."
+
+def diary_add(uid, totals, src):
+    """Записывает (ккал, б, ж, у) в дневник; True, если записали."""
+    if not totals or totals[0] <= 0:
+        return False
+    try:
+        DIARY.add(uid, *totals, src=src)
+        return True
+    except Exception as e:
+        log("diary_add", error=e, uid=uid)
+        return False
+
+def _fmt_kbju(kcal, p, f, c):
+    return f"{kcal:.0f} ккал, Б/Ж/У {p:.0f}/{f:.0f}/{c:.0f}"
+
+@ROUTER.text("📊 Мой дневник", menu=True)
+def diary_show(m):
+    uid = m.from_user.id
+    n, kcal, p, f, c = DIARY.today(uid)
+    days, akcal, ap, af, ac = DIARY.last_days(uid, 7)
+    wn, wkcal, wp, wf, wc = DIARY.this_week(uid)
+    lines = ["📊 <b>Сегодня</b>: " + (f"{_fmt_kbju(kcal, p, f, c)} ({n} зап.)" if n else "записей пока нет")]
+    if profile_complete(uid):
+        t = daily_targets(db_get_user(uid))
+        lines.append(f"Цель: {t['kcal']} ккал — осталось ~{max(0, t['kcal'] - kcal):.0f}")
+    if days:
+        lines.append(f"\n<b>Среднее за 7 дней</b> ({days} дн. с записями): {_fmt_kbju(akcal, ap, af, ac)}")
+    if wn:
+        lines.append(f"<b>С понедельника</b>: {_fmt_kbju(wkcal, wp, wf, wc)} ({wn} зап.)")
+    lines.append("\nЗаписи добавляются сами из «📸 КБЖУ по фото» и «🧾 КБЖУ по списку».")
+    bot.send_message(m.chat.id, "\n".join(lines), reply_markup=main_menu(uid))
+
 # ========== КБЖУ по СПИСКУ ==========
-@bot.message_handler(func=lambda m: m.text == "🧾 КБЖУ по списку")
+import foods
+
+# Локальная таблица КБЖУ: узнанные продукты считаем сами, в модель — только остальное
+FOODS = foods.FoodTable() if os.getenv("LOCAL_FOODS", "1") == "1" else None
+
+@ROUTER.text("🧾 КБЖУ по списку", menu=True)
 def kbju_list_start(m):
     uid = m.from_user.id
     set_step(uid, "kbju_list")
@@ -294,23 +619,41 @@ def kbju_list_start(m):
         reply_markup=back_menu()
     )
 
-@bot.message_handler(func=lambda m: get_step(m.from_user.id) == "kbju_list")
+@ROUTER.state("kbju_list")
 def kbju_list_calc(m):
     uid = m.from_user.id
     text = (m.text or "").strip()
     if not text or "Назад" in text:
         reset_flow(uid)
+        cancel_user_jobs(uid)
         bot.send_message(m.chat.id, "Отменил. Возвращаю в меню.", reply_markup=main_menu(uid))
         return
 
+    parsed = foods.parse_list(FOODS, text) if FOODS else None
+    STATS.feature("list")
+    if parsed and parsed.rows and not parsed.unmatched:
+        reset_flow(uid)
+        note = DIARY_NOTE if diary_add(uid, foods.total_of(parsed.rows), "list") else ""
+        bot.send_message(m.chat.id, foods.render(parsed.rows, note), reply_markup=main_menu(uid))
+        return
     wait = bot.send_message(m.chat.id, "🧠 Считаю КБЖУ по списку…", reply_markup=back_menu())
-    run_bg(_kbju_by_list_bg, m, wait.message_id)
+    run_user_job(m, wait.message_id, _kbju_by_list_bg, dedup=("list", normalize_text(text)))
 
+@JOURNAL.task
 def _kbju_by_list_bg(m, wait_id):
+    # разбор локальный и дешёвый — повторяем его здесь, чтобы в журнал шли только сообщение и id
+    parsed = foods.parse_list(FOODS, m.text or "") if FOODS else None
+    if parsed and parsed.rows:
+        return _kbju_partial_bg(m, wait_id, parsed)
+    if PROMPT_MODE == "json":
+        # итог считаем сами из построчной оценки — модели не нужно писать разбор и «Итого»
+        if parsed is None:
+            parsed = foods.ListResult()
+            parsed.unmatched = foods.split_items(m.text or "")
+        return _kbju_partial_bg(m, wait_id, parsed)
     chat_id = m.chat.id
     uid = m.from_user.id
     try:
-        user = db_get_user(uid)
         prompt = (
             "Ты нутрициолог. Посчитай суммарное КБЖУ (ккал/б/ж/у) по списку продуктов с граммовками.\n"
             "Если встречается «ложка/щепотка» — оцени разумно.\n"
@@ -319,94 +662,201 @@ def _kbju_by_list_bg(m, wait_id):
             "2) Итого (ккал и Б/Ж/У)\n\n"
             f"Список: {m.text}"
         )
-        res = oai_chat([{"role":"user","content":prompt}], temperature=0.2, max_tokens=900)
-        if not res:
-            raise RuntimeError("AI calc failed")
-        safe_delete(chat_id, wait_id)
         reset_flow(uid)
-        bot.send_message(chat_id, res, reply_markup=main_menu(uid))
+        res = ai_reply(chat_id, wait_id, uid, [{"role":"user","content":prompt}],
+                       temperature=0.2, feature="list", cache=True)
+        diary_add(uid, parse_estimate(res), "list")
     except Exception as e:
-        print("kbju_list error:", e)
+        log("kbju_list", error=e, uid=uid)
         safe_edit(chat_id, wait_id, "⚠️ Ошибка. Попробуй ещё раз.", reply_markup=main_menu(uid))
         reset_flow(uid)
+
+def _kbju_partial_bg(m, wait_id, parsed):
+    """Часть списка посчитана локально — модель оценивает только нераспознанные пункты."""
+    chat_id = m.chat.id
+    uid = m.from_user.id
+    budget = 60 + 40 * len(parsed.unmatched)
+    ai_rows_of = lambda rows: [(f"{r[0]} ≈",) + r[1:] for r in rows]
+    try:
+        if PROMPT_MODE == "json":
+            # строки приходят потоком: локально посчитанное видно сразу, оценки ИИ — по мере готовности
+            def render(raw, done):
+                ai_rows = ai_rows_of(prompts.list_rows(prompts.parse_partial(raw), partial=not done))
+                if not done:
+                    return foods.render(parsed.rows + ai_rows) if parsed.rows or ai_rows else None
+                return foods.render(parsed.rows + ai_rows, _list_note(parsed.unmatched, ai_rows))
+
+            def closing(raw):
+                ai_rows = ai_rows_of(prompts.list_rows(prompts.parse_partial(raw)))
+                return DIARY_NOTE if diary_add(uid, foods.total_of(parsed.rows + ai_rows), "list") else None
+
+            reset_flow(uid)
+            ai_reply(chat_id, wait_id, uid, prompts.list_messages(parsed.unmatched), temperature=0.1,
+                     max_tokens=budget, feature="list", cache=True, as_json=True, render=render, closing=closing)
+            return
+        prompt = (
+            "Ты нутрициолог. Оцени КБЖУ каждого продукта на указанный вес "
+            "(вес не указан — типичная порция; «ложка/щепотка» — оцени разумно).\n"
+            "Ответ — только строки вида: название | граммы | ккал | белки | жиры | углеводы\n\n"
+            + "\n".join(parsed.unmatched)
+        )
+        res = oai_chat([{"role":"user","content":prompt}], temperature=0.1,
+                       max_tokens=budget, feature="list", cache=True)
+        ai_rows = ai_rows_of(foods.parse_ai_rows(res))
+        note = _list_note(parsed.unmatched, ai_rows)
+        if diary_add(uid, foods.total_of(parsed.rows + ai_rows), "list"):
+            note = (note + "\n" + DIARY_NOTE).strip()
+        reset_flow(uid)
+        safe_delete(chat_id, wait_id)
+        bot.send_message(chat_id, foods.render(parsed.rows + ai_rows, note), reply_markup=main_menu(uid))
+    except Exception as e:
+        log("kbju_list", error=e, uid=uid)
+        safe_edit(chat_id, wait_id, "⚠️ Ошибка. Попробуй ещё раз.", reply_markup=main_menu(uid))
+        reset_flow(uid)
+
+def _list_note(unmatched, ai_rows):
+    note = ""
+    if not ai_rows:
+        note = "⚠️ Не нашёл в базе и не смог оценить: " + escape(", ".join(unmatched)) + " — итог без них."
+    elif len(ai_rows) < len(unmatched):
+        note = "⚠️ Часть пунктов оценить не удалось — итог может быть занижен."
+    if ai_rows:
+        note = ("≈ — оценка ИИ.\n" + note).strip()
+    return note
+
         # ========== КБЖУ по ФОТО ==========
-@bot.message_handler(func=lambda m: m.text == "📸 КБЖУ по фото")
+from images import pick_photo_size, preprocess, PhashIndex
+
+@ROUTER.text("📸 КБЖУ по фото", menu=True)
 def kbju_photo_prompt(m):
     bot.send_message(m.chat.id, "Пришли фото блюда. Можно добавить подпись с ингредиентами.", reply_markup=back_menu())
 
-@bot.message_handler(content_types=['photo'])
+@ROUTER.content_types('photo')
 def kbju_photo_received(m):
     wait = bot.send_message(m.chat.id, "🧠 Начинаю анализ изображения на КБЖУ…", reply_markup=back_menu())
     try:
-        file_id = m.photo[-1].file_id
+        # самого большого размера не нужно — берём минимально достаточный
+        p = pick_photo_size(m.photo)
+        file_id, unique_id = p.file_id, p.file_unique_id
     except:
         safe_edit(m.chat.id, wait.message_id, "Нужно фото.", reply_markup=main_menu(m.from_user.id))
         return
-    run_bg(_kbju_from_photo_bg, m, wait.message_id, file_id)
+    STATS.feature("photo")
+    run_user_job(m, wait.message_id, _kbju_from_photo_bg, file_id, unique_id, dedup=("photo", unique_id))
 
-def _kbju_from_photo_bg(m, wait_id, file_id):
+# Фото, отправленное «файлом» (без сжатия)
+@ROUTER.content_types('document', func=lambda m: (m.document.mime_type or "").startswith("image/"))
+def kbju_photo_document(m):
+    if (m.document.file_size or 0) > 20 * 1024 * 1024:
+        bot.reply_to(m, "Файл больше 20 МБ — пришли фото поменьше.", reply_markup=main_menu(m.from_user.id))
+        return
+    wait = bot.send_message(m.chat.id, "🧠 Начинаю анализ изображения на КБЖУ…", reply_markup=back_menu())
+    d = m.document
+    STATS.feature("photo")
+    run_user_job(m, wait.message_id, _kbju_from_photo_bg, d.file_id, d.file_unique_id, dedup=("photo", d.file_unique_id))
+
+PHOTO_PROMPT = (
+    "Определи блюдо и перечисли основные ингредиенты.\n"
+    "Дай оценку КБЖУ порции (ккал, Б/Ж/У). Если уверенность низкая — укажи это и предложи уточнить состав.\n"
+    "Формат:\n"
+    "Название\nИнгредиенты\nОценка: ~XXX ккал, Б/Ж/У xx/xx/xx\nКраткий комментарий."
+)
+# dHash недавних фото -> ключ AI_CACHE: почти такое же фото (пережатое, скриншот) того же юзера
+# с той же подписью не идёт в vision. Чужие фото не совпадают никогда — ответ уходит в дневник.
+PHASHES = PhashIndex(max_items=int(os.getenv("PHASH_INDEX_SIZE", "5000")),
+                     max_distance=int(os.getenv("PHASH_MAX_DISTANCE", "2")))
+
+def _analyze_photo(file_id, unique_id, scope):
+    # скачиваем файл (file_path кэшируется по unique_id, размер ограничен)
+    raw = FILES.download(file_id, unique_id)
+    img, h = preprocess(raw)
+    near_key = PHASHES.find(scope, h)
+    if near_key:
+        res = AI_CACHE.get(near_key)
+        if res:
+            return res
+    res = oai_vision(PHOTO_PROMPT, img)
+    if res:
+        key = make_key("vision-phash", list(scope), h)
+        AI_CACHE.put(key, res)
+        PHASHES.add(scope, h, key)
+    return res
+
+@JOURNAL.task
+def _kbju_from_photo_bg(m, wait_id, file_id, unique_id):
     chat_id = m.chat.id
     uid = m.from_user.id
     try:
-        # скачиваем файл
-        f = bot.get_file(file_id)
-        url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{f.file_path}"
-        img = requests.get(url, timeout=20).content
-
-        caption = m.caption or ""
-        prompt = (
-            "Определи блюдо и перечисли основные ингредиенты.\n"
-            "Дай оценку КБЖУ порции (ккал, Б/Ж/У). Если уверенность низкая — укажи это и предложи уточнить состав.\n"
-            "Формат:\n"
-            "Название\nИнгредиенты\nОценка: ~XXX ккал, Б/Ж/У xx/xx/xx\nКраткий комментарий."
-        )
-        res = oai_vision(prompt, img)
+        # тот же файл (пересланное фото) — из кэша, без скачивания и vision-запроса
+        key = make_key("vision", PHOTO_PROMPT, unique_id)
+        scope = (uid, normalize_text(m.caption or ""))
+        res = AI_CACHE.get_or_compute(key, lambda: _analyze_photo(file_id, unique_id, scope))
         if not res:
             raise RuntimeError("vision failed")
+        if diary_add(uid, parse_estimate(res), "photo"):
+            res += "\n\n" + DIARY_NOTE
         safe_delete(chat_id, wait_id)
         bot.send_message(chat_id, res, reply_markup=main_menu(uid))
+    except FileTooLarge as e:
+        log("kbju_photo", error=e, uid=uid)
+        safe_edit(chat_id, wait_id, "Файл больше 20 МБ — пришли фото поменьше.", reply_markup=main_menu(uid))
     except Exception as e:
-        print("photo kbju error:", e)
+        log("kbju_photo", error=e, uid=uid)
         safe_edit(chat_id, wait_id, "⚠️ Не удалось распознать фото. Попробуй ещё раз.", reply_markup=main_menu(uid))
 
 # ========== РЕЦЕПТЫ ==========
-@bot.message_handler(func=lambda m: m.text == "👨‍🍳 Рецепты от ИИ")
+@ROUTER.text("👨‍🍳 Рецепты от ИИ", menu=True)
 def recipes_menu(m):
-    kb = ReplyKeyboardMarkup(resize_keyboard=True)
-    kb.row(KeyboardButton("🍽 Рецепт по запросу"), KeyboardButton("🔥 Рецепт на N ккал"))
-    kb.row(KeyboardButton("⬅️ Назад"))
-    bot.send_message(m.chat.id, "Выбери вид рецепта:", reply_markup=kb)
+    bot.send_message(m.chat.id, "Выбери вид рецепта:", reply_markup=RECIPES_MENU)
 
-@bot.message_handler(func=lambda m: m.text == "🍽 Рецепт по запросу")
+@ROUTER.text("🍽 Рецепт по запросу")
 def recipe_freeform(m):
-    msg = bot.send_message(m.chat.id, "Напиши, что именно хочешь (например «блинчики без сахара»):", reply_markup=back_menu())
-    bot.register_next_step_handler(msg, _recipe_freeform_step)
+    set_step(m.from_user.id, "recipe_q")
+    bot.send_message(m.chat.id, "Напиши, что именно хочешь (например «блинчики без сахара»):", reply_markup=back_menu())
 
+@ROUTER.state("recipe_q")
 def _recipe_freeform_step(m):
+    reset_flow(m.from_user.id)
     query = (m.text or "").strip()
     if not query or "Назад" in query:
+        cancel_user_jobs(m.from_user.id)
         bot.send_message(m.chat.id, "Отменил.", reply_markup=main_menu(m.from_user.id))
         return
+    STATS.feature("recipe")
     wait = bot.send_message(m.chat.id, "🧠 Создаю рецепт…", reply_markup=back_menu())
-    run_bg(_make_recipe_bg, m, wait.message_id, {"type":"freeform", "q":query})
+    run_user_job(m, wait.message_id, _make_recipe_bg, {"type":"freeform", "q":query},
+                 dedup=("recipe", normalize_text(query)))
 
-@bot.message_handler(func=lambda m: m.text == "🔥 Рецепт на N ккал")
+@ROUTER.text("🔥 Рецепт на N ккал")
 def recipe_kcal(m):
-    msg = bot.send_message(m.chat.id, "Введи целевую калорийность (например 600):", reply_markup=back_menu())
-    bot.register_next_step_handler(msg, _recipe_kcal_step)
+    set_step(m.from_user.id, "recipe_kcal")
+    bot.send_message(m.chat.id, "Введи целевую калорийность (например 600):", reply_markup=back_menu())
 
+@ROUTER.state("recipe_kcal")
 def _recipe_kcal_step(m):
+    reset_flow(m.from_user.id)
     try:
         kcal = int(''.join([c for c in m.text if c.isdigit()]))
+        STATS.feature("recipe")
         wait = bot.send_message(m.chat.id, "🧠 Создаю рецепт…", reply_markup=back_menu())
-        run_bg(_make_recipe_bg, m, wait.message_id, {"type":"kcal", "kcal":kcal})
+        run_user_job(m, wait.message_id, _make_recipe_bg, {"type":"kcal", "kcal":kcal}, dedup=("recipe", kcal))
     except:
         bot.reply_to(m, "Нужно число, например 600.", reply_markup=back_menu())
 
+@JOURNAL.task
 def _make_recipe_bg(m, wait_id, params:dict):
     chat_id = m.chat.id
     uid = m.from_user.id
     try:
+        if PROMPT_MODE == "json":
+            try:
+                # рецепт рисуется по мере потока: название и ингредиенты видны с первых токенов
+                ai_reply(chat_id, wait_id, uid, prompts.recipe_messages(params), temperature=0.6, max_tokens=700,
+                         feature="recipe", cache=True, as_json=True,
+                         render=lambda raw, done: prompts.render_recipe(prompts.parse_partial(raw)))
+                return
+            except Exception as e:
+                log("recipe_json", error=e, uid=uid)   # дальше — текстовый промпт
         if params["type"] == "freeform":
             prompt = (
                 "Ты нутрициолог и шеф.\nСгенерируй один понятный рецепт под запрос пользователя.\n"
@@ -419,33 +869,74 @@ def _make_recipe_bg(m, wait_id, params:dict):
                 "Верни ингредиенты (г/шт), шаги, оценку КБЖУ и короткий совет по замене/подстройке.\n"
                 f"Цель: {params['kcal']} ккал."
             )
-        res = oai_chat([{"role":"user","content":prompt}], temperature=0.6, max_tokens=1000)
-        if not res:
-            raise RuntimeError("recipe failed")
-        safe_delete(chat_id, wait_id)
-        bot.send_message(chat_id, res, reply_markup=main_menu(uid))
+        ai_reply(chat_id, wait_id, uid, [{"role":"user","content":prompt}],
+                 temperature=0.6, feature="recipe", cache=True)
     except Exception as e:
-        print("recipe error:", e)
+        log("recipe", error=e, uid=uid)
         safe_edit(chat_id, wait_id, "⚠️ Не удалось сгенерировать рецепт. Попробуй ещё раз.", reply_markup=main_menu(uid))
 
 # ========== МЕНЮ НА НЕДЕЛЮ ==========
-@bot.message_handler(func=lambda m: m.text == "📅 Меню на неделю")
+import week_plan
+from nutrition import daily_targets
+from plan_library import PlanLibrary, bucket_of
+
+PLANS = PlanLibrary(os.getenv("PLAN_LIBRARY_PATH", "plans.sqlite3"), variants=int(os.getenv("PLAN_VARIANTS", "4")))
+GOAL_NAMES = {"cut":"похудение","maintain":"поддержание веса","bulk":"набор массы"}
+
+def _profile_words(u):
+    sex = "мужчина" if u["sex"]=="male" else "женщина"
+    return sex, GOAL_NAMES[u["goal"]]
+
+def _targets_text(t):
+    return f"🎯 Ваша норма: <b>{t['kcal']} ккал</b>, Б/Ж/У {t['protein']}/{t['fat']}/{t['carbs']} г в день."
+
+@ROUTER.text("📅 Меню на неделю", menu=True)
 def week_menu(m):
     uid = m.from_user.id
     if not profile_complete(uid):
         ask_profile(uid, m.chat.id)
         return
+    STATS.feature("plan")
+    u = db_get_user(uid)
+    bucket = bucket_of(u)
+    PLANS.hit(bucket)
+    # тёплая корзина — отвечаем сразу готовым планом, каждый раз следующим вариантом
+    rot = u.get("plan_rotation", uid % PLANS.variants)
+    days = PLANS.pick(bucket, rot)
+    if days:
+        db_set_user(uid, {"plan_rotation": rot + 1})
+        bot.send_message(m.chat.id, _targets_text(daily_targets(u)))
+        for text in days:
+            bot.send_message(m.chat.id, text)
+        bot.send_message(m.chat.id, "Готово ✅ План на неделю.", reply_markup=main_menu(uid))
+        return
     wait = bot.send_message(m.chat.id, "🧠 Создаю план под вас! Это может занять 5–15 секунд…", reply_markup=back_menu())
-    run_bg(_build_week_plan_bg, m, wait.message_id)
+    run_user_job(m, wait.message_id, _build_week_plan_bg, dedup="plan")
+
+# fanout — цели считаем сами, дни генерируются параллельно и приходят по мере готовности;
+# single — прежний режим: вся неделя одним запросом
+PLAN_MODE = os.getenv("PLAN_MODE", "fanout")
 
+@JOURNAL.task
 def _build_week_plan_bg(m, wait_id):
+    if PLAN_MODE == "fanout":
+        return _build_week_plan_fanout_bg(m, wait_id)
     chat_id = m.chat.id
     uid = m.from_user.id
     try:
         u = db_get_user(uid)
-        sex = "мужчина" if u["sex"]=="male" else "женщина"
-        goal_map = {"cut":"похудение","maintain":"поддержание веса","bulk":"набор массы"}
-        goal = goal_map[u["goal"]]
+        sex, goal = _profile_words(u)
+        if PROMPT_MODE == "json":
+            t = daily_targets(u)
+            res = oai_chat(prompts.week_messages(t), temperature=0.5, max_tokens=1800, feature="plan", as_json=True)
+            days = prompts.render_week(prompts.parse_json(res))
+            if days and all(days):
+                deliver(chat_id, wait_id, uid, _targets_text(t) + "\n\n" + "\n\n".join(days))
+                # в библиотеку — только полная неделя в допуске: её получат все в корзине
+                if len(days) == len(week_plan.DAYS) and all(week_plan.valid_day(d, t["kcal"]) for d in days):
+                    PLANS.add(bucket_of(u), days)
+                return
+            log("week_plan_json", error="unparsed", uid=uid)
         prompt = (
             "Ты профессиональный нутрициолог.\n"
             "Составь подробный план питания на 7 дней в виде:\n"
@@ -454,74 +945,121 @@ def _build_week_plan_bg(m, wait_id):
             "Добавь короткие подсказки по замене продуктов.\n\n"
             f"Параметры: пол — {sex}, рост — {u['height']} см, вес — {u['weight']} кг, цель — {goal}."
         )
-        res = oai_chat([{"role":"user","content":prompt}], temperature=0.5, max_tokens=2200)
-        if not res:
+        res = ai_reply(chat_id, wait_id, uid, [{"role":"user","content":prompt}],
+                       temperature=0.5, feature="plan")
+        # длинный план мог уйти несколькими сообщениями — в библиотеку кладём так же,
+        # но только если в нём 7 дней и калорийность каждого в допуске
+        if res and week_plan.valid_week(res, daily_targets(u)["kcal"]):
+            PLANS.add(bucket_of(u), split_message(res))
+        elif res:
+            log("week_plan_text", error="not cached: failed validation", uid=uid)
+    except Exception as e:
+        log("week_plan", error=e, uid=uid)
+        safe_edit(chat_id, wait_id, "⚠️ Не удалось построить план. Попробуй ещё раз.", reply_markup=main_menu(uid))
+
+def _generate_plan_day(prompt, feature="plan_day"):
+    if isinstance(prompt, prompts.DayRequest):
+        res = oai_chat(prompt.messages, temperature=0.6, max_tokens=450, feature=feature, as_json=True)
+        return prompts.render_day(prompt.idx, prompts.parse_json(res))
+    return oai_chat([{"role":"user","content":prompt}], temperature=0.6, feature=feature)
+
+def _day_prompt_fn():
+    return prompts.day_request if PROMPT_MODE == "json" else week_plan.day_prompt
+
+def _build_week_plan_fanout_bg(m, wait_id):
+    chat_id = m.chat.id
+    uid = m.from_user.id
+    try:
+        u = db_get_user(uid)
+        sex, goal = _profile_words(u)
+        t = daily_targets(u)
+        safe_edit(chat_id, wait_id, _targets_text(t) + "\n🧠 Составляю меню — присылаю по дням по мере готовности…")
+
+        def on_day(idx, text):
+            if text:
+                bot.send_message(chat_id, text)
+            else:
+                bot.send_message(chat_id, f"⚠️ {week_plan.DAYS[idx]}: не удалось составить меню.")
+
+        days = week_plan.build_week(t, sex, goal, _generate_plan_day, on_day, prompt_fn=_day_prompt_fn())
+        ok = sum(1 for d in days if d)
+        if not ok:
             raise RuntimeError("week plan failed")
-        safe_delete(chat_id, wait_id)
-        bot.send_message(chat_id, res, reply_markup=main_menu(uid))
+        if ok == len(days) and all(week_plan.valid_day(d, t["kcal"]) for d in days):
+            PLANS.add(bucket_of(u), days)
+        bot.send_message(chat_id, f"Готово ✅ План на неделю: {ok}/7 дней.", reply_markup=main_menu(uid))
     except Exception as e:
-        print("week plan error:", e)
+        log("week_plan", error=e, uid=uid)
         safe_edit(chat_id, wait_id, "⚠️ Не удалось построить план. Попробуй ещё раз.", reply_markup=main_menu(uid))
+
+def _pregen_plan(profile):
+    """План для типичного профиля корзины (фоновая предгенерация)."""
+    sex, goal = _profile_words(profile)
+    t = daily_targets(profile)
+    days = week_plan.build_week(t, sex, goal,
+                                lambda p: _generate_plan_day(p, feature="pregen"), lambda i, text: None,
+                                prompt_fn=_day_prompt_fn())
+    return days if all(d and week_plan.valid_day(d, t["kcal"]) for d in days) else None
+
+def _jobs_idle():
+    st = JOBS.stats()
+    return st["backlog"] == 0 and st["active"] == 0
+
         # ========== АДМИНКА ==========
-@bot.message_handler(func=lambda m: m.text == "🛠 Админ-панель")
+@ROUTER.text("🛠 Админ-панель", menu=True)
 def adm_panel(m):
     uid = m.from_user.id
     if not is_admin(uid):
         bot.reply_to(m, "Доступ только админам.", reply_markup=main_menu(uid)); return
-    kb = ReplyKeyboardMarkup(resize_keyboard=True)
-    kb.row(KeyboardButton("👥 Пользователи"), KeyboardButton("📣 Рассылка"))
-    kb.row(KeyboardButton("✏️ Сменить приветствие"))
-    kb.row(KeyboardButton("⬅️ Назад"))
-    bot.send_message(m.chat.id, "Админ-панель", reply_markup=kb)
+    bot.send_message(m.chat.id, "Админ-панель", reply_markup=ADMIN_MENU)
 
-@bot.message_handler(func=lambda m: m.text == "👥 Пользователи")
+@ROUTER.text("👥 Пользователи")
 def adm_users(m):
     if not is_admin(m.from_user.id): return
-    db = db_get()
-    bot.send_message(m.chat.id, f"Всего пользователей: <b>{len(db.get('users',{}))}</b>", reply_markup=back_menu())
+    s, c = STATS.summary(), AI_CACHE.summary()
+    feat_names = {"photo": "фото", "list": "список", "recipe": "рецепты", "plan": "план"}
+    feats = "\n".join(f"• {feat_names[f]}: {total} (сегодня {today})" for f, (total, today) in s["features"].items())
+    last = DB.broadcast_log(limit=1)
+    last_bc = (f"\nПоследняя рассылка: {last[0].get('sent', 0)} доставлено, {last[0].get('failed', 0)} ошибок"
+               if last else "")
+    bot.send_message(
+        m.chat.id,
+        f"Всего пользователей: <b>{s['users']}</b>\n"
+        f"Новых: сегодня {s['new_today']}, вчера {s['new_yesterday']}, за 7 дней {s['new_7d']}\n"
+        f"Активных: за день <b>{s['dau']}</b>, за неделю <b>{s['wau']}</b>\n"
+        f"Пол: 👨 {s['sex']['male']} / 👩 {s['sex']['female']}\n"
+        f"Цели: похудение {s['goal']['cut']}, поддержание {s['goal']['maintain']}, набор {s['goal']['bulk']}\n\n"
+        f"Функции (всего / сегодня):\n{feats}\n{last_bc}\n"
+        f"Кэш ИИ: попаданий <b>{c['hits'] + c['disk_hits']}</b> (с диска {c['disk_hits']}), "
+        f"промахов <b>{c['misses']}</b>, склеено {c['coalesced']}, hit rate {c['hit_rate']:.0%}, "
+        f"записей в памяти {c['size']}",
+        reply_markup=back_menu()
+    )
 
-@bot.message_handler(func=lambda m: m.text == "📣 Рассылка")
+@ROUTER.text("📣 Рассылка")
 def adm_broadcast(m):
     if not is_admin(m.from_user.id): return
     set_step(m.from_user.id, "adm_broadcast")
     bot.send_message(m.chat.id, "Пришлите текст рассылки (HTML разрешён).", reply_markup=back_menu())
 
-@bot.message_handler(func=lambda m: get_step(m.from_user.id) == "adm_broadcast")
+@ROUTER.state("adm_broadcast")
 def adm_broadcast_send(m):
     uid = m.from_user.id
     if "Назад" in (m.text or ""):
         reset_flow(uid); bot.send_message(m.chat.id, "Отменено.", reply_markup=main_menu(uid)); return
     reset_flow(uid)
-    run_bg(_broadcast_bg, m)
+    if not BROADCAST.start(m.text, m.chat.id):
+        bot.send_message(m.chat.id, "⏳ Уже идёт другая рассылка — дождитесь её завершения.", reply_markup=main_menu(uid))
+        return
     bot.send_message(m.chat.id, "🚀 Запустил рассылку в фоне.", reply_markup=main_menu(uid))
 
-def _broadcast_bg(m):
-    text = m.text
-    db = db_get()
-    users = list(db.get("users", {}).keys())
-    sent = 0
-    for suid in users:
-        try:
-            bot.send_message(int(suid), text, disable_web_page_preview=True)
-            sent += 1
-            time.sleep(0.03)
-        except Exception as e:
-            print("broadcast err to", suid, e)
-    with LOCK:
-        db = _load()
-        db["broadcast_log"].append({"at": datetime.utcnow().isoformat(), "sent": sent})
-        _save(db)
-    try:
-        bot.send_message(m.chat.id, f"Готово. Отправлено: <b>{sent}</b>")
-    except: pass
-
-@bot.message_handler(func=lambda m: m.text == "✏️ Сменить приветствие")
+@ROUTER.text("✏️ Сменить приветствие")
 def adm_welcome(m):
     if not is_admin(m.from_user.id): return
     set_step(m.from_user.id, "adm_welcome")
     bot.send_message(m.chat.id, "Пришлите новый текст приветствия (HTML ок).", reply_markup=back_menu())
 
-@bot.message_handler(func=lambda m: get_step(m.from_user.id) == "adm_welcome")
+@ROUTER.state("adm_welcome")
 def adm_welcome_set(m):
     uid = m.from_user.id
     if "Назад" in (m.text or ""):
@@ -530,28 +1068,86 @@ def adm_welcome_set(m):
     reset_flow(uid)
     bot.send_message(m.chat.id, "Готово. Новый текст сохранён ✅", reply_markup=main_menu(uid))
     # ========== AUTO-REGISTER USER ==========
-@bot.message_handler(func=lambda m: True, content_types=['text','photo','document','audio','video','sticker','voice'])
+KNOWN_USERS = set()  # uid, уже проверенные в этом процессе
+
 def ensure_user(m):
     """
-    Перехватчик в самом конце: регистрируем юзера в БД при первом действии.
-    Возвращает управление предыдущим хендлерам (мы уже всё описали выше),
-    поэтому тут только быстрая запись и no-op.
+    Вызывается роутером для каждого сообщения: регистрируем юзера в БД при первом действии.
+    Повторно БД не читаем — достаточно KNOWN_USERS и отметки активности за сегодня.
     """
+    uid = m.from_user.id
+    # после _mark_gone юзера нет в KNOWN_USERS — первое же сообщение снимет blocked
+    if uid in KNOWN_USERS and STATS.seen_today(uid):
+        return
     try:
-        u = db_get_user(m.from_user.id)
+        u = db_get_user(uid)
         if not u:
-            db_set_user(m.from_user.id, {
+            db_set_user(uid, {
                 "first_name": m.from_user.first_name,
                 "username": m.from_user.username,
                 "created_at": datetime.utcnow().isoformat()
             })
+        elif u.get("blocked"):
+            # написал — значит, снова разблокировал бота: возвращаем в рассылки
+            db_set_user(uid, {"blocked": False})
+        # первое действие за день — для DAU/WAU
+        if not STATS.seen_today(uid):
+            today = STATS.active(uid, u.get("last_seen"))
+            if u.get("last_seen") != today:
+                db_set_user(uid, {"last_seen": today})
+        KNOWN_USERS.add(uid)
     except Exception as e:
-        print("ensure_user err:", e)
-    # НИЧЕГО не отвечаем — чтобы не мешать конкретным хендлерам.
+        log("ensure_user", error=e)
 
 # ========== MAIN ==========
-if __name__ == "__main__":
-    print("Starting (webhook)…")
+def run_polling(port):
+    """
+    RUN_MODE=polling: апдейты тянутся getUpdates пачками (см. polling.py), публичный HTTPS не нужен.
+    Flask остаётся в фоне ради / и /metrics. SIGTERM — дорабатываем принятое и выходим.
+    """
+    from polling import LongPoller
+    bot.remove_webhook()
+    threading.Thread(target=lambda: app.run(host="0.0.0.0", port=port), name="http", daemon=True).start()
+    poller = LongPoller(bot, UPDATES, timeout=int(os.getenv("POLL_TIMEOUT", "25")))
+    poller.install_signals()
+    drain = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "30"))
+    poller.run(drain_timeout=drain)
+    shutdown(drain)
+    log("stopped", mode="polling")
+
+def shutdown(drain):
+    """
+    Новые апдейты уже не принимаются. Рассылка останавливается после текущей пачки
+    (курсор сохранён — resume() продолжит), предгенерация снимается, интерактивные
+    задачи доделываются первыми; не успевшие остаются в JOURNAL до следующего старта.
+    """
+    BROADCAST.stop()
+    JOBS.shutdown(timeout=drain)
+    DB.close()
+
+def run_webhook(port):
+    import signal
     setup_webhook()
-    port = int(os.getenv("PORT", "10000"))
+    drain = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "30"))
+
+    def on_term(*_):
+        UPDATES.stop(drain=True, timeout=drain)
+        shutdown(drain)
+        log("stopped", mode="webhook")
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, on_term)
     app.run(host="0.0.0.0", port=port)
+
+if __name__ == "__main__":
+    mode = os.getenv("RUN_MODE", "webhook")
+    log("starting", mode=mode)
+    recover_jobs()
+    BROADCAST.resume()
+    if os.getenv("PLAN_PREGEN", "1") == "1":
+        PLANS.start_pregen(_jobs_idle, _pregen_plan, interval=float(os.getenv("PLAN_PREGEN_INTERVAL", "60")),
+                           submit=lambda fn, b: JOBS.submit(None, fn, b, prio=PRIO_PREGEN, dedup="pregen"))
+    port = int(os.getenv("PORT", "10000"))
+    if mode == "polling":
+        run_polling(port)
+    else:
+        run_webhook(port)
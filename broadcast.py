@@ -0,0 +1,264 @@
+# =======================
+# Broadcast engine — token bucket, 429 backoff, resumable cursor
+# =======================
+import threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from metrics import log
+
+# Bot API: ~30 сообщений/сек глобально, 1/сек в один чат (в рассылке — по одному на чат)
+GLOBAL_RATE = 28.0
+MIN_RATE = 5.0
+YIELD_MAX = 2.0   # сколько пачка рассылки максимум ждёт интерактивные задачи
+
+# Ошибки, после которых пользователю больше не пишем
+_GONE_MARKERS = (
+    "bot was blocked by the user",
+    "user is deactivated",
+    "chat not found",
+    "bot was kicked",
+    "bot can't initiate conversation",
+)
+
+
+class TokenBucket:
+    """Потокобезопасный token bucket с возможностью общей паузы (для 429)."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self._tokens = self.burst
+        self._ts = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = float(rate)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.burst, self._tokens + (now - self._ts) * self.rate)
+                    self._ts = now
+                    if self._tokens >= 1.0:
+                        self._tokens -= 1.0
+                        return
+                    wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def retry_after_of(e):
+    """Секунды из 429 или None, если ошибка не 429."""
+    if getattr(e, "error_code", None) != 429:
+        return None
+    params = (getattr(e, "result_json", None) or {}).get("parameters") or {}
+    return float(params.get("retry_after", 1))
+
+
+def _is_gone(e):
+    code = getattr(e, "error_code", None)
+    desc = str(getattr(e, "description", "") or e).lower()
+    return code in (400, 403) and any(x in desc for x in _GONE_MARKERS)
+
+
+class BroadcastEngine:
+    """
+    Рассылка пачками по chunk пользователей: внутри пачки — workers параллельных
+    отправителей под общим token bucket, после пачки курсор (последний uid)
+    сохраняется в БД.
+    После рестарта resume() продолжает с сохранённого курсора
+    (последняя незавершённая пачка может уйти повторно).
+    spawn(fn, state) -> bool запускает fn(state) во внешнем пуле (иначе — свой поток);
+    пока yield_to() истинно, следующая пачка ждёт (не дольше YIELD_MAX секунд).
+    stop() завершает рассылку после текущей пачки, состояние остаётся для resume().
+    Рассылка, упавшая с ошибкой, пишется в лог рассылок с полем error, её состояние
+    стирается (иначе start() отказывал бы до рестарта), админ получает сообщение.
+    """
+
+    def __init__(self, bot, load_state, save_state, list_users, count_users, mark_gone, log_done,
+                 rate=GLOBAL_RATE, workers=8, chunk=200, progress_every=3.0, spawn=None, yield_to=None):
+        self.bot = bot
+        self.load_state = load_state      # () -> dict | None
+        self.save_state = save_state      # (dict | None) -> None
+        self.list_users = list_users      # (after_uid, limit) -> [uid, ...] по возрастанию, без заблокированных
+        self.count_users = count_users    # () -> int
+        self.mark_gone = mark_gone        # (uid) -> None
+        self.log_done = log_done          # (dict) -> None
+        self.max_rate = rate
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self.chunk = chunk
+        self.progress_every = progress_every
+        self.spawn = spawn
+        self.yield_to = yield_to
+        self._lock = threading.Lock()
+        self._running = False
+        self._stop = threading.Event()
+        self._ok_streak = 0
+
+    def running(self):
+        return self._running
+
+    def stop(self):
+        self._stop.set()
+
+    def start(self, text, admin_chat_id) -> bool:
+        with self._lock:
+            if self.running() or self.load_state():
+                return False
+            total = self.count_users()
+            state = {
+                "id": uuid.uuid4().hex[:8],
+                "text": text,
+                "admin_chat": admin_chat_id,
+                "progress_msg": None,
+                "total": total,
+                "cursor": None,   # последний обработанный uid
+                "done": 0,
+                "sent": 0, "failed": 0, "pruned": 0,
+                "started_at": datetime.utcnow().isoformat(),
+            }
+            self.save_state(state)
+            self._spawn(state)
+            return True
+
+    def resume(self) -> bool:
+        with self._lock:
+            state = self.load_state()
+            if not state or self.running():
+                return False
+            log("broadcast_resume", id=state["id"], done=state["done"], total=state["total"])
+            self._spawn(state)
+            return True
+
+    def _spawn(self, state):
+        self._running = True
+        self._stop.clear()
+        if self.spawn and self.spawn(self._run, state):
+            return
+        threading.Thread(target=self._run, args=(state,), name="broadcast", daemon=True).start()
+
+    def _yield(self):
+        end = time.monotonic() + YIELD_MAX
+        while self.yield_to and self.yield_to() and time.monotonic() < end and not self._stop.is_set():
+            time.sleep(0.1)
+
+    # ---------- sending ----------
+    def _adapt(self, hit_429):
+        with self._lock:
+            if hit_429:
+                self._ok_streak = 0
+                self.bucket.set_rate(max(MIN_RATE, self.bucket.rate * 0.7))
+            else:
+                self._ok_streak += 1
+                if self._ok_streak >= 100 and self.bucket.rate < self.max_rate:
+                    self._ok_streak = 0
+                    self.bucket.set_rate(min(self.max_rate, self.bucket.rate * 1.1))
+
+    def _send_one(self, uid, text):
+        """'sent' | 'gone' | 'failed'"""
+        for _ in range(4):
+            self.bucket.acquire()
+            try:
+                self.bot.send_message(int(uid), text, disable_web_page_preview=True)
+                self._adapt(False)
+                return "sent"
+            except Exception as e:
+                ra = retry_after_of(e)
+                if ra is not None:
+                    self.bucket.pause(ra)
+                    self._adapt(True)
+                    continue
+                if _is_gone(e):
+                    try: self.mark_gone(uid)
+                    except Exception as e2: log("broadcast_prune", error=e2, uid=uid)
+                    return "gone"
+                log("broadcast_send", error=e, uid=uid)
+                return "failed"
+        return "failed"
+
+    # ---------- progress ----------
+    def _progress_text(self, st, done=False):
+        total = max(st["total"], st["done"])
+        head = "✅ Рассылка завершена" if done else "📣 Рассылка идёт…"
+        return (
+            f"{head}\n"
+            f"Прогресс: <b>{st['done']}/{total}</b>\n"
+            f"Отправлено: <b>{st['sent']}</b> · ошибок: {st['failed']} · удалено неактивных: {st['pruned']}"
+        )
+
+    def _report(self, st, done=False):
+        text = self._progress_text(st, done)
+        try:
+            if st.get("progress_msg"):
+                self.bot.edit_message_text(text, st["admin_chat"], st["progress_msg"])
+            else:
+                st["progress_msg"] = self.bot.send_message(st["admin_chat"], text).message_id
+        except Exception as e:
+            if "message is not modified" not in str(e):
+                log("broadcast_progress", error=e)
+
+    def _run(self, st):
+        try:
+            self._run_chunks(st)
+        except Exception as e:
+            log("broadcast_failed", error=e, id=st["id"], done=st["done"], total=st["total"])
+            self._fail(st, e)
+        finally:
+            self._running = False
+
+    def _fail(self, st, e):
+        try:
+            self.log_done(self._summary(st, error=f"{type(e).__name__}: {e}"))
+        finally:
+            self.save_state(None)
+        try:
+            self.bot.send_message(st["admin_chat"], f"⚠️ Рассылка прервана ошибкой на {st['done']}/{st['total']}: "
+                                                    f"{type(e).__name__}. Отправлено: {st['sent']}.")
+        except Exception as e2:
+            log("broadcast_progress", error=e2)
+
+    def _summary(self, st, **extra):
+        return dict({
+            "id": st["id"],
+            "at": datetime.utcnow().isoformat(),
+            "started_at": st["started_at"],
+            "sent": st["sent"], "failed": st["failed"], "pruned": st["pruned"],
+        }, **extra)
+
+    def _run_chunks(self, st):
+        last_report = 0.0
+        self._report(st)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcast") as pool:
+            while True:
+                if self._stop.is_set():
+                    log("broadcast_stopped", id=st["id"], done=st["done"], total=st["total"])
+                    return
+                self._yield()
+                batch = self.list_users(st["cursor"], self.chunk)
+                if not batch:
+                    break
+                for res in pool.map(lambda u: self._send_one(u, st["text"]), batch):
+                    if res == "sent": st["sent"] += 1
+                    elif res == "gone": st["pruned"] += 1
+                    else: st["failed"] += 1
+                st["cursor"] = int(batch[-1])
+                st["done"] += len(batch)
+                self.save_state(st)
+                if time.monotonic() - last_report >= self.progress_every:
+                    last_report = time.monotonic()
+                    self._report(st)
+        self._report(st, done=True)
+        self.log_done(self._summary(st))
+        self.save_state(None)
@@ -0,0 +1,151 @@
+# =======================
+# Food diary — записи КБЖУ пользователя и сводки «за сегодня» / «за 7 дней»
+# =======================
+import re, time, sqlite3, threading
+from array import array
+from collections import OrderedDict
+
+RING_DAYS = 8                 # сегодня + 7 прошлых дней
+_FIELDS = 6                   # day, n, kcal, p, f, c
+_EMPTY = -1.0
+
+# пробел внутри числа — только разделитель тысяч («1 250»), иначе «2 45 ккал» слипалось бы в 245
+_KCAL_RE = re.compile(r"((?:\d{1,3}(?:[ \u00a0\u202f]\d{3})+|\d+)(?:[.,]\d+)?)\s*ккал", re.IGNORECASE)
+_BJU_RE = re.compile(r"Б\s*/\s*Ж\s*/\s*У[^\d]{0,10}(\d+(?:[.,]\d+)?)\s*/\s*(\d+(?:[.,]\d+)?)\s*/\s*(\d+(?:[.,]\d+)?)", re.IGNORECASE)
+
+
+def _num(s):
+    return float(re.sub(r"\s", "", s).replace(",", "."))
+
+
+def parse_estimate(text):
+    """(ккал, б, ж, у) из ответа модели: строка «Итого…»/«Оценка…», иначе последняя оценка в тексте."""
+    lines = (text or "").splitlines()
+    pref = [ln for ln in lines if re.search(r"итого|оценка", ln, re.IGNORECASE)]
+    for chunk in (pref[-1:] if pref else []) + ["\n".join(lines)]:
+        kcal = _KCAL_RE.findall(chunk)
+        bju = _BJU_RE.findall(chunk)
+        if kcal and bju:
+            return (_num(kcal[-1]),) + tuple(_num(x) for x in bju[-1])
+    return None
+
+
+class _Ring:
+    """Дневные суммы юзера за RING_DAYS дней: плоский array('d'), слот = day % RING_DAYS."""
+    __slots__ = ("data",)
+
+    def __init__(self):
+        self.data = array("d", [_EMPTY, 0, 0, 0, 0, 0] * RING_DAYS)
+
+    def add(self, day, n, kcal, p, f, c):
+        i = (day % RING_DAYS) * _FIELDS
+        d = self.data
+        if d[i] != day:
+            d[i:i + _FIELDS] = array("d", [day, 0, 0, 0, 0, 0])
+        d[i + 1] += n; d[i + 2] += kcal; d[i + 3] += p; d[i + 4] += f; d[i + 5] += c
+
+    def get(self, day):
+        i = (day % RING_DAYS) * _FIELDS
+        if self.data[i] != day:
+            return (0, 0.0, 0.0, 0.0, 0.0)
+        d = self.data
+        return (int(d[i + 1]), d[i + 2], d[i + 3], d[i + 4], d[i + 5])
+
+
+class FoodDiary:
+    """
+    Записи только дописываются (entries), а дневные и недельные суммы
+    обновляются в той же транзакции (daily, weekly). Для активных юзеров
+    последние дни лежат в памяти в _Ring — сводка без запросов к БД.
+    День считается по местному времени: tz_offset часов от UTC.
+    """
+
+    def __init__(self, path, tz_offset=3.0, cache_size=20000):
+        self.tz = tz_offset * 3600
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._rings = OrderedDict()   # uid -> _Ring
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS entries (uid INTEGER NOT NULL, ts REAL NOT NULL, kcal REAL, p REAL, f REAL, c REAL, src TEXT);"
+            "CREATE INDEX IF NOT EXISTS entries_uid_ts ON entries(uid, ts);"
+            "CREATE TABLE IF NOT EXISTS daily (uid INTEGER NOT NULL, day INTEGER NOT NULL, n INTEGER NOT NULL,"
+            " kcal REAL NOT NULL, p REAL NOT NULL, f REAL NOT NULL, c REAL NOT NULL, PRIMARY KEY (uid, day)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS weekly (uid INTEGER NOT NULL, week INTEGER NOT NULL, n INTEGER NOT NULL,"
+            " kcal REAL NOT NULL, p REAL NOT NULL, f REAL NOT NULL, c REAL NOT NULL, PRIMARY KEY (uid, week)) WITHOUT ROWID;"
+        )
+
+    def day_of(self, ts=None):
+        return int(((ts or time.time()) + self.tz) // 86400)
+
+    @staticmethod
+    def week_of(day):
+        return (day - 4) // 7   # 1970-01-05 (день 4) — понедельник
+
+    def _ring(self, uid, today):
+        """Кольцо юзера; при промахе — из daily за последние RING_DAYS дней. Вызывать под self._lock."""
+        r = self._rings.get(uid)
+        if r is not None:
+            self._rings.move_to_end(uid)
+            return r
+        r = _Ring()
+        for row in self._conn.execute(
+            "SELECT day, n, kcal, p, f, c FROM daily WHERE uid = ? AND day > ?", (uid, today - RING_DAYS)
+        ):
+            r.add(*row)
+        self._rings[uid] = r
+        while len(self._rings) > self.cache_size:
+            self._rings.popitem(last=False)
+        return r
+
+    def add(self, uid, kcal, p, f, c, src="", ts=None):
+        ts = ts or time.time()
+        day = self.day_of(ts)
+        vals = (kcal, p, f, c)
+        with self._lock:
+            today = self.day_of()
+            ring = self._ring(uid, today)   # до записи: иначе новая строка попала бы в кольцо дважды
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("INSERT INTO entries(uid, ts, kcal, p, f, c, src) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   (uid, ts) + vals + (src,))
+                for table, key, k in (("daily", "day", day), ("weekly", "week", self.week_of(day))):
+                    self._conn.execute(
+                        f"INSERT INTO {table}(uid, {key}, n, kcal, p, f, c) VALUES (?, ?, 1, ?, ?, ?, ?) "
+                        f"ON CONFLICT(uid, {key}) DO UPDATE SET n = n + 1, kcal = kcal + excluded.kcal, "
+                        "p = p + excluded.p, f = f + excluded.f, c = c + excluded.c",
+                        (uid, k) + vals,
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            if day > today - RING_DAYS:
+                ring.add(day, 1, *vals)
+
+    def today(self, uid):
+        """(записей, ккал, б, ж, у) за сегодня."""
+        day = self.day_of()
+        with self._lock:
+            return self._ring(uid, day).get(day)
+
+    def last_days(self, uid, days=7):
+        """Средние ккал/б/ж/у за дни с записями из последних days (включая сегодня): (дней, ккал, б, ж, у)."""
+        today = self.day_of()
+        with self._lock:
+            r = self._ring(uid, today)
+            rows = [r.get(today - i) for i in range(min(days, RING_DAYS))]
+        rows = [x for x in rows if x[0]]
+        if not rows:
+            return (0, 0.0, 0.0, 0.0, 0.0)
+        k = len(rows)
+        return (k,) + tuple(sum(x[i] for x in rows) / k for i in range(1, 5))
+
+    def this_week(self, uid):
+        """(записей, ккал, б, ж, у) за текущую календарную неделю (пн–вс)."""
+        with self._lock:
+            row = self._conn.execute("SELECT n, kcal, p, f, c FROM weekly WHERE uid = ? AND week = ?",
+                                     (uid, self.week_of(self.day_of()))).fetchone()
+        return tuple(row) if row else (0, 0.0, 0.0, 0.0, 0.0)
@@ -0,0 +1,115 @@
+# =======================
+# Update dispatcher — bounded queue + per-chat sharded workers
+# =======================
+import threading, queue, time
+
+from metrics import log
+
+
+def update_chat_id(update):
+    """chat_id апдейта (для шардирования). Если чата нет — update_id."""
+    for attr in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        msg = getattr(update, attr, None)
+        if msg is not None:
+            return msg.chat.id
+    cq = getattr(update, "callback_query", None)
+    if cq is not None:
+        if cq.message is not None:
+            return cq.message.chat.id
+        return cq.from_user.id
+    for attr in ("inline_query", "chosen_inline_result", "pre_checkout_query", "shipping_query", "my_chat_member", "chat_member"):
+        obj = getattr(update, attr, None)
+        if obj is not None:
+            frm = getattr(obj, "from_user", None)
+            if frm is not None:
+                return frm.id
+    return getattr(update, "update_id", 0)
+
+
+class UpdateDispatcher:
+    """
+    Апдейты одного чата обрабатываются строго по очереди (один шард = один поток),
+    разные чаты — параллельно. Общая глубина ограничена max_pending:
+    при переполнении submit() возвращает False, и вызывающий отдаёт Telegram ошибку
+    (Telegram повторит доставку позже).
+    """
+
+    def __init__(self, handler, workers=8, max_pending=1000, name="upd"):
+        self.handler = handler
+        self.max_pending = max_pending
+        self._pending = 0
+        self._processed = 0
+        self._shed = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._shards = [queue.Queue() for _ in range(max(1, workers))]
+        self._threads = []
+        for i, q in enumerate(self._shards):
+            t = threading.Thread(target=self._worker, args=(q,), name=f"{name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        self._closed = False
+
+    def submit(self, update, on_done=None) -> bool:
+        """on_done(update) — после обработки (и после ошибки хендлера)."""
+        with self._lock:
+            if self._closed or self._pending >= self.max_pending:
+                self._shed += 1
+                return False
+            self._pending += 1
+        shard = hash(update_chat_id(update)) % len(self._shards)
+        self._shards[shard].put((update, on_done))
+        return True
+
+    def submit_many(self, updates):
+        """Кладёт пачку апдейтов; возвращает число принятых."""
+        return sum(1 for u in updates if self.submit(u))
+
+    def _worker(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            update, on_done = item
+            try:
+                self.handler(update)
+            except Exception as e:
+                log("dispatch", error=e)
+            finally:
+                if on_done is not None:
+                    try: on_done(update)
+                    except Exception as e: log("dispatch_done", error=e)
+                with self._lock:
+                    self._pending -= 1
+                    self._processed += 1
+                    if self._pending == 0:
+                        self._idle.notify_all()
+
+    def depth(self):
+        with self._lock:
+            return self._pending
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "processed": self._processed,
+                "shed": self._shed,
+                "workers": len(self._shards),
+                "shard_depths": [q.qsize() for q in self._shards],
+            }
+
+    def stop(self, drain=True, timeout=30.0):
+        """Перестаёт принимать апдейты; при drain=True ждёт, пока очередь опустеет."""
+        with self._lock:
+            self._closed = True
+            if drain:
+                deadline = time.monotonic() + timeout
+                while self._pending > 0:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._idle.wait(left)
+        for q in self._shards:
+            q.put(None)
@@ -0,0 +1,129 @@
+# =======================
+# Flow store — шаги сценариев пользователей с TTL; память или общий SQLite
+# =======================
+import json, time, sqlite3, threading
+
+from metrics import log
+
+
+class FlowRecord:
+    __slots__ = ("step", "data", "expires")
+
+    def __init__(self, step, data=None, expires=0.0):
+        self.step = step
+        self.data = data      # dict с доп. полями или None
+        self.expires = expires
+
+
+class MemoryFlowBackend:
+    """Состояния в памяти процесса (один воркер)."""
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, uid):
+        return self._items.get(uid)
+
+    def put(self, uid, rec):
+        self._items[uid] = rec
+
+    def delete(self, uid):
+        self._items.pop(uid, None)
+
+    def sweep(self, now):
+        with self._lock:
+            dead = [uid for uid, r in list(self._items.items()) if r.expires <= now]
+            for uid in dead:
+                self._items.pop(uid, None)
+        return len(dead)
+
+    def count(self):
+        return len(self._items)
+
+
+class SqliteFlowBackend:
+    """
+    Состояния в файле SQLite: переживают рестарт процесса.
+    Бот при этом работает одним процессом — Storage (write-behind кэш юзеров),
+    KNOWN_USERS, счётчики STATS и порядок апдейтов чата живут в памяти процесса,
+    так что несколько воркеров (gunicorn -w N) теряли бы записи.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS flows (uid INTEGER PRIMARY KEY, step TEXT NOT NULL, data TEXT, expires REAL NOT NULL)"
+        )
+
+    def get(self, uid):
+        with self._lock:
+            row = self._db.execute("SELECT step, data, expires FROM flows WHERE uid = ?", (uid,)).fetchone()
+        if not row:
+            return None
+        return FlowRecord(row[0], json.loads(row[1]) if row[1] else None, row[2])
+
+    def put(self, uid, rec):
+        data = json.dumps(rec.data, ensure_ascii=False) if rec.data else None
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO flows(uid, step, data, expires) VALUES (?, ?, ?, ?)",
+                (uid, rec.step, data, rec.expires),
+            )
+
+    def delete(self, uid):
+        with self._lock:
+            self._db.execute("DELETE FROM flows WHERE uid = ?", (uid,))
+
+    def sweep(self, now):
+        with self._lock:
+            return self._db.execute("DELETE FROM flows WHERE expires <= ?", (now,)).rowcount
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM flows").fetchone()[0]
+
+
+class FlowStore:
+    """
+    Текущий шаг сценария пользователя. Запись живёт ttl секунд с последнего set();
+    просроченные не возвращаются и удаляются фоновым sweeper'ом.
+    """
+
+    def __init__(self, backend, ttl=3600.0, sweep_interval=60.0):
+        self.backend = backend
+        self.ttl = ttl
+        self._stop = threading.Event()
+        t = threading.Thread(target=self._sweeper, args=(sweep_interval,), name="flow-sweep", daemon=True)
+        t.start()
+
+    def set(self, uid, step, **extra):
+        self.backend.put(uid, FlowRecord(step, extra or None, time.time() + self.ttl))
+
+    def get(self, uid):
+        rec = self.backend.get(uid)
+        if rec is None or rec.expires <= time.time():
+            return None
+        return rec
+
+    def step(self, uid):
+        rec = self.get(uid)
+        return rec.step if rec else None
+
+    def clear(self, uid):
+        self.backend.delete(uid)
+
+    def _sweeper(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.backend.sweep(time.time())
+            except Exception as e:
+                log("flow_sweep", error=e)
+
+
+def make_flow_store(kind="memory", path="flows.sqlite3", ttl=3600.0):
+    backend = SqliteFlowBackend(path) if kind == "sqlite" else MemoryFlowBackend()
+    return FlowStore(backend, ttl=ttl)
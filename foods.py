@@ -0,0 +1,267 @@
+# =======================
+# Foods — локальная таблица КБЖУ, нечёткий поиск и разбор «Продукт 120 г; …»
+# =======================
+import os, re
+from array import array
+from difflib import SequenceMatcher
+from functools import lru_cache
+from html import escape
+
+FOODS_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "foods.csv")
+
+# Граммы в бытовых единицах
+UNIT_GRAMS = {"tbsp": 15.0, "tsp": 5.0, "pinch": 1.0, "glass": 200.0}
+MIN_SCORE = 0.72
+BARE_GRAMS_FROM = 20   # число без единиц: «банан 2» — штуки, «банан 20» — граммы
+
+_ENDINGS = re.compile(
+    r"(ями|ами|ого|его|ому|ему|ыми|ими|ах|ях|ая|яя|ое|ее|ые|ие|ой|ей|ий|ый|ую|юю|ов|ев|ам|ям|ом|ем|а|я|о|е|ы|и|у|ю|ь|й)$"
+)
+_NUM = r"(\d+(?:[.,]\d+)?)"
+_UNIT = (
+    r"(кг|килограмм\w*|гр?\.?|грамм\w*|мл|л\.?|литр\w*|шт\.?|штук\w*|кусоч\w*|кус\w*|ломтик\w*|"
+    r"ст\.?\s*л\.?|стол\w*\s+ложк\w*|ч\.?\s*л\.?|чайн\w*\s+ложк\w*|ложк\w*|щепотк\w*|стакан\w*)"
+)
+_QTY_RE = re.compile(_NUM + r"(?!\s*%)\s*" + _UNIT + r"?(?![а-яa-z\d%])", re.IGNORECASE)
+_BARE_UNIT_RE = re.compile(r"(?<![а-яa-z])" + _UNIT + r"(?![а-яa-z])", re.IGNORECASE)
+
+
+def normalize(text):
+    text = (text or "").lower().replace("ё", "е")
+    return re.sub(r"[^\w.%\- ]+", " ", text).strip()
+
+
+def stem(token):
+    """Грубый стеммер: срезаем падежные/родовые окончания у длинных слов."""
+    token = token.strip(".-")
+    return _ENDINGS.sub("", token) if len(token) > 3 else token
+
+
+def _tokens(text):
+    """[(stem, is_abbr)] — «кур.» считаем сокращением (совпадение по префиксу)."""
+    out = []
+    for raw in normalize(text).replace("-", " ").split():
+        if not re.search(r"[а-яa-z]", raw):
+            continue
+        out.append((stem(raw), raw.endswith(".")))
+    return out
+
+
+def _trigrams(word):
+    w = f"  {word} "
+    return {w[i:i + 3] for i in range(len(w) - 2)}
+
+
+class FoodTable:
+    """
+    Таблица продуктов: столбцы КБЖУ лежат в array('d') (по индексу продукта),
+    поиск — через триграммный индекс по токенам названий и синонимов.
+    """
+
+    def __init__(self, path=FOODS_CSV):
+        self.names = []
+        self.kcal, self.protein, self.fat, self.carbs = array("d"), array("d"), array("d"), array("d")
+        self.piece = array("d")
+        self._aliases = []      # [(food_idx, [(stem, False)...])]
+        self._index = {}        # trigram -> set(alias_idx)
+        # кэш на экземпляр: lru_cache на методе держал бы self в общем кэше класса
+        self.match = lru_cache(maxsize=4096)(self._match)
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                name, aliases, kcal, p, fat, c, piece = line.split(";")
+                idx = len(self.names)
+                self.names.append(name)
+                self.kcal.append(float(kcal)); self.protein.append(float(p))
+                self.fat.append(float(fat)); self.carbs.append(float(c))
+                self.piece.append(float(piece) if piece else 0.0)
+                for alias in [name] + [a for a in aliases.split("|") if a]:
+                    self._add_alias(idx, alias)
+
+    def _add_alias(self, idx, alias):
+        toks = _tokens(alias)
+        if not toks:
+            return
+        a_idx = len(self._aliases)
+        self._aliases.append((idx, toks))
+        for st, _ in toks:
+            for g in _trigrams(st):
+                self._index.setdefault(g, set()).add(a_idx)
+
+    @staticmethod
+    def _tok_score(q, is_abbr, a):
+        if q == a:
+            return 1.0
+        if (is_abbr or len(q) >= 3) and a.startswith(q):
+            return 0.9
+        if len(a) >= 3 and q.startswith(a):
+            return 0.85
+        r = SequenceMatcher(None, q, a).ratio()
+        return r if r >= 0.8 else 0.0
+
+    def _match(self, name):
+        """(food_idx, score) лучшего совпадения или (None, 0)."""
+        q = _tokens(name)
+        if not q:
+            return None, 0.0
+        cand = set()
+        for st, _ in q:
+            for g in _trigrams(st):
+                cand |= self._index.get(g, set())
+        best, best_score = None, 0.0
+        for a_idx in cand:
+            food, a = self._aliases[a_idx]
+            total = 0.0
+            for st, abbr in q:
+                total += max(self._tok_score(st, abbr, at) for at, _ in a)
+            # Dice по токенам: лишние слова с любой стороны снижают оценку
+            score = 2 * total / (len(q) + len(a))
+            if score > best_score or (score == best_score and best is not None and len(a) < len(self._aliases[best][1])):
+                best, best_score = a_idx, score
+        if best is None or best_score < MIN_SCORE:
+            return None, best_score
+        return self._aliases[best][0], best_score
+
+    def totals(self, ids, grams):
+        """Сумма КБЖУ по (индекс продукта, граммы) — скалярные произведения по столбцам."""
+        return tuple(
+            sum(col[i] * g for i, g in zip(ids, grams)) / 100.0
+            for col in (self.kcal, self.protein, self.fat, self.carbs)
+        )
+
+
+def _unit_kind(unit):
+    u = (unit or "").lower().replace(" ", "")
+    if not u:
+        return None
+    if u.startswith("ложк"):
+        return "tbsp"
+    if u.startswith("ломт"):
+        return "pcs"
+    if u.startswith("кг") or u.startswith("килог"):
+        return "kg"
+    if u.startswith("г"):
+        return "g"
+    if u.startswith("мл"):
+        return "g"
+    if u.startswith("л"):
+        return "kg"
+    if u.startswith("шт") or u.startswith("кус"):
+        return "pcs"
+    if u.startswith("ч") or u.startswith("чайн"):
+        return "tsp"
+    if u.startswith("ст") and not u.startswith("стакан"):
+        return "tbsp"
+    if u.startswith("щеп"):
+        return "pinch"
+    if u.startswith("стакан"):
+        return "glass"
+    return None
+
+
+def split_items(text):
+    """Разбивает список по «;», переводам строк и запятым (но не «0,5»)."""
+    parts = re.split(r"[;\n]|,(?!\d)", text or "")
+    return [p.strip(" .\t") for p in parts if p.strip(" .\t")]
+
+
+def parse_item(item):
+    """'Кур. грудка 150 г' -> (name, qty, unit_kind). qty/unit могут быть None."""
+    found = list(_QTY_RE.finditer(item))
+    # «творог 5% 200 г»: берём количество с единицей, иначе последнее число
+    m = next((x for x in found if x.group(2)), found[-1] if found else None)
+    if m:
+        qty = float(m.group(1).replace(",", "."))
+        kind = _unit_kind(m.group(2))
+        name = (item[:m.start()] + " " + item[m.end():]).strip()
+        return name, qty, kind
+    m = _BARE_UNIT_RE.search(item)   # «ложка сахара», «щепотка соли»
+    if m:
+        name = (item[:m.start()] + " " + item[m.end():]).strip()
+        return name, 1.0, _unit_kind(m.group(1))
+    return item.strip(), None, None
+
+
+def to_grams(table, food, qty, kind):
+    """Граммы или None, если вес не определить без модели."""
+    if qty is None:
+        return None
+    if kind == "g":
+        return qty
+    if kind == "kg":
+        return qty * 1000
+    if kind in UNIT_GRAMS:
+        return qty * UNIT_GRAMS[kind]
+    piece = table.piece[food]
+    if kind == "pcs":
+        return qty * piece if piece else None
+    # число без единиц: меньше BARE_GRAMS_FROM — штуки (если у продукта есть вес штуки), иначе граммы
+    if qty >= BARE_GRAMS_FROM:
+        return qty
+    return qty * piece if piece else None
+
+
+class ListResult:
+    __slots__ = ("rows", "unmatched")
+
+    def __init__(self):
+        self.rows = []        # [(name, grams, kcal, p, f, c)]
+        self.unmatched = []   # исходные строки, которые не разобрали локально
+
+
+def parse_list(table, text):
+    res = ListResult()
+    ids, grams, names = [], [], []
+    for item in split_items(text):
+        name, qty, kind = parse_item(item)
+        food, _ = table.match(normalize(name))
+        g = to_grams(table, food, qty, kind) if food is not None else None
+        if food is None or g is None:
+            res.unmatched.append(item)
+            continue
+        ids.append(food); grams.append(g); names.append(table.names[food])
+    for name, food, g in zip(names, ids, grams):
+        res.rows.append((name, g) + table.totals([food], [g]))
+    return res
+
+
+def total_of(rows):
+    return tuple(sum(r[i] for r in rows) for i in range(2, 6))
+
+
+def _fmt(x):
+    return f"{x:.0f}" if x >= 10 or x == int(x) else f"{x:.1f}"
+
+
+def render(rows, note=""):
+    """HTML-ответ для «КБЖУ по списку»."""
+    lines = ["🧾 <b>Разбор</b>"]
+    for name, g, kcal, p, f, c in rows:
+        lines.append(f"• {name} — {_fmt(g)} г: {_fmt(kcal)} ккал, Б/Ж/У {_fmt(p)}/{_fmt(f)}/{_fmt(c)}")
+    kcal, p, f, c = total_of(rows)
+    lines.append("")
+    lines.append(f"<b>Итого:</b> {_fmt(kcal)} ккал, Б/Ж/У {_fmt(p)}/{_fmt(f)}/{_fmt(c)}")
+    if note:
+        lines.append("")
+        lines.append(note)
+    return "\n".join(lines)
+
+
+_AI_ROW_RE = re.compile(
+    r"^\s*[-•*\d.)]*\s*(?P<name>[^|]+?)\s*\|\s*(?P<g>[\d.,]+)[^|]*\|\s*(?P<k>[\d.,]+)[^|]*\|\s*(?P<p>[\d.,]+)[^|]*\|"
+    r"\s*(?P<f>[\d.,]+)[^|]*\|\s*(?P<c>[\d.,]+)"
+)
+
+
+def parse_ai_rows(text):
+    """Строки «название | г | ккал | б | ж | у» из ответа модели (название — уже для HTML)."""
+    rows = []
+    for line in (text or "").splitlines():
+        m = _AI_ROW_RE.match(line)
+        if not m:
+            continue
+        num = lambda k: float(m.group(k).replace(",", "."))
+        rows.append((escape(m.group("name").strip()), num("g"), num("k"), num("p"), num("f"), num("c")))
+    return rows
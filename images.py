@@ -0,0 +1,82 @@
+# =======================
+# Images — выбор размера, даунскейл/перекодирование, pHash
+# =======================
+import io, threading
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+
+VISION_MIN_SIDE = 768    # меньшая сторона, которой достаточно для распознавания блюда
+VISION_MAX_SIDE = 1024   # после даунскейла большая сторона не больше этого
+JPEG_QUALITY = 80
+
+
+def pick_photo_size(sizes, min_side=VISION_MIN_SIDE):
+    """Самый маленький PhotoSize, у которого меньшая сторона >= min_side; иначе самый большой."""
+    sizes = sorted(sizes, key=lambda p: p.width * p.height)
+    for p in sizes:
+        if min(p.width, p.height) >= min_side:
+            return p
+    return sizes[-1]
+
+
+def dhash(img, size=8):
+    """64-битный разностный хэш (dHash): устойчив к пережатию и масштабу."""
+    g = img.convert("L").resize((size + 1, size), Image.BILINEAR)
+    px = list(g.getdata())
+    h = 0
+    for row in range(size):
+        for col in range(size):
+            left = px[row * (size + 1) + col]
+            right = px[row * (size + 1) + col + 1]
+            h = (h << 1) | (left > right)
+    return h
+
+
+def preprocess(data, max_side=VISION_MAX_SIDE, quality=JPEG_QUALITY):
+    """
+    Байты картинки -> (jpeg_bytes, dhash).
+    Применяем EXIF-поворот, уменьшаем до max_side, сохраняем JPEG без метаданных.
+    """
+    img = Image.open(io.BytesIO(data))
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+    out = io.BytesIO()
+    # exif/icc не передаём — метаданные не попадают в выходной файл
+    img.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue(), dhash(img)
+
+
+class PhashIndex:
+    """
+    Недавние хэши фото -> значение; поиск почти-дубликатов по расстоянию Хэмминга
+    только внутри scope (юзер + подпись): похожее блюдо другого юзера — не дубликат.
+    """
+
+    def __init__(self, max_items=5000, max_distance=2):
+        self.max_items = max_items
+        self.max_distance = max_distance
+        self._items = OrderedDict()   # (scope, hash) -> value
+        self._lock = threading.Lock()
+
+    def add(self, scope, h, value):
+        with self._lock:
+            self._items[(scope, h)] = value
+            self._items.move_to_end((scope, h))
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def find(self, scope, h):
+        with self._lock:
+            if (scope, h) in self._items:
+                return self._items[(scope, h)]
+            best, best_d = None, self.max_distance + 1
+            for (s, k), v in self._items.items():
+                if s != scope:
+                    continue
+                d = bin(k ^ h).count("1")
+                if d < best_d:
+                    best, best_d = v, d
+            return best
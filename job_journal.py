@@ -0,0 +1,95 @@
+# =======================
+# Job journal — задачи пользователей в SQLite: переживают рестарт, ключ идемпотентности
+# =======================
+import json, time, sqlite3, threading
+
+from metrics import log
+
+QUEUED, RUNNING, DONE = "queued", "running", "done"
+
+
+class JournalEntry:
+    __slots__ = ("key", "task", "owner", "chat_id", "wait_id", "payload", "attempts", "created")
+
+    def __init__(self, key, task, owner, chat_id, wait_id, payload, attempts, created):
+        self.key = key
+        self.task = task
+        self.owner = owner
+        self.chat_id = chat_id
+        self.wait_id = wait_id
+        self.payload = json.loads(payload)
+        self.attempts = attempts
+        self.created = created
+
+
+class JobJournal:
+    """
+    Строка на задачу: begin() при постановке (INSERT OR IGNORE по ключу), start() перед
+    каждой попыткой, finish() после. Всё, что не дошло до DONE, после рестарта
+    отдаёт unfinished() — выполнение «хотя бы раз»: задача, упавшая вместе с процессом
+    после ответа пользователю, может повториться.
+    Завершённые строки хранятся keep_done секунд: повторная доставка того же
+    апдейта не порождает вторую задачу.
+    """
+
+    def __init__(self, path, keep_done=24 * 3600):
+        self.keep_done = keep_done
+        self.tasks = {}                  # имя -> функция (только их можно восстановить)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (key TEXT PRIMARY KEY, task TEXT NOT NULL, owner INTEGER, "
+            "chat_id INTEGER, wait_id INTEGER, payload TEXT NOT NULL, state TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state, updated)")
+        self._last_prune = 0.0
+
+    def task(self, fn):
+        """Декоратор: задача восстанавливается после рестарта по имени функции."""
+        self.tasks[fn.__name__] = fn
+        return fn
+
+    def begin(self, key, task, owner, chat_id, wait_id, payload) -> bool:
+        """False — задача с таким ключом уже есть (повтор того же запроса)."""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO jobs(key, task, owner, chat_id, wait_id, payload, state, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, task, owner, chat_id, wait_id, json.dumps(payload, ensure_ascii=False), QUEUED, now, now),
+            )
+            if now - self._last_prune > 600:
+                self._last_prune = now
+                self._conn.execute("DELETE FROM jobs WHERE state = ? AND updated < ?", (DONE, now - self.keep_done))
+        return cur.rowcount == 1
+
+    def start(self, key):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET state = ?, attempts = attempts + 1, updated = ? WHERE key = ?",
+                               (RUNNING, time.time(), key))
+
+    def finish(self, key):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET state = ?, updated = ? WHERE key = ?", (DONE, time.time(), key))
+
+    def unfinished(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, task, owner, chat_id, wait_id, payload, attempts, created FROM jobs "
+                "WHERE state != ? ORDER BY created", (DONE,)
+            ).fetchall()
+        entries = []
+        for row in rows:
+            try:
+                entries.append(JournalEntry(*row))
+            except ValueError as e:
+                log("journal_entry", error=e, key=row[0])
+                self.finish(row[0])
+        return entries
+
+    def stats(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
@@ -0,0 +1,192 @@
+# =======================
+# Job scheduler — priority classes, per-user limits, round-robin fairness, dedup, cancellation
+# =======================
+import time, threading
+from collections import deque
+
+from metrics import log, trace, current_trace
+
+SYSTEM = "_sys"  # очередь для фоновых задач без пользователя
+
+OK, BUSY, DUPLICATE = "ok", "busy", "duplicate"
+
+# Классы приоритета: меньше — важнее
+INTERACTIVE, BROADCAST, PREGEN = 0, 1, 2
+PRIORITIES = (INTERACTIVE, BROADCAST, PREGEN)
+
+
+class Job:
+    __slots__ = ("owner", "prio", "fn", "args", "kwargs", "dedup", "on_cancel", "trace")
+
+    def __init__(self, owner, fn, args, kwargs, dedup=None, on_cancel=None, prio=INTERACTIVE):
+        self.owner = owner
+        self.prio = prio
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.dedup = dedup
+        self.on_cancel = on_cancel
+        self.trace = current_trace()   # trace id апдейта, породившего задачу
+
+
+class JobScheduler:
+    """
+    Пул воркеров, который берёт задачи по кругу из очередей пользователей:
+    один пользователь с альбомом из 30 фото не блокирует остальных.
+    Сначала обслуживается класс INTERACTIVE, затем BROADCAST, затем PREGEN;
+    не-интерактивные задачи не занимают последние reserved воркеров.
+    У каждого пользователя не больше per_user задач одновременно в работе,
+    общий бэклог ограничен max_backlog (submit вернёт BUSY).
+    """
+
+    def __init__(self, workers=6, per_user=2, max_backlog=200, reserved=2):
+        self.per_user = per_user
+        self.max_backlog = max_backlog
+        self.reserved = min(reserved, workers - 1)
+        self._queues = {}        # (prio, owner) -> deque[Job]
+        self._rings = [deque() for _ in PRIORITIES]   # владельцы с ожидающими задачами по классам
+        self._inflight = {}      # owner -> int
+        self._dedup = set()      # (owner, key) ожидающих задач
+        self._backlog = 0
+        self._queued = [0] * len(PRIORITIES)
+        self._active = 0
+        self._active_low = 0     # не-интерактивных в работе
+        self._cv = threading.Condition()
+        self._stopping = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"job-{i}", daemon=True) for i in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, owner, fn, *args, dedup=None, on_cancel=None, prio=INTERACTIVE, **kwargs):
+        owner = SYSTEM if owner is None else owner
+        with self._cv:
+            if dedup is not None and (owner, dedup) in self._dedup:
+                return DUPLICATE
+            if self._stopping or self._backlog >= self.max_backlog:
+                return BUSY
+            q = self._queues.get((prio, owner))
+            if q is None:
+                q = self._queues[(prio, owner)] = deque()
+                self._rings[prio].append(owner)
+            q.append(Job(owner, fn, args, kwargs, dedup, on_cancel, prio))
+            if dedup is not None:
+                self._dedup.add((owner, dedup))
+            self._backlog += 1
+            self._queued[prio] += 1
+            self._cv.notify()
+            return OK
+
+    def _take(self, prio, owner):
+        """Снимает очередь (prio, owner) целиком. Вызывать под self._cv."""
+        q = self._queues.pop((prio, owner), None)
+        if not q:
+            return []
+        try: self._rings[prio].remove(owner)
+        except ValueError: pass
+        self._backlog -= len(q)
+        self._queued[prio] -= len(q)
+        for job in q:
+            if job.dedup is not None:
+                self._dedup.discard((owner, job.dedup))
+        return list(q)
+
+    @staticmethod
+    def _cancelled(jobs):
+        for job in jobs:
+            if job.on_cancel:
+                try: job.on_cancel()
+                except Exception as e: log("job_on_cancel", error=e)
+
+    def cancel(self, owner):
+        """Снимает ещё не начатые задачи пользователя. Возвращает их число."""
+        with self._cv:
+            jobs = [j for prio in PRIORITIES for j in self._take(prio, owner)]
+        self._cancelled(jobs)
+        return len(jobs)
+
+    def pending(self, prio=INTERACTIVE):
+        with self._cv:
+            return self._queued[prio]
+
+    def _limit(self, owner):
+        return len(self._threads) if owner == SYSTEM else self.per_user
+
+    def _next_job(self):
+        """Следующая задача: старший класс первым, внутри класса — по кругу. Вызывать под self._cv."""
+        for prio, ring in zip(PRIORITIES, self._rings):
+            if prio != INTERACTIVE and self._active_low >= len(self._threads) - self.reserved:
+                return None
+            for _ in range(len(ring)):
+                owner = ring[0]
+                ring.rotate(-1)
+                if self._inflight.get(owner, 0) >= self._limit(owner):
+                    continue
+                q = self._queues[(prio, owner)]
+                job = q.popleft()
+                if not q:
+                    del self._queues[(prio, owner)]
+                    ring.remove(owner)
+                if job.dedup is not None:
+                    self._dedup.discard((owner, job.dedup))
+                self._backlog -= 1
+                self._queued[prio] -= 1
+                self._inflight[owner] = self._inflight.get(owner, 0) + 1
+                if prio != INTERACTIVE:
+                    self._active_low += 1
+                return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cv:
+                job = self._next_job()
+                while job is None:
+                    if self._stopping and not self._backlog:
+                        return
+                    self._cv.wait()
+                    job = self._next_job()
+                self._active += 1
+            try:
+                with trace(job.trace):
+                    try:
+                        job.fn(*job.args, **job.kwargs)
+                    except Exception as e:
+                        log("bg_task", error=e)
+            finally:
+                with self._cv:
+                    self._active -= 1
+                    if job.prio != INTERACTIVE:
+                        self._active_low -= 1
+                    n = self._inflight[job.owner] - 1
+                    if n: self._inflight[job.owner] = n
+                    else: del self._inflight[job.owner]
+                    # освободился слот пользователя — его задачи снова доступны
+                    self._cv.notify_all()
+
+    def stats(self):
+        with self._cv:
+            return {
+                "backlog": self._backlog,
+                "max_backlog": self.max_backlog,
+                "active": self._active,
+                "workers": len(self._threads),
+                "users_waiting": len({o for ring in self._rings for o in ring}),
+                "queued": dict(zip(("interactive", "broadcast", "pregen"), self._queued)),
+            }
+
+    def shutdown(self, timeout=30.0):
+        """
+        Перестаёт принимать задачи, снимает фоновую предгенерацию и доделывает
+        очередь — сначала интерактивные, затем остальные. Чего не успели за timeout,
+        остаётся в журнале (job_journal) до следующего старта.
+        """
+        with self._cv:
+            self._stopping = True
+            dropped = [j for owner in list(self._rings[PREGEN]) for j in self._take(PREGEN, owner)]
+            self._cv.notify_all()
+        self._cancelled(dropped)
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
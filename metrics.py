@@ -0,0 +1,187 @@
+# =======================
+# Metrics — счётчики/гистограммы в текстовом формате Prometheus + trace id в логах
+# =======================
+import json, time, uuid, bisect, threading
+from contextlib import contextmanager
+
+# Границы бакетов латентности, сек
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 90.0)
+
+
+def _fmt_labels(names, values, extra=""):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                out.append(f"{self.name}{_fmt_labels(self.labels, key)} {v}")
+        return out
+
+
+class Gauge:
+    """Значение снимается при каждом /metrics: fn() -> число или {labels tuple: число}."""
+
+    def __init__(self, name, help_text, fn, labels=()):
+        self.name, self.help, self.fn, self.labels = name, help_text, fn, tuple(labels)
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            v = self.fn()
+        except Exception as e:
+            return out + [f"# error: {e}"]
+        items = v.items() if isinstance(v, dict) else [((), v)]
+        for key, x in items:
+            out.append(f"{self.name}{_fmt_labels(self.labels, key)} {x}")
+        return out
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}   # labels -> [counts по бакетам..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((k, list(s)) for k, s in self._series.items())
+        for key, s in series:
+            acc = 0
+            for le, n in zip(self.buckets, s):
+                acc += n
+                out.append("%s_bucket%s %d" % (self.name, _fmt_labels(self.labels, key, 'le="%s"' % le), acc))
+            out.append("%s_bucket%s %d" % (self.name, _fmt_labels(self.labels, key, 'le="+Inf"'), s[-1]))
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {s[-2]:.6f}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {s[-1]}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, fn, labels=()):
+        return self.register(Gauge(name, help_text, fn, labels))
+
+    def render(self):
+        lines = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Общие метрики: этапы обработки (webhook, update, db, tg_download, openai, tg_api) и OpenAI
+STAGE_SECONDS = REGISTRY.histogram("bot_stage_seconds", "Latency of a processing stage", ("stage", "op"))
+OPENAI_TOKENS = REGISTRY.counter("bot_openai_tokens_total", "OpenAI tokens used", ("feature", "kind"))
+OPENAI_ERRORS = REGISTRY.counter("bot_openai_errors_total", "OpenAI call errors", ("feature", "kind"))
+ERRORS = REGISTRY.counter("bot_errors_total", "Errors logged by handlers and workers", ("event",))
+
+
+def timed(stage, op=""):
+    """with timed("db", "flush"): ... — замер этапа в bot_stage_seconds."""
+    return STAGE_SECONDS.time(stage=stage, op=op)
+
+
+def count_usage(feature, usage):
+    if usage is None:
+        return
+    OPENAI_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, feature=feature, kind="prompt")
+    OPENAI_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, feature=feature, kind="completion")
+
+
+# ---------- trace id + структурные логи ----------
+_local = threading.local()
+
+
+def current_trace():
+    return getattr(_local, "trace", None)
+
+
+def new_trace_id():
+    return uuid.uuid4().hex[:12]
+
+
+@contextmanager
+def trace(trace_id=None):
+    """Привязывает trace id к текущему потоку на время блока."""
+    prev = current_trace()
+    _local.trace = trace_id or new_trace_id()
+    try:
+        yield _local.trace
+    finally:
+        _local.trace = prev
+
+
+def traced(fn, trace_id=None):
+    """Обёртка для передачи trace id в другой поток (фоновые задачи)."""
+    trace_id = trace_id or current_trace()
+
+    def run(*args, **kwargs):
+        with trace(trace_id):
+            return fn(*args, **kwargs)
+    return run
+
+
+def log(event, error=None, **fields):
+    """Строка JSON в stdout: ts, event, trace, поля; error (исключение или текст) — ещё и в bot_errors_total."""
+    rec = {"ts": round(time.time(), 3), "event": event, "trace": current_trace()}
+    if error is not None:
+        rec["error"] = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+        ERRORS.inc(event=event)
+    rec.update(fields)
+    print(json.dumps(rec, ensure_ascii=False, default=str), flush=True)
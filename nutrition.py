@@ -0,0 +1,39 @@
+# =======================
+# Nutrition math — BMR / TDEE / daily macro targets
+# =======================
+
+# В анкете нет возраста и активности — берём типичные значения
+DEFAULT_AGE = 30
+ACTIVITY_FACTOR = 1.4   # лёгкая активность
+
+GOAL_FACTORS = {"cut": 0.85, "maintain": 1.0, "bulk": 1.1}
+PROTEIN_PER_KG = {"cut": 2.0, "maintain": 1.6, "bulk": 1.8}
+FAT_PER_KG = 0.9
+
+
+def bmr(sex, height, weight, age=DEFAULT_AGE):
+    """Основной обмен по Миффлину — Сан Жеору, ккал/сутки."""
+    base = 10 * weight + 6.25 * height - 5 * age
+    return base + 5 if sex == "male" else base - 161
+
+
+def daily_targets(profile):
+    """
+    Дневные цели по профилю {"sex","height","weight","goal"}:
+    {"bmr","tdee","kcal","protein","fat","carbs"} (ккал и граммы, округлённые).
+    """
+    sex, h, w, goal = profile["sex"], float(profile["height"]), float(profile["weight"]), profile["goal"]
+    b = bmr(sex, h, w, profile.get("age", DEFAULT_AGE))
+    tdee = b * ACTIVITY_FACTOR
+    kcal = tdee * GOAL_FACTORS.get(goal, 1.0)
+    protein = w * PROTEIN_PER_KG.get(goal, 1.6)
+    fat = max(w * FAT_PER_KG, kcal * 0.2 / 9)
+    carbs = max(50.0, (kcal - protein * 4 - fat * 9) / 4)
+    return {
+        "bmr": round(b),
+        "tdee": round(tdee),
+        "kcal": int(round(kcal / 10) * 10),
+        "protein": round(protein),
+        "fat": round(fat),
+        "carbs": round(carbs),
+    }
@@ -0,0 +1,122 @@
+# =======================
+# Plan library — готовые недельные планы по «корзинам» профиля
+# =======================
+import json, time, sqlite3, threading
+
+from metrics import log
+
+HEIGHT_STEP = 5   # см
+WEIGHT_STEP = 3   # кг
+
+
+def bucket_of(profile):
+    """Ключ корзины: пол, цель, рост шагом 5 см, вес шагом 3 кг."""
+    h = int(float(profile["height"]) // HEIGHT_STEP * HEIGHT_STEP)
+    w = int(float(profile["weight"]) // WEIGHT_STEP * WEIGHT_STEP)
+    return f"{profile['sex']}:{profile['goal']}:{h}:{w}"
+
+
+def bucket_profile(bucket):
+    """Типичный профиль корзины (середина диапазонов) — для предгенерации."""
+    sex, goal, h, w = bucket.split(":")
+    return {"sex": sex, "goal": goal, "height": int(h) + HEIGHT_STEP / 2, "weight": int(w) + WEIGHT_STEP / 2}
+
+
+class PlanLibrary:
+    """
+    До variants планов на корзину. Пользователю отдаётся следующий по кругу
+    вариант, поэтому соседи по корзине (и он сам при повторном запросе)
+    получают разные меню.
+    """
+
+    def __init__(self, path, variants=4):
+        self.variants = variants
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS plans (bucket TEXT NOT NULL, variant INTEGER NOT NULL,"
+            " days TEXT NOT NULL, created REAL NOT NULL, PRIMARY KEY (bucket, variant));"
+            "CREATE TABLE IF NOT EXISTS bucket_hits (bucket TEXT PRIMARY KEY, hits INTEGER NOT NULL);"
+        )
+
+    def hit(self, bucket):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO bucket_hits(bucket, hits) VALUES (?, 1) ON CONFLICT(bucket) DO UPDATE SET hits = hits + 1",
+                (bucket,),
+            )
+
+    def count(self, bucket):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM plans WHERE bucket = ?", (bucket,)).fetchone()[0]
+
+    def pick(self, bucket, rotation):
+        """План-вариант номер rotation % n или None, если корзина холодная."""
+        with self._lock:
+            rows = self._db.execute("SELECT days FROM plans WHERE bucket = ? ORDER BY variant", (bucket,)).fetchall()
+        if not rows:
+            return None
+        return json.loads(rows[rotation % len(rows)][0])
+
+    def add(self, bucket, days):
+        """Добавляет план; когда вариантов уже максимум — заменяет самый старый."""
+        with self._lock:
+            rows = self._db.execute("SELECT variant, created FROM plans WHERE bucket = ? ORDER BY created", (bucket,)).fetchall()
+            if len(rows) < self.variants:
+                used = {r[0] for r in rows}
+                variant = next(i for i in range(self.variants) if i not in used)
+            else:
+                variant = rows[0][0]
+            self._db.execute(
+                "INSERT OR REPLACE INTO plans(bucket, variant, days, created) VALUES (?, ?, ?, ?)",
+                (bucket, variant, json.dumps(days, ensure_ascii=False), time.time()),
+            )
+
+    def next_to_fill(self):
+        """Самая популярная корзина, где вариантов меньше максимума."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT h.bucket FROM bucket_hits h"
+                " LEFT JOIN (SELECT bucket, COUNT(*) n FROM plans GROUP BY bucket) p ON p.bucket = h.bucket"
+                " WHERE COALESCE(p.n, 0) < ? ORDER BY h.hits DESC LIMIT 1",
+                (self.variants,),
+            ).fetchone()
+        return row[0] if row else None
+
+    def stats(self):
+        with self._lock:
+            buckets, plans = self._db.execute("SELECT COUNT(DISTINCT bucket), COUNT(*) FROM plans").fetchone()
+        return {"buckets": buckets, "plans": plans}
+
+    # ---------- предгенерация в простое ----------
+    def start_pregen(self, is_idle, generate_days, interval=60.0, submit=None):
+        """
+        Фоновый поток: раз в interval секунд, если is_idle(), дозаполняет
+        самую популярную корзину планом generate_days(profile) -> [str] | None.
+        submit(fn, bucket) — выполнить заполнение во внешнем пуле (иначе прямо в потоке).
+        """
+        def fill(bucket):
+            days = generate_days(bucket_profile(bucket))
+            if days:
+                self.add(bucket, days)
+                log("plan_pregen_filled", bucket=bucket)
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    if not is_idle():
+                        continue
+                    bucket = self.next_to_fill()
+                    if not bucket:
+                        continue
+                    if submit:
+                        submit(fill, bucket)
+                    else:
+                        fill(bucket)
+                except Exception as e:
+                    log("plan_pregen", error=e)
+        t = threading.Thread(target=loop, name="plan-pregen", daemon=True)
+        t.start()
+        return t
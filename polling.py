@@ -0,0 +1,124 @@
+# =======================
+# Long polling — getUpdates пачками по 100, разбор через UpdateDispatcher
+# =======================
+import time, random, signal, threading
+
+from broadcast import retry_after_of
+from metrics import log, timed
+
+BATCH = 100
+
+
+class LongPoller:
+    """
+    Тянет апдейты пачками и кладёт их в dispatcher (порядок внутри чата сохраняется шардами).
+    offset (он же подтверждение для Telegram) — не дальше самого старого ещё не обработанного
+    апдейта: то, что принято в очередь, но не доделано, при остановке не теряется, а придёт
+    снова. Повторно пришедшие, но уже принятые апдейты пропускаются по update_id.
+    Непринятый из-за переполнения хвост пачки тоже будет запрошен повторно.
+    stop() — перестать тянуть; run() затем дожидается обработки принятого и подтверждает
+    обработанное в Telegram.
+    """
+
+    def __init__(self, bot, dispatcher, timeout=25, allowed_updates=None, limit=BATCH):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.timeout = timeout
+        self.allowed_updates = allowed_updates
+        self.limit = limit
+        self._seen = None        # последний принятый update_id
+        self._inflight = set()   # принятые, но ещё не обработанные update_id
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def stop(self, *_):
+        self._stop.set()
+
+    def install_signals(self):
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self.stop)
+
+    @property
+    def offset(self):
+        """Первый update_id, который ещё нужен: самый старый необработанный или следующий за принятыми."""
+        with self._lock:
+            if self._inflight:
+                return min(self._inflight)
+            return None if self._seen is None else self._seen + 1
+
+    def _done(self, update):
+        with self._lock:
+            self._inflight.discard(update.update_id)
+
+    def _fetch(self):
+        with timed("poll", "getUpdates"):
+            return self.bot.get_updates(
+                offset=self.offset, limit=self.limit, timeout=self.timeout,
+                allowed_updates=self.allowed_updates, long_polling_timeout=self.timeout,
+            )
+
+    def _submit(self, updates):
+        """Кладёт новые апдейты пачки по порядку до первого отказа: (всё ли принято, сколько новых)."""
+        new = 0
+        for upd in updates:
+            uid = upd.update_id
+            with self._lock:
+                if self._seen is not None and uid <= self._seen:
+                    continue   # ещё в очереди с прошлой выборки
+                self._inflight.add(uid)
+            if not self.dispatcher.submit(upd, on_done=self._done):
+                with self._lock:
+                    self._inflight.discard(uid)
+                return False, new
+            with self._lock:
+                self._seen = uid
+            new += 1
+        return True, new
+
+    def run(self, drain_timeout=30.0):
+        errors = 0
+        while not self._stop.is_set():
+            try:
+                updates = self._fetch()
+                errors = 0
+            except Exception as e:
+                errors += 1
+                pause = retry_after_of(e) or min(30.0, random.uniform(0.5, 2.0) * 2 ** min(errors, 5))
+                log("poll", error=e, pause=round(pause, 1))
+                self._stop.wait(pause)
+                continue
+            if not updates:
+                continue
+            ok, new = self._submit(updates)
+            if not ok:
+                # очередь полна — ждём и перезапрашиваем непринятый хвост
+                log("poll_backpressure", depth=self.dispatcher.depth(), offset=self.offset)
+                self._wait_room()
+            elif not new:
+                # пришли только ещё не обработанные — Telegram отдаст их сразу, не крутимся
+                self._stop.wait(0.2)
+        log("poll_stopping", offset=self.offset, pending=self.dispatcher.depth())
+        self.dispatcher.stop(drain=True, timeout=drain_timeout)
+        self._confirm()
+
+    def _wait_room(self, max_wait=5.0):
+        # до половины очереди, чтобы следующая пачка влезла целиком
+        end = time.monotonic() + max_wait
+        while self.dispatcher.depth() > self.dispatcher.max_pending // 2 and time.monotonic() < end:
+            if self._stop.wait(0.05):
+                return
+
+    def _confirm(self):
+        # обработанные апдейты подтверждаются getUpdates с бóльшим offset; не доделанные
+        # за drain_timeout остаются за offset и придут после рестарта
+        offset = self.offset
+        if offset is None:
+            return
+        with self._lock:
+            left = len(self._inflight)
+        if left:
+            log("poll_unfinished", n=left, offset=offset)
+        try:
+            self.bot.get_updates(offset=offset, limit=1, timeout=0)
+        except Exception as e:
+            log("poll_confirm", error=e)
@@ -0,0 +1,171 @@
+# =======================
+# Prompts — компактные JSON-запросы к модели и локальный рендер ответа в HTML
+# =======================
+import json, re
+from collections import namedtuple
+from html import escape
+
+from week_plan import DAYS, DAY_FOCUS
+
+# Общая шапка + схема только своей задачи. Делать один system на все фичи ради prompt
+# caching нет смысла: апстрим кэширует префиксы от 1024 токенов, а здесь их ~100.
+# Инструкции по-английски: кириллица в токенах вдвое дороже, а текст ответа всё равно русский.
+# Вход, токенов (cl100k, system+user, было -> стало): список 169 -> 121, рецепт 106 -> 94,
+# день 231 -> 115, неделя 230 -> 165.
+HEAD = "Nutritionist and chef. Reply with JSON only, all text in Russian. k=kcal, p/f/c=protein/fat/carbs g, bare numbers.\n"
+SCHEMAS = {
+    "list": '{"items":[{"n":"name","g":0,"k":0,"p":0,"f":0,"c":0}]} one row per item; no weight = typical serving',
+    "recipe": '{"t":"title","i":[["item","qty"]],"s":["step"],"k":0,"p":0,"f":0,"c":0,"tip":"swap"} per serving',
+    "day": '{"m":[{"n":"meal","d":"dishes with grams","k":0,"p":0,"f":0,"c":0}]} 3-5 meals, no totals',
+}
+SCHEMAS["week"] = '{"d":[<day>x7]}, day: ' + SCHEMAS["day"]
+
+DayRequest = namedtuple("DayRequest", "idx messages")
+
+
+def _msgs(task, text):
+    return [{"role": "system", "content": HEAD + SCHEMAS[task]}, {"role": "user", "content": text}]
+
+
+def _targets(t):
+    return f"{t['kcal']} ккал, Б{t['protein']} Ж{t['fat']} У{t['carbs']} (±5%)"
+
+
+# ---------- запросы ----------
+def list_messages(items):
+    return _msgs("list", "\n".join(items))
+
+
+def recipe_messages(params):
+    if params["type"] == "freeform":
+        return _msgs("recipe", params["q"])
+    return _msgs("recipe", f"{params['kcal']} ккал ±5%, интересный")
+
+
+def day_request(day_idx, targets, sex=None, goal=None):
+    """Подставляется в week_plan.build_week(prompt_fn=...): цели уже посчитаны локально."""
+    return DayRequest(day_idx, _msgs("day", f"Цель: {_targets(targets)}. Основной белок: {DAY_FOCUS[day_idx]}"))
+
+
+def week_messages(targets):
+    return _msgs("week", f"Цель на день: {_targets(targets)}. Белок по дням: {', '.join(DAY_FOCUS)}")
+
+
+# ---------- разбор и рендер ----------
+def parse_json(text):
+    """dict из ответа модели (терпим ```json-обёртку и текст вокруг) или None."""
+    if not text:
+        return None
+    s, e = text.find("{"), text.rfind("}")
+    if s < 0 or e <= s:
+        return None
+    try:
+        data = json.loads(text[s:e + 1])
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def parse_partial(text):
+    """
+    dict из ещё не дописанного JSON (поток): закрываем открытую строку и скобки,
+    а если хвост так не разбирается — откатываемся к последней запятой/скобке.
+    """
+    s = (text or "").find("{")
+    if s < 0:
+        return None
+    stack, cuts, in_str, esc = [], [], False, False
+    for i in range(s, len(text)):
+        ch = text[i]
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+            continue
+        if ch == '"':
+            in_str = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            cuts.append((i + 1, "".join(reversed(stack))))
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return parse_json(text[s:i + 1])
+            cuts.append((i + 1, "".join(reversed(stack))))
+        elif ch == ",":
+            cuts.append((i, "".join(reversed(stack))))
+    attempts = [text[s:] + ('"' if in_str else "") + "".join(reversed(stack))]
+    attempts += [text[s:i] + closers for i, closers in reversed(cuts[-4:])]
+    for a in attempts:
+        try:
+            data = json.loads(a)
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
+
+def _n(x):
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        m = re.search(r"\d+(?:[.,]\d+)?", str(x or ""))
+        return float(m.group(0).replace(",", ".")) if m else 0.0
+
+
+def _kbju(k, p, f, c):
+    return f"{k:.0f} ккал, Б/Ж/У {p:.0f}/{f:.0f}/{c:.0f}"
+
+
+def list_rows(data, partial=False):
+    """[(name, g, kcal, p, f, c)] для foods.render; итог считает foods.total_of.
+    partial=True — из потока: только строки, дописанные до последнего поля."""
+    rows = []
+    for it in (data or {}).get("items") or []:
+        if isinstance(it, dict) and it.get("n") and (not partial or "c" in it):
+            rows.append((escape(str(it["n"])), _n(it.get("g")), _n(it.get("k")), _n(it.get("p")), _n(it.get("f")), _n(it.get("c"))))
+    return rows
+
+
+def render_recipe(data):
+    if not data or not data.get("t") or not data.get("i"):
+        return None
+    lines = [f"👨‍🍳 <b>{escape(str(data['t']))}</b>", "", "<b>Ингредиенты</b>"]
+    for row in data["i"]:
+        name, qty = (row + ["", ""])[:2] if isinstance(row, list) else (row, "")
+        if not name:
+            continue
+        lines.append(f"• {escape(str(name))}" + (f" — {escape(str(qty))}" if qty else ""))
+    lines += ["", "<b>Приготовление</b>"]
+    lines += [f"{i}. {escape(str(step))}" for i, step in enumerate(data.get("s") or [], 1)]
+    if "c" in data:   # в потоке КБЖУ ещё может не быть
+        lines += ["", "<b>КБЖУ на порцию:</b> ~" + _kbju(*(_n(data.get(x)) for x in "kpfc"))]
+    if data.get("tip"):
+        lines.append(f"💡 {escape(str(data['tip']))}")
+    return "\n".join(lines)
+
+
+def render_day(day_idx, data):
+    """HTML дня в формате week_plan (строка «Итого за день» — сумма по приёмам пищи)."""
+    meals = [m for m in (data or {}).get("m") or [] if isinstance(m, dict)]
+    if not meals:
+        return None
+    lines = [f"<b>{DAYS[day_idx]}</b>"]
+    tot = [0.0] * 4
+    for m in meals:
+        vals = [_n(m.get(x)) for x in "kpfc"]
+        tot = [a + b for a, b in zip(tot, vals)]
+        lines.append(f"- {escape(str(m.get('n', '')))}: {escape(str(m.get('d', '')))} ({_kbju(*vals)})")
+    lines.append("Итого за день: " + _kbju(*tot))
+    return "\n".join(lines)
+
+
+def render_week(data):
+    """Список HTML-дней (None — день не разобрался)."""
+    days = (data or {}).get("d") or []
+    return [render_day(i, d if isinstance(d, dict) else None) for i, d in enumerate(days[:len(DAYS)])]
@@ -0,0 +1,121 @@
+# =======================
+# Router — O(1) выбор хендлера по командe / тексту кнопки / шагу сценария
+# =======================
+
+
+class Router:
+    """
+    Хендлеры регистрируются и в таблицах роутера, и в telebot (тот же порядок),
+    поэтому process() выбирает тот же хендлер, что и линейный перебор telebot,
+    но за словарный поиск: из подходящих команды, текста и шага побеждает
+    зарегистрированный раньше.
+    Исключение — кнопки главного меню (text(..., menu=True)): они важнее шага
+    сценария и сбрасывают его (reset_step), иначе брошенный шаг съел бы следующий текст.
+    Апдейты, которые роутер не разбирает (не message, ждущий next_step_handler),
+    отдаются в bot.process_new_updates как раньше.
+    """
+
+    def __init__(self, bot, get_step, on_message=None, reset_step=None):
+        self.bot = bot
+        self.get_step = get_step
+        self.on_message = on_message   # вызывается для каждого сообщения (регистрация юзера)
+        self.reset_step = reset_step
+        self.menu = set()    # тексты кнопок главного меню
+        self._order = 0
+        self.commands = {}   # "start" -> (order, fn)
+        self.texts = {}      # "⬅️ Назад" -> (order, fn)
+        self.states = {}     # "kbju_list" -> (order, fn)
+        self.content = {}    # "photo" -> [(order, pred, fn)]
+
+    def _next(self):
+        self._order += 1
+        return self._order
+
+    # ---------- регистрация ----------
+    def command(self, *names):
+        def deco(fn):
+            o = self._next()
+            for n in names:
+                self.commands.setdefault(n, (o, fn))
+            self.bot.message_handler(commands=list(names))(fn)
+            return fn
+        return deco
+
+    def text(self, *texts, menu=False):
+        def deco(fn):
+            h = fn
+            if menu:
+                self.menu.update(texts)
+                h = self._resetting(fn)
+            o = self._next()
+            for t in texts:
+                self.texts.setdefault(t, (o, h))
+            ts = frozenset(texts)
+            self.bot.message_handler(func=lambda m: m.text in ts)(h)
+            return fn
+        return deco
+
+    def _resetting(self, fn):
+        def h(m):
+            if self.reset_step and self.get_step(m.from_user.id) is not None:
+                self.reset_step(m.from_user.id)
+            return fn(m)
+        return h
+
+    def state(self, step):
+        def deco(fn):
+            o = self._next()
+            self.states.setdefault(step, (o, fn))
+            self.bot.message_handler(
+                func=lambda m: m.text not in self.menu and self.get_step(m.from_user.id) == step)(fn)
+            return fn
+        return deco
+
+    def content_types(self, *types, func=None):
+        def deco(fn):
+            o = self._next()
+            for t in types:
+                self.content.setdefault(t, []).append((o, func, fn))
+            self.bot.message_handler(content_types=list(types), func=func)(fn)
+            return fn
+        return deco
+
+    # ---------- диспетчеризация ----------
+    def resolve(self, m):
+        if m.content_type != "text":
+            for _, pred, fn in self.content.get(m.content_type, ()):
+                if pred is None or pred(m):
+                    return fn
+            return None
+        text = m.text or ""
+        best = self.texts.get(text)
+        if text.startswith("/"):
+            cmd = text[1:].split(maxsplit=1)[0].split("@")[0] if len(text) > 1 else ""
+            c = self.commands.get(cmd)
+            if c and (best is None or c[0] < best[0]):
+                best = c
+        step = self.get_step(m.from_user.id) if text not in self.menu else None
+        if step is not None:
+            s = self.states.get(step)
+            if s and (best is None or s[0] < best[0]):
+                best = s
+        return best[1] if best else None
+
+    def _waits_next_step(self, chat_id):
+        handlers = getattr(self.bot.next_step_backend, "handlers", None)
+        # неизвестный backend — не рискуем, пусть решает telebot
+        return handlers is None or chat_id in handlers
+
+    def process(self, update):
+        m = update.message
+        if m is None:
+            self.bot.process_new_updates([update])
+            return
+        if self.on_message:
+            self.on_message(m)
+        if self._waits_next_step(m.chat.id):
+            self.bot.process_new_updates([update])
+            return
+        fn = self.resolve(m)
+        if fn is not None:
+            fn(m)
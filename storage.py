@@ -0,0 +1,219 @@
+# =======================
+# Storage — SQLite (WAL) + read-through cache + write-behind flush
+# =======================
+import os, json, sqlite3, threading, atexit
+from datetime import datetime
+from collections import OrderedDict
+from types import MappingProxyType
+
+from metrics import timed, log
+
+_NO_USER = MappingProxyType({})   # промах чтения: общий и неизменяемый, в кэш не кладётся
+
+
+class Storage:
+    """
+    Хранилище пользователей и настроек.
+    Чтение — через LRU-кэш в памяти, запись — в кэш + пакетный сброс в SQLite
+    фоновым потоком раз в flush_interval секунд.
+    """
+
+    def __init__(self, path, legacy_json=None, flush_interval=1.0, cache_size=50000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()   # uid(str) -> dict
+        self._dirty = set()           # uid(str), ожидающие записи
+        self._meta = {}               # key -> value (кэшируем целиком, их мало)
+        self._meta_dirty = set()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS users (uid TEXT PRIMARY KEY, data TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS users_uid_int ON users(CAST(uid AS INTEGER));"
+            "CREATE TABLE IF NOT EXISTS broadcast_log (id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL);"
+        )
+        for k, v in self._conn.execute("SELECT key, value FROM meta"):
+            self._meta[k] = json.loads(v)
+        if legacy_json:
+            self._migrate_json(legacy_json)
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="db-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    # ---------- migration ----------
+    def _migrate_json(self, json_path):
+        """Одноразовый перенос старого db.json в SQLite."""
+        if self._meta.get("migrated_from_json") or not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                old = json.load(f)
+        except Exception as e:
+            log("db_migrate_read", error=e, path=json_path)
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO users(uid, data) VALUES (?, ?)",
+                    [(str(uid), json.dumps(u, ensure_ascii=False)) for uid, u in old.get("users", {}).items()],
+                )
+                self._conn.executemany(
+                    "INSERT INTO broadcast_log(data) VALUES (?)",
+                    [(json.dumps(e, ensure_ascii=False),) for e in old.get("broadcast_log", [])],
+                )
+                meta = {"migrated_from_json": datetime.utcnow().isoformat()}
+                if "welcome" in old:
+                    meta["welcome"] = old["welcome"]
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)",
+                    [(k, json.dumps(v, ensure_ascii=False)) for k, v in meta.items()],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._meta.update(meta)
+        try:
+            os.replace(json_path, json_path + ".migrated")
+        except OSError as e:
+            log("db_migrate_rename", error=e)
+        log("db_migrated", users=len(old.get("users", {})))
+
+    # ---------- users ----------
+    def _cached(self, uid, create=False):
+        """
+        Пользователь из кэша (или из SQLite при промахе). Вызывать под self._lock.
+        Несуществующий uid кэшируется только для записи (create=True): чтение любых
+        чужих id не забивает LRU.
+        """
+        u = self._cache.get(uid)
+        if u is not None:
+            self._cache.move_to_end(uid)
+            return u
+        with timed("db", "load"):
+            row = self._conn.execute("SELECT data FROM users WHERE uid = ?", (uid,)).fetchone()
+        if row is None and not create:
+            return _NO_USER
+        u = json.loads(row[0]) if row else {}
+        self._cache[uid] = u
+        self._evict()
+        return u
+
+    def _evict(self):
+        # вытесняем только «чистые» записи с головы LRU; грязные уходят в хвост и ждут сброса
+        skipped = 0
+        while len(self._cache) > self.cache_size and skipped < len(self._cache):
+            key = next(iter(self._cache))
+            if key in self._dirty:
+                self._cache.move_to_end(key)
+                skipped += 1
+            else:
+                del self._cache[key]
+
+    def get_user(self, uid):
+        with self._lock:
+            return dict(self._cached(str(uid)))
+
+    def set_user(self, uid, data: dict):
+        uid = str(uid)
+        with self._lock:
+            # грязным — до _cached: иначе только что загруженную запись может вытеснить её же _evict()
+            self._dirty.add(uid)
+            u = self._cached(uid, create=True)
+            u.update(data)
+
+    def user_ids(self):
+        self.flush()
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT uid FROM users")]
+
+    def user_ids_after(self, after=None, limit=200, active_only=True):
+        """Пачка uid по возрастанию, строго после after (keyset-курсор для рассылок)."""
+        self.flush()
+        sql = "SELECT uid FROM users WHERE (? IS NULL OR CAST(uid AS INTEGER) > ?)"
+        if active_only:
+            sql += " AND COALESCE(json_extract(data, '$.blocked'), 0) = 0"
+        sql += " ORDER BY CAST(uid AS INTEGER) LIMIT ?"
+        with self._lock:
+            return [r[0] for r in self._conn.execute(sql, (after, after, limit))]
+
+    def user_count(self, active_only=False):
+        self.flush()
+        sql = "SELECT COUNT(*) FROM users"
+        if active_only:
+            sql += " WHERE COALESCE(json_extract(data, '$.blocked'), 0) = 0"
+        with self._lock:
+            return self._conn.execute(sql).fetchone()[0]
+
+    def all_users(self):
+        self.flush()
+        with self._lock:
+            return {uid: json.loads(d) for uid, d in self._conn.execute("SELECT uid, data FROM users")}
+
+    # ---------- meta ----------
+    def get_meta(self, key, default=None):
+        with self._lock:
+            return self._meta.get(key, default)
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._meta[key] = value
+            self._meta_dirty.add(key)
+
+    # ---------- broadcast log ----------
+    def append_broadcast_log(self, entry: dict):
+        with self._lock:
+            self._conn.execute("INSERT INTO broadcast_log(data) VALUES (?)", (json.dumps(entry, ensure_ascii=False),))
+
+    def broadcast_log(self, limit=20):
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM broadcast_log ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [json.loads(r[0]) for r in reversed(rows)]
+
+    # ---------- write-behind ----------
+    def flush(self):
+        """Сбрасывает накопленные изменения одной транзакцией."""
+        with self._lock:
+            if not self._dirty and not self._meta_dirty:
+                return
+            users = [(uid, json.dumps(self._cache[uid], ensure_ascii=False)) for uid in self._dirty if uid in self._cache]
+            if len(users) < len(self._dirty):
+                log("db_flush_lost", error="dirty uid not cached", n=len(self._dirty) - len(users))
+            meta = [(k, json.dumps(self._meta[k], ensure_ascii=False)) for k in self._meta_dirty]
+            with timed("db", "flush"):
+                self._conn.execute("BEGIN")
+                try:
+                    self._conn.executemany("INSERT OR REPLACE INTO users(uid, data) VALUES (?, ?)", users)
+                    self._conn.executemany("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)", meta)
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            self._dirty.clear()
+            self._meta_dirty.clear()
+            self._evict()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                log("db_flush", error=e)
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception as e:
+            log("db_flush_close", error=e)
+        with self._lock:
+            self._conn.close()
+
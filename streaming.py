@@ -0,0 +1,189 @@
+# =======================
+# Streaming editor — постепенная правка «🧠 …»-сообщения по мере генерации
+# =======================
+import re, time
+
+from broadcast import retry_after_of
+from metrics import log
+
+TG_LIMIT = 4096
+SPLIT_AT = 3900         # запас под HTML-сущности и «…»
+EDIT_INTERVAL = 1.0     # сек между правками одного сообщения (лимиты Telegram)
+CURSOR = " ▌"
+_HTML_TOKEN = re.compile(r"<(/?)[a-zA-Z][^>]*>|&#?\w+;")
+
+
+def split_point(text, limit=SPLIT_AT):
+    """Где резать длинный текст: последний перевод строки (или пробел) до limit."""
+    if len(text) <= limit:
+        return len(text)
+    cut = text.rfind("\n", 0, limit)
+    if cut < limit // 2:
+        cut = text.rfind(" ", 0, limit)
+    return cut if cut > 0 else limit
+
+
+def split_message(text, limit=SPLIT_AT):
+    """Режет текст на части не длиннее limit (для отправки несколькими сообщениями)."""
+    parts = []
+    while len(text) > limit:
+        cut = split_point(text, limit)
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        parts.append(text)
+    return parts
+
+
+def html_split_point(html, limit=SPLIT_AT):
+    """Как split_point, но только вне тегов и сущностей: обе части — корректный HTML."""
+    if len(html) <= limit:
+        return len(html)
+    nl = sp = edge = 0
+    depth, pos = 0, 0
+    tokens = [(m.start(), m.end(), m.group(1)) for m in _HTML_TOKEN.finditer(html, 0)]
+    for start, end, close in tokens + [(len(html), len(html), None)]:
+        if pos > limit:
+            break
+        if depth == 0:
+            b = min(start, limit)
+            i, j = html.rfind("\n", pos, b), html.rfind(" ", pos, b)
+            nl, sp, edge = max(nl, i), max(sp, j), max(edge, b)
+        if close is not None:
+            depth += -1 if close else 1
+            depth = max(depth, 0)
+        pos = end
+    if nl >= limit // 2:
+        return nl
+    return sp or nl or edge or limit
+
+
+def split_html(html, limit=SPLIT_AT):
+    """split_message для HTML, собранного ботом: не режет внутри <b>…</b> и сущностей."""
+    parts = []
+    while len(html) > limit:
+        cut = html_split_point(html, limit)
+        parts.append(html[:cut])
+        html = html[cut:].lstrip("\n")
+    if html:
+        parts.append(html)
+    return parts
+
+
+class StreamingEditor:
+    """
+    feed(delta) копит текст и правит текущее сообщение не чаще interval;
+    первая правка — сразу, чтобы пользователь увидел начало ответа.
+    Текст длиннее лимита продолжается новыми сообщениями.
+    Промежуточные правки — без разметки (HTML может быть недописан),
+    финальная — с HTML, а при ошибке разбора — обычным текстом.
+    """
+
+    def __init__(self, bot, chat_id, message_id, interval=EDIT_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = interval
+        self.buf = ""            # текст текущего (последнего) сообщения
+        self.parts = []          # уже зафиксированные сообщения
+        self._shown = None
+        self._next_edit = 0.0
+        self._blocked_until = 0.0   # после 429
+
+    @property
+    def text(self):
+        return "".join(self.parts) + self.buf
+
+    def _wait_unblocked(self):
+        pause = self._blocked_until - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+
+    def _edit(self, text, html=False):
+        if text == self._shown:
+            return
+        try:
+            if html:
+                self.bot.edit_message_text(text, self.chat_id, self.message_id)
+            else:
+                self.bot.edit_message_text(text, self.chat_id, self.message_id, parse_mode="")
+            self._shown = text
+        except Exception as e:
+            ra = retry_after_of(e)
+            if ra is not None:
+                self._blocked_until = self._next_edit = time.monotonic() + ra
+            elif html and "parse" in str(e).lower():
+                self._edit(text, html=False)
+            elif "not modified" not in str(e):
+                log("stream_edit", error=e)
+
+    def _roll_over(self):
+        # текущее сообщение заполнено — фиксируем его и начинаем новое
+        cut = split_point(self.buf)
+        head, self.buf = self.buf[:cut], self.buf[cut:].lstrip("\n")
+        self._wait_unblocked()
+        self._edit(head, html=True)
+        self.parts.append(head + "\n")
+        msg = self.bot.send_message(self.chat_id, (self.buf or "…") + CURSOR, parse_mode="")
+        self.message_id = msg.message_id
+        self._shown = None
+
+    def feed(self, delta):
+        self.buf += delta
+        if len(self.buf) > SPLIT_AT:
+            self._roll_over()
+        now = time.monotonic()
+        if now >= self._next_edit:
+            self._next_edit = now + self.interval
+            self._edit(self.buf + CURSOR)
+
+    def finish(self):
+        """Финальная правка с HTML. Возвращает весь текст."""
+        while len(self.buf) > SPLIT_AT:
+            self._roll_over()
+        final = self.buf.strip() or "…"
+        for _ in range(3):
+            self._wait_unblocked()
+            self._edit(final, html=True)
+            if self._blocked_until <= time.monotonic():
+                break
+        return self.text.strip()
+
+
+class RenderedEditor(StreamingEditor):
+    """
+    Поток структурного (JSON) ответа: сырой текст копится в raw, а показывается
+    render(raw, done) — HTML собирает сам бот, поэтому теги в нём всегда закрыты.
+    Пока частичный HTML не разбирается или длиннее одного сообщения, правки пропускаются;
+    финальный режется на части по границам тегов (первая — правкой, остальные — новыми сообщениями).
+    """
+
+    def __init__(self, bot, chat_id, message_id, render, interval=EDIT_INTERVAL):
+        super().__init__(bot, chat_id, message_id, interval)
+        self.render = render
+        self.raw = ""
+
+    def feed(self, delta):
+        self.raw += delta
+        now = time.monotonic()
+        if now < self._next_edit:
+            return
+        html = self.render(self.raw, False)
+        if html and len(html) <= SPLIT_AT:
+            self._next_edit = now + self.interval
+            self._edit(html + CURSOR, html=True)
+
+    def finish(self):
+        """Финальная правка. Возвращает показанный HTML или None, если ответ не разобрался."""
+        html = self.render(self.raw, True)
+        if not html:
+            return None
+        parts = split_html(html)
+        for _ in range(3):
+            self._wait_unblocked()
+            self._edit(parts[0], html=True)
+            if self._blocked_until <= time.monotonic():
+                break
+        for part in parts[1:]:
+            self.bot.send_message(self.chat_id, part)
+        return html
@@ -0,0 +1,4 @@
+import os, sys
+
+# модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
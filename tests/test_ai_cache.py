@@ -0,0 +1,45 @@
+import threading
+import time
+
+from ai_cache import ResponseCache, make_key
+
+
+def test_single_flight_computes_once():
+    cache = ResponseCache()
+    release, calls, results = threading.Event(), [], []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return "ответ"
+
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    end = time.monotonic() + 5
+    while cache.summary()["coalesced"] < 7 and time.monotonic() < end:
+        time.sleep(0.005)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1 and results == ["ответ"] * 8
+    assert cache.get_or_compute("k", lambda: "другой") == "ответ"
+
+
+def test_failed_compute_is_not_cached():
+    cache = ResponseCache()
+    assert cache.get_or_compute("k", lambda: None) is None
+    assert cache.get_or_compute("k", lambda: "ok") == "ok"
+
+
+def test_disk_tier_survives_restart_and_ttl_expires(tmp_path):
+    path = str(tmp_path / "ai_cache.sqlite3")
+    ResponseCache(disk_path=path).put("a", "1")
+    ResponseCache(disk_path=path).put("b", "2", ttl=0.01)
+    time.sleep(0.02)
+    fresh = ResponseCache(disk_path=path)
+    assert fresh.get("a") == "1" and fresh.get("b") is None
+
+
+def test_key_normalizes_case_and_spaces():
+    assert make_key("recipe", "Блинчики  без сахара") == make_key("recipe", "блинчики без сахара ")
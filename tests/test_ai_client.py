@@ -0,0 +1,37 @@
+import time
+
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("openai")
+
+from ai_client import CircuitBreaker
+
+
+def _opened(**kw):
+    b = CircuitBreaker(threshold=1, cooldown=0.0, **kw)
+    b.failure()
+    return b
+
+
+def test_half_open_lets_one_probe_through():
+    b = _opened()
+    probe = b.allow()
+    assert probe and probe is not True
+    assert not b.allow()
+    b.success()
+    assert b.allow() is True
+
+
+def test_abandoned_probe_is_released():
+    b = _opened()
+    probe = b.allow()
+    b.release(probe)
+    assert b.allow()
+
+
+def test_stale_probe_times_out():
+    b = _opened(probe_timeout=0.01)
+    assert b.allow()
+    time.sleep(0.02)
+    assert b.allow()
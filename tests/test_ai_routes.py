@@ -0,0 +1,50 @@
+import ai_routes
+from ai_routes import FALLBACK_MODEL, PROBE_EVERY, RouteTable, load_config, with_detail
+
+
+def _table():
+    return RouteTable(load_config())
+
+
+def _degrade(t, feature, seconds):
+    for _ in range(ai_routes.MIN_SAMPLES):
+        t.observe(t.pick(feature), seconds)
+
+
+def test_slo_miss_switches_to_fallback_and_probes_primary():
+    t = _table()
+    _degrade(t, "plan_day", 60)
+    picks = [t.pick("plan_day").name for _ in range(PROBE_EVERY * 2)]
+    assert picks.count("primary") == 2 and picks.count("fallback") == PROBE_EVERY * 2 - 2
+    assert t.state()["plan_day"][0]
+
+
+def test_recovers_when_primary_is_fast_again():
+    t = _table()
+    _degrade(t, "list", 60)
+    for _ in range(ai_routes.WINDOW):
+        t.observe(t._routes["list"][0], 1.0)
+    assert t.pick("list").name == "primary" and not t.state()["list"][0]
+
+
+def test_fallback_is_cheaper_than_callers_hint():
+    t = _table()
+    for feature, hint in (("plan_day", 450), ("recipe", 700), ("list", 180)):
+        primary, fallback = t._routes[feature]
+        assert fallback.model == FALLBACK_MODEL
+        assert fallback.params(0.5, hint)[1] <= primary.params(0.5, hint)[1]
+    assert t._routes["plan_day"][1].params(0.5, 450)[1] < 450
+
+
+def test_no_slo_means_no_fallback():
+    t = _table()
+    _degrade(t, "pregen", 600)
+    assert t.pick("pregen").name == "primary"
+
+
+def test_with_detail_sets_image_detail_only():
+    msgs = [{"role": "user", "content": [{"type": "text", "text": "?"},
+                                         {"type": "image_url", "image_url": {"url": "data:", "detail": "auto"}}]}]
+    out = with_detail(msgs, "low")
+    assert out[0]["content"][1]["image_url"]["detail"] == "low"
+    assert msgs[0]["content"][1]["image_url"]["detail"] == "auto"
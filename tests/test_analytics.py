@@ -0,0 +1,35 @@
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from analytics import Analytics
+
+
+@pytest.fixture
+def stats(tmp_path):
+    s = Analytics(str(tmp_path / "analytics.sqlite3"), flush_interval=3600)
+    yield s
+    s.close()
+
+
+def test_wau_counts_each_user_once(stats):
+    today = date.today()
+    stats.rebuild([{"last_seen": (today - timedelta(days=3)).isoformat()}])
+    stats.active(1, (today - timedelta(days=3)).isoformat())
+    s = stats.summary()
+    assert s["dau"] == 1 and s["wau"] == 1
+
+
+def test_new_users_counted_by_local_day(stats, monkeypatch):
+    monkeypatch.setenv("TZ", "Etc/GMT-3")   # UTC+3
+    time.tzset()
+    try:
+        # 00:30 по местному — ещё вчера по UTC
+        local = datetime.combine(date.today(), datetime.min.time()).replace(minute=30).astimezone()
+        created = local.astimezone(timezone.utc).replace(tzinfo=None).isoformat()
+        stats.user_changed({}, {"created_at": created})
+        assert stats.summary()["new_today"] == 1
+    finally:
+        monkeypatch.undo()
+        time.tzset()
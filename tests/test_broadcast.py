@@ -0,0 +1,97 @@
+import time
+from types import SimpleNamespace
+
+from broadcast import BroadcastEngine
+
+ADMIN = 1
+
+
+class _ApiError(Exception):
+    def __init__(self, code, description="", retry_after=None):
+        super().__init__(description)
+        self.error_code = code
+        self.description = description
+        self.result_json = {"parameters": {"retry_after": retry_after}} if retry_after is not None else {}
+
+
+class _Bot:
+    def __init__(self, fail=None):
+        self.fail = fail or {}   # uid -> [исключения по очереди]
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kw):
+        errs = self.fail.get(chat_id)
+        if errs:
+            raise errs.pop(0)
+        self.sent.append(chat_id)
+        return SimpleNamespace(message_id=len(self.sent))
+
+    def edit_message_text(self, *a, **kw):
+        pass
+
+
+def _engine(bot, users, store, **kw):
+    users = sorted(users)
+    return BroadcastEngine(
+        bot,
+        load_state=lambda: store.get("state"),
+        save_state=lambda st: store.__setitem__("state", dict(st) if st else None),
+        list_users=kw.pop("list_users", lambda after, n: [u for u in users if after is None or u > after][:n]),
+        count_users=lambda: len(users),
+        mark_gone=lambda uid: store.setdefault("gone", []).append(uid),
+        log_done=lambda entry: store.setdefault("log", []).append(entry),
+        chunk=2, workers=2, rate=1000, progress_every=0,
+        **kw,
+    )
+
+
+def _wait(eng):
+    deadline = time.monotonic() + 5
+    while eng.running() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not eng.running()
+
+
+def test_429_is_retried_after_pause():
+    bot = _Bot(fail={11: [_ApiError(429, "Too Many Requests", retry_after=0.01)]})
+    store = {}
+    eng = _engine(bot, [10, 11, 12], store)
+    assert eng.start("hi", ADMIN)
+    _wait(eng)
+    users_sent = [u for u in bot.sent if u != ADMIN]
+    assert sorted(users_sent) == [10, 11, 12]
+    assert store["state"] is None and store["log"][0]["sent"] == 3
+
+
+def test_blocked_user_is_pruned():
+    bot = _Bot(fail={11: [_ApiError(403, "Forbidden: bot was blocked by the user")]})
+    store = {}
+    eng = _engine(bot, [10, 11], store)
+    eng.start("hi", ADMIN)
+    _wait(eng)
+    assert store["gone"] == [11] and store["log"][0]["pruned"] == 1
+
+
+def test_resume_continues_from_saved_cursor():
+    bot = _Bot()
+    store = {"state": {"id": "x", "text": "hi", "admin_chat": ADMIN, "progress_msg": None, "total": 4,
+                       "cursor": 11, "done": 2, "sent": 2, "failed": 0, "pruned": 0, "started_at": "t"}}
+    eng = _engine(bot, [10, 11, 12, 13], store)
+    assert eng.resume()
+    _wait(eng)
+    assert [u for u in bot.sent if u != ADMIN] == [12, 13]
+    assert store["log"][0]["sent"] == 4
+
+
+def test_crash_clears_state_and_tells_admin():
+    def boom(after, n):
+        raise RuntimeError("db gone")
+
+    bot = _Bot()
+    store = {}
+    eng = _engine(bot, [10], store, list_users=boom)
+    assert eng.start("hi", ADMIN)
+    _wait(eng)
+    assert store["state"] is None and "error" in store["log"][0]
+    assert bot.sent.count(ADMIN) == 2   # прогресс + сообщение об ошибке
+    assert eng.start("again", ADMIN) is True
@@ -0,0 +1,17 @@
+from diary import FoodDiary, parse_estimate
+
+
+def test_kcal_thousands_separator():
+    assert parse_estimate("Итого: 1 250 ккал, Б/Ж/У 80/40/120") == (1250.0, 80.0, 40.0, 120.0)
+
+
+def test_kcal_separate_numbers_not_joined():
+    assert parse_estimate("Итого: порций 3 45 ккал, Б/Ж/У 2/1/6") == (45.0, 2.0, 1.0, 6.0)
+
+
+def test_this_week_sums_entries(tmp_path):
+    d = FoodDiary(str(tmp_path / "diary.sqlite3"))
+    d.add(1, 500, 20, 10, 60)
+    d.add(1, 300, 10, 5, 40)
+    assert d.this_week(1) == (2, 800.0, 30.0, 15.0, 100.0)
+    assert d.this_week(2) == (0, 0.0, 0.0, 0.0, 0.0)
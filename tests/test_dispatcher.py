@@ -0,0 +1,64 @@
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from dispatcher import UpdateDispatcher, update_chat_id
+
+
+def _upd(i, chat):
+    return SimpleNamespace(update_id=i, message=SimpleNamespace(chat=SimpleNamespace(id=chat)))
+
+
+def test_updates_of_one_chat_run_in_order():
+    seen, lock = {}, threading.Lock()
+
+    def handler(u):
+        time.sleep(random.random() / 1000)
+        with lock:
+            seen.setdefault(u.message.chat.id, []).append(u.update_id)
+
+    d = UpdateDispatcher(handler, workers=4)
+    sent = {}
+    for i in range(400):
+        chat = random.randrange(10)
+        sent.setdefault(chat, []).append(i)
+        assert d.submit(_upd(i, chat))
+    d.stop(drain=True, timeout=10)
+    assert seen == sent
+
+
+def test_slow_chat_does_not_block_others():
+    release, done = threading.Event(), threading.Event()
+
+    def handler(u):
+        if u.message.chat.id == 1:
+            release.wait(5)
+        else:
+            done.set()
+
+    d = UpdateDispatcher(handler, workers=4)
+    d.submit(_upd(1, 1))
+    chat = next(c for c in range(2, 100) if hash(c) % 4 != hash(1) % 4)   # другой шард
+    d.submit(_upd(2, chat))
+    assert done.wait(2)
+    release.set()
+    d.stop()
+
+
+def test_full_queue_sheds_and_stop_rejects():
+    release = threading.Event()
+    d = UpdateDispatcher(lambda u: release.wait(5), workers=1, max_pending=2)
+    assert d.submit(_upd(1, 1)) and d.submit(_upd(2, 1))
+    assert not d.submit(_upd(3, 1))
+    release.set()
+    d.stop(drain=True, timeout=5)
+    assert not d.submit(_upd(4, 1))
+    assert d.stats()["shed"] == 2 and d.stats()["processed"] == 2
+
+
+def test_chat_id_of_callback_without_message():
+    cq = SimpleNamespace(message=None, from_user=SimpleNamespace(id=42))
+    upd = SimpleNamespace(update_id=9, message=None, edited_message=None, channel_post=None,
+                          edited_channel_post=None, callback_query=cq)
+    assert update_chat_id(upd) == 42
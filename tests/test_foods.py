@@ -0,0 +1,32 @@
+import pytest
+
+import foods
+
+
+@pytest.fixture(scope="module")
+def table():
+    return foods.FoodTable()
+
+
+def _grams(table, text):
+    res = foods.parse_list(table, text)
+    return res.rows[0][1] if res.rows else None
+
+
+@pytest.mark.parametrize("text, grams", [
+    ("банан 2", 240),       # число меньше 20 — штуки
+    ("банан 19", 19 * 120),
+    ("банан 20", 20),       # от 20 — граммы
+    ("банан 150", 150),
+    ("банан 2 шт", 240),
+    ("банан 20 шт", 2400),  # явные штуки — штуки при любом числе
+    ("банан 5 г", 5),
+    ("банан 150 г", 150),
+])
+def test_quantity_boundaries(table, text, grams):
+    assert _grams(table, text) == pytest.approx(grams)
+
+
+def test_no_quantity_left_to_model(table):
+    res = foods.parse_list(table, "банан")
+    assert not res.rows and res.unmatched == ["банан"]
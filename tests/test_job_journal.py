@@ -0,0 +1,30 @@
+from job_journal import JobJournal
+
+
+def test_unfinished_jobs_survive_reopen(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    j = JobJournal(path)
+    assert j.begin("1:10", "plan", 1, 1, 11, {"x": 1})
+    assert j.begin("1:12", "list", 1, 1, 13, {"x": 2})
+    j.start("1:10")
+    j.finish("1:12")
+
+    again = JobJournal(path)   # «рестарт»
+    entries = again.unfinished()
+    assert [(e.key, e.task, e.payload, e.attempts) for e in entries] == [("1:10", "plan", {"x": 1}, 1)]
+
+
+def test_same_key_is_not_queued_twice(tmp_path):
+    j = JobJournal(str(tmp_path / "jobs.sqlite3"))
+    assert j.begin("5:1", "list", 5, 5, 2, {})
+    assert not j.begin("5:1", "list", 5, 5, 2, {})
+    j.finish("5:1")
+    assert not j.begin("5:1", "list", 5, 5, 2, {})         # повторная доставка после выполнения
+
+
+def test_broken_payload_is_finished_not_replayed(tmp_path):
+    j = JobJournal(str(tmp_path / "jobs.sqlite3"))
+    j.begin("7:1", "list", 7, 7, 2, {})
+    j._conn.execute("UPDATE jobs SET payload = 'not json' WHERE key = '7:1'")
+    assert j.unfinished() == []
+    assert j.stats() == {"done": 1}
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+
+from jobs import BROADCAST, BUSY, DUPLICATE, OK, PREGEN, JobScheduler
+
+
+def _wait_for(cond, timeout=5):
+    end = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < end, "timeout"
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def gate():
+    """Задачи ждут gate, пока тест не отпустит; в конце отпускаем всё."""
+    ev = threading.Event()
+    yield ev
+    ev.set()
+
+
+def test_dedup_while_pending(gate):
+    s = JobScheduler(workers=1, per_user=1, reserved=0)
+    assert s.submit(1, gate.wait) == OK                      # занял единственного воркера
+    _wait_for(lambda: s.stats()["active"] == 1)
+    assert s.submit(1, lambda: None, dedup="plan") == OK
+    assert s.submit(1, lambda: None, dedup="plan") == DUPLICATE
+    assert s.submit(2, lambda: None, dedup="plan") == OK      # ключ — в пределах пользователя
+
+
+def test_backlog_limit(gate):
+    s = JobScheduler(workers=1, per_user=1, max_backlog=2, reserved=0)
+    s.submit(1, gate.wait)
+    _wait_for(lambda: s.stats()["active"] == 1)
+    assert [s.submit(2, lambda: None) for _ in range(3)] == [OK, OK, BUSY]
+
+
+def test_per_user_limit_and_round_robin(gate):
+    s = JobScheduler(workers=2, per_user=1, reserved=0)
+    order = []
+    for i in range(3):
+        s.submit("heavy", lambda i=i: (order.append(("heavy", i)), gate.wait()))
+    s.submit("light", lambda: order.append(("light", 0)))
+    # у heavy в работе максимум одна задача — второй воркер достаётся light
+    _wait_for(lambda: len(order) == 2)
+    assert sorted(order) == [("heavy", 0), ("light", 0)]
+    gate.set()
+    _wait_for(lambda: len(order) == 4)
+
+
+def test_cancel_drops_pending_and_calls_on_cancel(gate):
+    s = JobScheduler(workers=1, per_user=1, reserved=0)
+    s.submit(1, gate.wait)
+    _wait_for(lambda: s.stats()["active"] == 1)
+    cancelled, ran = [], []
+    s.submit(1, lambda: ran.append(1), on_cancel=lambda: cancelled.append(1), dedup="x")
+    assert s.cancel(1) == 1 and cancelled == [1]
+    assert s.submit(1, lambda: None, dedup="x") == OK         # ключ освобождён
+    gate.set()
+    _wait_for(lambda: s.stats()["backlog"] == 0 and s.stats()["active"] == 0)
+    assert ran == []
+
+
+def test_interactive_runs_before_queued_background(gate):
+    s = JobScheduler(workers=1, per_user=5, reserved=0)
+    s.submit(None, gate.wait)
+    _wait_for(lambda: s.stats()["active"] == 1)
+    order = []
+    s.submit(None, lambda: order.append("pregen"), prio=PREGEN)
+    s.submit(None, lambda: order.append("broadcast"), prio=BROADCAST)
+    s.submit(1, lambda: order.append("user"))
+    gate.set()
+    _wait_for(lambda: len(order) == 3)
+    assert order == ["user", "broadcast", "pregen"]
+
+
+def test_background_never_takes_reserved_workers(gate):
+    s = JobScheduler(workers=3, per_user=1, reserved=1)
+    for _ in range(4):
+        s.submit(None, gate.wait, prio=BROADCAST)
+    _wait_for(lambda: s.stats()["active"] == 2)
+    time.sleep(0.05)
+    assert s.stats()["active"] == 2                          # третий воркер держится для юзеров
+    done = threading.Event()
+    s.submit(1, done.set)
+    assert done.wait(2)
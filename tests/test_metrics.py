@@ -0,0 +1,26 @@
+import json
+
+import week_plan
+from metrics import log, trace
+
+
+def _records(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith("{")]
+
+
+def test_log_error_formats_strings_as_is(capsys):
+    log("e1", error="not cached")
+    log("e2", error=ValueError("bad"))
+    r = _records(capsys)
+    assert r[0]["error"] == "not cached"
+    assert r[1]["error"] == "ValueError: bad"
+
+
+def test_trace_reaches_week_plan_pool(capsys):
+    def generate(prompt):
+        raise RuntimeError("boom")
+
+    with trace("t-week"):
+        week_plan.build_week({"kcal": 2000}, "", "", generate, lambda i, t: None, prompt_fn=lambda i, *a: str(i))
+    days = [r for r in _records(capsys) if r["event"] == "plan_day"]
+    assert len(days) == 7 and {r["trace"] for r in days} == {"t-week"}
@@ -0,0 +1,50 @@
+import threading
+from types import SimpleNamespace
+
+from dispatcher import UpdateDispatcher
+from polling import LongPoller
+
+
+def _upd(i, chat):
+    return SimpleNamespace(update_id=i, message=SimpleNamespace(chat=SimpleNamespace(id=chat)))
+
+
+class _Bot:
+    """getUpdates: отдаёт всё с update_id >= offset; после batches выборок — останавливает поллер."""
+
+    def __init__(self, updates):
+        self.updates = updates
+        self.offsets = []
+        self.poller = None
+
+    def get_updates(self, offset=None, limit=100, timeout=0, **kw):
+        self.offsets.append(offset)
+        if len(self.offsets) >= 3:
+            self.poller.stop()
+        return [u for u in self.updates if offset is None or u.update_id >= offset][:limit]
+
+
+def test_unfinished_update_is_not_acked_on_shutdown():
+    release = threading.Event()
+    handled = []
+
+    def handler(u):
+        if u.update_id == 2:
+            release.wait(5)   # «зависший» апдейт
+        handled.append(u.update_id)
+
+    bot = _Bot([_upd(1, 10), _upd(2, 20), _upd(3, 30)])
+    disp = UpdateDispatcher(handler, workers=3)
+    poller = bot.poller = LongPoller(bot, disp, timeout=0)
+    poller.run(drain_timeout=0.2)
+    assert bot.offsets[-1] == 2                 # подтверждено только до зависшего
+    assert sorted(handled) == [1, 3]            # повторно выданные 1 и 3 не обработаны дважды
+    release.set()
+
+
+def test_everything_acked_after_clean_drain():
+    bot = _Bot([_upd(5, 1), _upd(6, 1)])
+    disp = UpdateDispatcher(lambda u: None, workers=2)
+    poller = bot.poller = LongPoller(bot, disp, timeout=0)
+    poller.run(drain_timeout=2)
+    assert bot.offsets[-1] == 7
@@ -0,0 +1,38 @@
+import json
+
+import prompts
+
+RECIPE = {"t": "Омлет", "i": [["яйца", "2 шт"], ["молоко", "50 мл"]], "s": ["Взбить", "Жарить 5 минут"],
+          "k": 250, "p": 15, "f": 18, "c": 4, "tip": "молоко — на воду"}
+
+
+def test_parse_partial_every_prefix():
+    raw = json.dumps(RECIPE, ensure_ascii=False)
+    for i in range(len(raw) + 1):
+        data = prompts.parse_partial(raw[:i])
+        assert data is None or isinstance(data, dict)
+        prompts.render_recipe(data)   # частичный ответ не роняет рендер
+    assert prompts.parse_partial(raw) == RECIPE
+
+
+def test_parse_partial_closes_open_string_and_brackets():
+    assert prompts.parse_partial('```json\n{"t":"Омл') == {"t": "Омл"}
+    assert prompts.parse_partial('{"i":[["яйца","2') == {"i": [["яйца", "2"]]}
+
+
+def test_list_rows_partial_skips_unfinished_row():
+    raw = '{"items":[{"n":"рис","g":80,"k":280,"p":6,"f":1,"c":62},{"n":"масло","g":10,"k":90'
+    rows = prompts.list_rows(prompts.parse_partial(raw), partial=True)
+    assert [r[0] for r in rows] == ["рис"]
+    assert len(prompts.list_rows(prompts.parse_partial(raw))) == 2
+
+
+def test_list_rows_escape_model_names():
+    rows = prompts.list_rows({"items": [{"n": "<b>сыр</b>", "g": 30, "k": 110, "p": 7, "f": 9, "c": 0}]})
+    assert rows[0][0] == "&lt;b&gt;сыр&lt;/b&gt;"
+
+
+def test_render_day_sums_meals():
+    html = prompts.render_day(0, {"m": [{"n": "Завтрак", "d": "каша", "k": 400, "p": 20, "f": 10, "c": 60},
+                                        {"n": "Обед", "d": "курица", "k": 600, "p": 50, "f": 20, "c": 50}]})
+    assert html.splitlines()[-1] == "Итого за день: 1000 ккал, Б/Ж/У 70/30/110"
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+from routing import Router
+
+
+class _Bot:
+    def message_handler(self, **kw):
+        return lambda fn: fn
+
+
+def _msg(text, uid=1):
+    return SimpleNamespace(content_type="text", text=text, from_user=SimpleNamespace(id=uid))
+
+
+def _router(steps):
+    r = Router(_Bot(), steps.get, reset_step=lambda uid: steps.pop(uid, None))
+    calls = []
+
+    @r.state("recipe_q")
+    def recipe_q(m):
+        calls.append("recipe_q")
+
+    @r.text("📊 Мой дневник", menu=True)
+    def diary(m):
+        calls.append("diary")
+
+    @r.text("🍽 Рецепт по запросу")
+    def recipe(m):
+        calls.append("recipe")
+
+    return r, calls
+
+
+def test_menu_button_beats_stale_step_and_resets_it():
+    steps = {1: "recipe_q"}
+    r, calls = _router(steps)
+    r.resolve(_msg("📊 Мой дневник"))(_msg("📊 Мой дневник"))
+    assert calls == ["diary"] and 1 not in steps
+    assert r.resolve(_msg("борщ")) is None
+
+
+def test_earlier_state_still_beats_later_plain_button():
+    steps = {1: "recipe_q"}
+    r, calls = _router(steps)
+    r.resolve(_msg("🍽 Рецепт по запросу"))(_msg("🍽 Рецепт по запросу"))
+    assert calls == ["recipe_q"]
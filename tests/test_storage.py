@@ -0,0 +1,47 @@
+import sqlite3
+
+import pytest
+
+from storage import Storage
+
+
+def test_writes_survive_eviction_with_small_cache(tmp_path):
+    path = str(tmp_path / "db.sqlite3")
+    db = Storage(path, flush_interval=3600, cache_size=3)
+    for i in range(100, 110):
+        db.set_user(i, {"n": i})
+    db.flush()
+    db.set_user(200, {"n": 200})
+    db.close()
+    rows = dict(sqlite3.connect(path).execute("SELECT uid, data FROM users"))
+    assert sorted(rows) == [str(i) for i in range(100, 110)] + ["200"]
+    assert Storage(path, flush_interval=3600).get_user(109) == {"n": 109}
+
+
+def test_clean_entries_evicted_after_flush(tmp_path):
+    db = Storage(str(tmp_path / "db.sqlite3"), flush_interval=3600, cache_size=3)
+    for i in range(10):
+        db.set_user(i, {"n": i})
+    db.flush()
+    assert len(db._cache) == 3
+    assert db.get_user(0) == {"n": 0}
+    db.close()
+
+
+def test_reading_unknown_users_does_not_fill_cache(tmp_path):
+    db = Storage(str(tmp_path / "db.sqlite3"), flush_interval=3600)
+    for i in range(50):
+        assert db.get_user(1000 + i) == {}
+    assert len(db._cache) == 0
+    db.set_user(7, {"n": 7})
+    assert db.get_user(7) == {"n": 7}
+
+
+def test_close_closes_connection(tmp_path):
+    db = Storage(str(tmp_path / "db.sqlite3"), flush_interval=3600)
+    db.set_user(1, {"n": 1})
+    db.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        db._conn.execute("SELECT 1")
+    conn = sqlite3.connect(str(tmp_path / "db.sqlite3"))
+    assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 1
@@ -0,0 +1,42 @@
+import re
+from types import SimpleNamespace
+
+from streaming import RenderedEditor, split_html
+
+
+def _balanced(part):
+    return part.count("<b>") == part.count("</b>") and not re.search(r"<[^>]*$|&\w*$", part)
+
+
+def test_split_html_never_cuts_inside_tags():
+    html = "\n".join(f"• <b>продукт {i} &amp; соус</b> — {'x' * (i % 7)}" for i in range(400))
+    parts = split_html(html, limit=500)
+    assert len(parts) > 1
+    assert all(len(p) <= 500 and _balanced(p) for p in parts)
+    assert "\n".join(parts) == html
+
+
+def test_split_html_long_bold_line_cut_outside_tag():
+    html = "хвост " * 50 + "<b>" + "слово " * 100 + "</b>"
+    parts = split_html(html, limit=700)
+    assert all(_balanced(p) for p in parts)
+
+
+class _Bot:
+    def __init__(self):
+        self.edits, self.sent = [], []
+
+    def edit_message_text(self, text, chat_id, message_id, **kw):
+        self.edits.append(text)
+
+    def send_message(self, chat_id, text, **kw):
+        self.sent.append(text)
+        return SimpleNamespace(message_id=2)
+
+
+def test_rendered_editor_finish_sends_balanced_parts():
+    bot = _Bot()
+    ed = RenderedEditor(bot, 1, 1, render=lambda raw, done: " ".join(f"<b>{w} {w}</b>" for w in raw.split()))
+    ed.feed(" ".join(f"слово{i}" for i in range(600)))
+    assert ed.finish()
+    assert bot.sent and all(_balanced(p) for p in [bot.edits[-1]] + bot.sent)
@@ -0,0 +1,51 @@
+import threading
+
+import week_plan
+
+
+def _week(totals):
+    return "\n\n".join(f"<b>{d}</b>\n- Обед: ...\nИтого за день: {k} ккал, Б/Ж/У 100/60/200"
+                       for d, k in zip(week_plan.DAYS, totals))
+
+
+def test_valid_week_needs_seven_days_in_tolerance():
+    assert week_plan.valid_week(_week([2000] * 7), 2000)
+    assert not week_plan.valid_week(_week([2000] * 6), 2000)
+    assert not week_plan.valid_week(_week([2000] * 6 + [2600]), 2000)
+
+
+def _day(idx, kcal):
+    return f"<b>{week_plan.DAYS[idx]}</b>\n- Обед: ...\nИтого за день: {kcal} ккал, Б/Ж/У 100/60/200"
+
+
+def test_days_are_delivered_as_they_complete():
+    monday_go = threading.Event()
+    order = []
+
+    def generate(prompt):
+        idx = int(prompt)
+        if idx == 0:
+            monday_go.wait(5)
+        return _day(idx, 2000)
+
+    def on_day(idx, text):
+        order.append(idx)
+        if len(order) == 6:
+            monday_go.set()   # понедельник отпускаем только когда остальные уже отданы
+
+    days = week_plan.build_week({"kcal": 2000}, "", "", generate, on_day, prompt_fn=lambda i, *a: str(i))
+    assert order[-1] == 0 and sorted(order) == list(range(7))
+    assert all(days) and week_plan.APPROX_NOTE not in days[0]
+
+
+def test_out_of_range_day_is_marked_approximate():
+    calls = []
+
+    def generate(prompt):
+        calls.append(prompt)
+        return _day(int(prompt), 3000 if prompt == "2" else 2000)
+
+    days = week_plan.build_week({"kcal": 2000}, "", "", generate, lambda i, t: None, prompt_fn=lambda i, *a: str(i))
+    assert calls.count("2") == week_plan.DAY_ATTEMPTS
+    assert days[2].endswith(week_plan.APPROX_NOTE) and not week_plan.valid_day(days[2], 2000)
+    assert week_plan.APPROX_NOTE not in days[1]
@@ -0,0 +1,90 @@
+# =======================
+# Telegram HTTP — общий keep-alive пул для telebot и скачивания файлов
+# =======================
+import time, threading
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import timed
+
+MAX_FILE_BYTES = 20 * 1024 * 1024   # лимит Bot API на скачивание
+FILE_PATH_TTL = 50 * 60             # file_path действителен не меньше часа
+CHUNK = 64 * 1024
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+def make_session(pool_size):
+    """requests.Session с пулом на pool_size соединений к хосту (по одному на поток)."""
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=False, max_retries=0)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+class FileFetcher:
+    """
+    Скачивание файлов Telegram через общую сессию: getFile кэшируется по file_unique_id,
+    тело читается потоком в буфер не больше max_bytes.
+    """
+
+    def __init__(self, bot, session, file_url, max_bytes=MAX_FILE_BYTES, cache_size=10000, timeout=(5, 20)):
+        self.bot = bot
+        self.session = session
+        self.file_url = file_url        # file_path -> URL
+        self.max_bytes = max_bytes
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self._paths = OrderedDict()     # file_unique_id -> (file_path, expires)
+        self._lock = threading.Lock()
+
+    def file_path(self, file_id, unique_id=None):
+        if unique_id:
+            with self._lock:
+                hit = self._paths.get(unique_id)
+                if hit and hit[1] > time.monotonic():
+                    self._paths.move_to_end(unique_id)
+                    return hit[0]
+        f = self.bot.get_file(file_id)
+        if f.file_size and f.file_size > self.max_bytes:
+            raise FileTooLarge(f"{f.file_size} bytes")
+        if unique_id:
+            with self._lock:
+                self._paths[unique_id] = (f.file_path, time.monotonic() + FILE_PATH_TTL)
+                while len(self._paths) > self.cache_size:
+                    self._paths.popitem(last=False)
+        return f.file_path
+
+    def _forget(self, unique_id):
+        with self._lock:
+            self._paths.pop(unique_id, None)
+
+    def download(self, file_id, unique_id=None):
+        for attempt in range(2):
+            path = self.file_path(file_id, unique_id)
+            try:
+                return self._fetch(self.file_url(path))
+            except requests.HTTPError as e:
+                # file_path из кэша мог протухнуть — один раз берём свежий
+                if attempt or not unique_id or e.response is None or e.response.status_code not in (400, 404):
+                    raise
+                self._forget(unique_id)
+
+    def _fetch(self, url):
+        with timed("tg_download"):
+            with self.session.get(url, stream=True, timeout=self.timeout) as r:
+                r.raise_for_status()
+                size = int(r.headers.get("Content-Length") or 0)
+                if size > self.max_bytes:
+                    raise FileTooLarge(f"{size} bytes")
+                buf = bytearray()
+                for chunk in r.iter_content(CHUNK):
+                    buf += chunk
+                    if len(buf) > self.max_bytes:
+                        raise FileTooLarge(f"> {self.max_bytes} bytes")
+                return bytes(buf)
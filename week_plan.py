@@ -0,0 +1,102 @@
+# =======================
+# Week plan — параллельная генерация по дням с проверкой и ретраем дня
+# =======================
+import re, threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import log, traced
+
+DAYS = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+# Основной белок дня — чтобы параллельно сгенерированные дни не повторялись
+DAY_FOCUS = ["курица", "рыба", "говядина", "индейка", "яйца и творог", "бобовые", "морепродукты"]
+
+KCAL_TOLERANCE = 0.15
+DAY_ATTEMPTS = 3
+APPROX_NOTE = "⚠️ Калорийность дня заметно отличается от цели — считай его примерным."
+
+_POOL = ThreadPoolExecutor(max_workers=14, thread_name_prefix="plan-day")
+_TOTAL_RE = re.compile(r"Итого[^\n]*?(\d[\d\s]{2,5})\s*ккал", re.IGNORECASE)
+
+
+def day_prompt(day_idx, targets, sex, goal):
+    t = targets
+    return (
+        "Ты профессиональный нутрициолог.\n"
+        f"Составь меню на один день ({DAYS[day_idx]}) в виде:\n"
+        f"<b>{DAYS[day_idx]}</b>\n- Завтрак: ... (ккал, Б/Ж/У)\n- Перекус: ...\n- Обед: ...\n- Перекус: ...\n- Ужин: ...\n"
+        "Итого за день: XXXX ккал, Б/Ж/У xx/xx/xx\n\n"
+        f"Цель на день: {t['kcal']} ккал, Б {t['protein']} г, Ж {t['fat']} г, У {t['carbs']} г (±5%).\n"
+        f"Пол — {sex}, цель — {goal}. Основной источник белка в этот день — {DAY_FOCUS[day_idx]}.\n"
+        "3–5 приёмов пищи, граммовки у каждого продукта, без вступления и пояснений."
+    )
+
+
+def day_total_kcal(text):
+    m = _TOTAL_RE.search(text or "")
+    return int(re.sub(r"\s", "", m.group(1))) if m else None
+
+
+def valid_day(text, target_kcal):
+    """День принят, если есть «Итого» и калорийность в пределах допуска."""
+    total = day_total_kcal(text)
+    return total is not None and abs(total - target_kcal) <= target_kcal * KCAL_TOLERANCE
+
+
+def valid_week(text, target_kcal):
+    """Неделя одним текстом: ровно 7 строк «Итого», каждая в допуске."""
+    totals = [int(re.sub(r"\s", "", x)) for x in _TOTAL_RE.findall(text or "")]
+    return len(totals) == len(DAYS) and all(abs(x - target_kcal) <= target_kcal * KCAL_TOLERANCE for x in totals)
+
+
+def build_week(targets, sex, goal, generate, on_day, prompt_fn=day_prompt):
+    """
+    generate(prompt) -> str | None — один запрос к модели;
+    prompt = prompt_fn(idx, targets, sex, goal) (по умолчанию текстовый day_prompt).
+    on_day(idx, text | None) вызывается, как только готов этот день, — в порядке готовности,
+    а не дней недели: медленный понедельник не держит остальные (None — день не удалось
+    сгенерировать). День, не попавший в допуск за DAY_ATTEMPTS попыток, — ближайший
+    к цели вариант с пометкой APPROX_NOTE.
+    Возвращает список текстов дней по порядку.
+    """
+    results = [None] * len(DAYS)
+    left = [len(DAYS)]
+    lock = threading.Lock()
+    finished = threading.Event()
+
+    def one_day(idx):
+        prompt = prompt_fn(idx, targets, sex, goal)
+        best, best_err = None, None
+        for _ in range(DAY_ATTEMPTS):
+            text = generate(prompt)
+            if not text:
+                continue
+            if valid_day(text, targets["kcal"]):
+                return text
+            total = day_total_kcal(text)
+            err = abs(total - targets["kcal"]) if total is not None else float("inf")
+            if best is None or err < best_err:
+                best, best_err = text, err
+        return best + "\n" + APPROX_NOTE if best else None
+
+    def done(idx, fut):
+        try:
+            text = fut.result()
+        except Exception as e:
+            log("plan_day", error=e, day=idx)
+            text = None
+        with lock:
+            results[idx] = text
+            try:
+                on_day(idx, text)
+            except Exception as e:
+                log("plan_on_day", error=e, day=idx)
+            left[0] -= 1
+            if not left[0]:
+                finished.set()
+
+    # trace id запроса — в потоки пула: логи дней связаны с апдейтом
+    one_day, done = traced(one_day), traced(done)
+    for idx in range(len(DAYS)):
+        _POOL.submit(one_day, idx).add_done_callback(lambda f, i=idx: done(i, f))
+    finished.wait()
+    return results